@@ -0,0 +1,193 @@
+import asyncio
+import dataclasses
+import time
+from collections.abc import Callable, Coroutine, Sequence
+from contextvars import ContextVar
+from typing import Any
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.dependencies.utils import get_flat_dependant
+from fastapi.routing import APIRoute
+
+from app.data.dbs.postgres.models import Model
+from app.infra.core.context import TenantContext
+from app.infra.core.response_cache import (
+    CachedResponse,
+    ResponseCache,
+    get_cache_key,
+    response_cache,
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class CachePolicy:
+    ttl: float
+    # Tables read by the endpoint
+    tags: tuple[str, ...]
+    # Lowercased names of the request headers the response depends on
+    vary: tuple[str, ...]
+
+
+@dataclasses.dataclass
+class _CacheLookup:
+    key: str
+    versions: tuple[int, ...]
+    hit: bool = False
+
+
+# Lookup of the request being handled, done once its dependencies are solved
+_cache_lookup: ContextVar[_CacheLookup | None] = ContextVar(
+    "cache_lookup", default=None
+)
+
+
+def cache_response[**P, R](
+    *,
+    ttl: float,
+    models: Sequence[type[Model]] = (),
+    vary: Sequence[str] = (),
+) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """
+    Caches the responses of a GET endpoint per tenant, for `ttl` seconds at most.
+
+    `models` are the models the endpoint reads: a commit changing one of them in
+    a tenant invalidates the responses of the tenant. Responses are keyed on the
+    caller (its `Authorization` header and subject ID), the path, the query
+    parameters and the `vary` request headers. An endpoint with security
+    dependencies has to list the headers it varies on, `Authorization` at least.
+    """
+    policy = CachePolicy(
+        ttl=ttl,
+        tags=tuple(sorted({model.__tablename__ for model in models})),
+        vary=tuple(header.lower() for header in vary),
+    )
+
+    def decorator(f: Callable[P, R]) -> Callable[P, R]:
+        f._cache_policy = policy  # type: ignore[attr-defined]
+        return f
+
+    return decorator
+
+
+def is_cacheable(response: Response, *, max_body_bytes: int) -> bool:
+    if response.status_code != 200 or response.background is not None:
+        return False
+    # Streaming and file responses have no body
+    body = getattr(response, "body", None)
+    if not isinstance(body, bytes) or len(body) > max_body_bytes:
+        return False
+    if "set-cookie" in response.headers:
+        return False
+    cache_control = response.headers.get("cache-control", "").lower()
+    return "no-store" not in cache_control and "private" not in cache_control
+
+
+class CachedAPIRoute(APIRoute):
+    """
+    A subclass of `APIRoute` that serves the endpoints
+    decorated with `@cache_response` from the response cache.
+
+    Only the GET requests of a tenant are cached, and only their successful
+    responses with a body, no cookie and no `Cache-Control: no-store/private`.
+    The cache is read in place of the endpoint call, once the dependencies
+    (authentication, rate limits...) of the request are solved.
+    """
+
+    cache_policy: CachePolicy | None
+    response_cache: ResponseCache = response_cache
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        self.cache_policy = getattr(endpoint, "_cache_policy", None)
+        super().__init__(path, endpoint, **kwargs)
+
+        if (
+            self.cache_policy is not None
+            and not self.cache_policy.vary
+            and get_flat_dependant(self.dependant).security_requirements
+        ):
+            raise ValueError(
+                f"The cached route {path} is authenticated: "
+                "`@cache_response` needs the headers it varies on"
+            )
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        if self.cache_policy is None:
+            return super().get_route_handler()
+        policy = self.cache_policy
+
+        # Before the handler is built, which checks if the call is a coroutine
+        endpoint_call = self.dependant.call
+        if endpoint_call is not None and not getattr(endpoint_call, "_cached", False):
+            self.dependant.call = self.wrap_endpoint_call(endpoint_call)
+        handler = super().get_route_handler()
+
+        async def cached_handler(request: Request) -> Response:
+            tenant_context = TenantContext.get_tenant_context(request)
+            if (
+                request.method != "GET"
+                or tenant_context is None
+                or (tenant_id := tenant_context.tenant_id) is None
+            ):
+                return await handler(request)
+
+            # Taken before the endpoint runs: a change committed meanwhile
+            # outdates the response right away
+            versions = await self.response_cache.get_versions(tenant_id, policy.tags)
+            if versions is None:
+                return await handler(request)
+
+            key = get_cache_key(
+                tenant_id,
+                request.scope["path"],
+                request.scope["query_string"].decode("latin-1"),
+                [
+                    tenant_context.sub_id or "",
+                    request.headers.get("authorization", ""),
+                    *(request.headers.get(header, "") for header in policy.vary),
+                ],
+            )
+            lookup = _CacheLookup(key=key, versions=versions)
+            token = _cache_lookup.set(lookup)
+            try:
+                response = await handler(request)
+            finally:
+                _cache_lookup.reset(token)
+
+            if not lookup.hit and is_cacheable(
+                response, max_body_bytes=self.response_cache.max_body_bytes
+            ):
+                self.response_cache.put(
+                    key,
+                    CachedResponse(
+                        status_code=response.status_code,
+                        headers=list(response.raw_headers),
+                        body=bytes(response.body),
+                        versions=versions,
+                        expires_at=time.time() + policy.ttl,
+                    ),
+                )
+            return response
+
+        return cached_handler
+
+    def wrap_endpoint_call(
+        self, call: Callable[..., Any]
+    ) -> Callable[..., Coroutine[Any, Any, Any]]:
+        is_coroutine = asyncio.iscoroutinefunction(call)
+
+        async def cached_call(**values: Any) -> Any:
+            if (lookup := _cache_lookup.get()) is not None:
+                cached = await self.response_cache.get(lookup.key, lookup.versions)
+                if cached is not None:
+                    lookup.hit = True
+                    return cached.to_response()
+            if is_coroutine:
+                return await call(**values)
+            return await run_in_threadpool(call, **values)
+
+        cached_call._cached = True  # type: ignore[attr-defined]
+        return cached_call
+
+
+__all__ = ["cache_response", "CachedAPIRoute"]
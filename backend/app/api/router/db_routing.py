@@ -1,14 +1,20 @@
 # Based on: https://github.com/polarsource/polar/blob/main/server/polar/kit/routing.py
 
-from collections.abc import Callable
-
-# from functools import wraps
+import inspect
+from collections.abc import Awaitable, Callable
+from functools import wraps
 from typing import Any, ParamSpec, TypeVar
 
 from fastapi import APIRouter as _APIRouter
 from fastapi.routing import APIRoute
 
-# from app.infra.core.postgres import AsyncSession
+from app.data.dbs.postgres.postgres import holds_connection
+from app.infra.core.postgres import AsyncSession
+
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+_P = ParamSpec("_P")
+_T = TypeVar("_T")
 
 
 class AutoCommitAPIRoute(APIRoute):
@@ -18,13 +24,48 @@ class AutoCommitAPIRoute(APIRoute):
 
     It allows to directly return ORM objects from the endpoint
     without having to call `session.commit()` before returning.
+
+    The commit happens before the response serialization, so the connection
+    is released as soon as possible.
+
+    Routes only serving safe methods (GET, HEAD, OPTIONS) are `read_only`:
+    their session runs a `READ ONLY` transaction, on the read replica
+    if there is one, and is never committed.
     """
 
-    pass
+    read_only: bool
 
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        methods = {method.upper() for method in kwargs.get("methods") or ("GET",)}
+        self.read_only = methods <= SAFE_METHODS
 
-_P = ParamSpec("_P")
-_T = TypeVar("_T")
+        # `include_router` re-creates the routes from already wrapped endpoints
+        is_wrapped = getattr(endpoint, "_auto_commit", False)
+        if not (self.read_only or is_wrapped) and inspect.iscoroutinefunction(endpoint):
+            endpoint = self.wrap_endpoint(endpoint)
+
+        super().__init__(path, endpoint, **kwargs)
+
+    def wrap_endpoint(
+        self, f: Callable[_P, Awaitable[_T]]
+    ) -> Callable[_P, Awaitable[_T]]:
+        @wraps(f)
+        async def wrapped_endpoint(*args: _P.args, **kwargs: _P.kwargs) -> _T:
+            session: AsyncSession | None = None
+            for arg in (*args, *kwargs.values()):
+                if isinstance(arg, AsyncSession):
+                    session = arg
+                    break
+
+            retval = await f(*args, **kwargs)
+
+            if session is not None and holds_connection(session):
+                await session.commit()
+
+            return retval
+
+        wrapped_endpoint._auto_commit = True  # type: ignore[attr-defined]
+        return wrapped_endpoint
 
 
 def _inherit_signature_from(
@@ -1,11 +1,12 @@
 from .auth_routing import DocumentedAuthSubjectAPIRoute
+from .cache_routing import CachedAPIRoute, cache_response
 from .db_routing import AutoCommitAPIRoute, get_api_router_class
 
 
-class APIRoute(AutoCommitAPIRoute, DocumentedAuthSubjectAPIRoute):
+class APIRoute(CachedAPIRoute, AutoCommitAPIRoute, DocumentedAuthSubjectAPIRoute):
     pass
 
 
 APIRouter = get_api_router_class(APIRoute)
 
-__all__ = ["APIRouter"]
+__all__ = ["APIRouter", "cache_response"]
@@ -1,3 +1,4 @@
+import asyncio
 import contextlib
 from collections.abc import AsyncGenerator
 from typing import TypedDict
@@ -8,11 +9,20 @@ from fastapi import FastAPI
 from app.api.api import router
 from app.api.openapi import OPENAPI_PARAMETERS
 from app.infra.config import settings
-from app.infra.core.cors import configure_cors
+from app.infra.core.cors import configure_cors, tenant_cors_configs
 
 # from app.infra.core.db import lifespan
 from app.infra.core.exceptions import add_exception_handlers
 from app.infra.core.middleware import add_middlewares
+from app.infra.core.postgres import (
+    TenantEngineRegistry,
+    replica_router,
+    tenant_engines,
+)
+from app.infra.core.redis import redis
+from app.infra.core.response_cache import response_cache
+from app.infra.core.tenant_hosts import tenant_host_index
+from app.infra.core.tenant_resolution import tenant_resolver
 
 # from app.providers.webhook.webhooks import app as webhook_app
 # from app.infra.core.sentry import configure_sentry
@@ -52,12 +62,35 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[GlobalResourcesState, None]:
     log.info(f"Starting {settings.APP_NAME} API")
 
     async with worker_lifespan() as arq_pool:
+        background_tasks = [
+            asyncio.create_task(tenant_host_index.run(redis)),
+            asyncio.create_task(tenant_resolver.run(redis)),
+            asyncio.create_task(replica_router.run()),
+            asyncio.create_task(tenant_cors_configs.run(redis)),
+            asyncio.create_task(response_cache.run(redis)),
+        ]
+        # Idle tenant pools are closed, not only evicted by the busy tenants
+        for engines in (
+            tenant_engines,
+            *(replica.engines for replica in replica_router.replicas),
+        ):
+            if isinstance(engines, TenantEngineRegistry):
+                background_tasks.append(
+                    asyncio.create_task(engines.run_idle_eviction())
+                )
         log.info(f"{settings.APP_NAME} API started")
 
         yield {
             "arq_pool": arq_pool,
         }
 
+        for background_task in background_tasks:
+            background_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await background_task
+        await tenant_engines.dispose()
+        await replica_router.dispose()
+
         log.info(f"{settings.APP_NAME} API stopped")
 
 
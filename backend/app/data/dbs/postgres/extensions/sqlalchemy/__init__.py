@@ -1,8 +1,11 @@
 from . import sql
+from .bulk import bulk_copy, bulk_upsert
 from .types import IntEnum, StringEnum
 
 __all__ = [
     "IntEnum",
     "StringEnum",
+    "bulk_copy",
+    "bulk_upsert",
     "sql",
 ]
@@ -0,0 +1,190 @@
+import itertools
+from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
+from typing import Any
+
+from sqlalchemy import Column, ColumnDefault, Table
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import DeclarativeBase
+
+from . import sql
+
+Row = Mapping[str, Any]
+
+# Bind parameters of a statement are numbered with an int16 in the protocol
+POSTGRES_MAX_PARAMETERS = 32767
+
+
+def _copy_columns(table: Table, first_row: Row) -> list[Column[Any]]:
+    if unknown_keys := first_row.keys() - table.columns.keys():
+        raise ValueError(f"Unknown columns for {table.name}: {sorted(unknown_keys)}")
+    # Columns left out are filled by Postgres (server default or NULL)
+    return [
+        column
+        for column in table.columns
+        if column.key in first_row or column.default is not None
+    ]
+
+
+def _column_default(column: Column[Any]) -> Callable[[], Any]:
+    default = column.default
+    if default is None:
+        return lambda: None
+    if default.is_callable:
+        return lambda: default.arg(None)  # type: ignore[attr-defined]
+    if default.is_scalar:
+        return lambda: default.arg  # type: ignore[attr-defined]
+    raise ValueError(f"COPY doesn't support the default of {column}")
+
+
+def _onupdate_value(column: Column[Any]) -> Any:
+    onupdate = column.onupdate
+    if not isinstance(onupdate, ColumnDefault):
+        raise ValueError(f"Upserts don't support the onupdate of {column}")
+    if onupdate.is_callable:
+        return onupdate.arg(None)
+    # Scalars are bound, SQL expressions (e.g. `func.now()`) are rendered inline
+    return onupdate.arg
+
+
+async def bulk_copy(
+    session: AsyncSession,
+    model: type[DeclarativeBase],
+    rows: Iterable[Row],
+) -> int:
+    """
+    Inserts `rows` (column key -> value) into the table of `model` with
+    `COPY ... FROM STDIN (FORMAT binary)`, in the current transaction of the session.
+
+    Missing values get the Python side column defaults (e.g. `id` and
+    `created_at` of `RecordModel`), and values go through the bind processing of
+    the column types, so `StringEnum`/`IntEnum` members and JSONB documents are
+    converted just as with an INSERT. Rows are streamed to Postgres: `rows` may be
+    a generator.
+
+    The ORM is bypassed: no instances, no identity map, no `before_insert`
+    events, no flush. The table is added to `session.info["copied_tables"]`
+    instead, for the commit hooks (e.g. the invalidation of the response
+    cache). Returns the number of copied rows.
+    """
+    iterator = iter(rows)
+    first_row = next(iterator, None)
+    if first_row is None:
+        return 0
+
+    table: Table = model.__table__  # type: ignore[assignment]
+    columns = _copy_columns(table, first_row)
+
+    conn = await session.connection()
+    dialect = conn.dialect
+    defaults = [_column_default(column) for column in columns]
+    processors = [
+        column.type.dialect_impl(dialect).bind_processor(dialect) for column in columns
+    ]
+    keys = [column.key for column in columns]
+
+    def records() -> Iterator[Sequence[Any]]:
+        for row in itertools.chain((first_row,), iterator):
+            record = []
+            for key, default, processor in zip(keys, defaults, processors, strict=True):
+                value = row[key] if key in row else default()
+                record.append(
+                    processor(value) if processor and value is not None else value
+                )
+            yield record
+
+    schema_name = table.schema or None
+    schema_translate_map = conn.sync_connection.get_execution_options().get(  # type: ignore[union-attr]
+        "schema_translate_map"
+    )
+    if schema_translate_map and schema_name in schema_translate_map:
+        schema_name = schema_translate_map[schema_name]
+
+    raw_connection = await conn.get_raw_connection()
+    status: str = await raw_connection.driver_connection.copy_records_to_table(  # type: ignore[union-attr]
+        table.name,
+        schema_name=schema_name,
+        columns=[column.name for column in columns],
+        records=records(),
+    )
+    session.info.setdefault("copied_tables", set()).add(table.name)
+    # Status of the command, e.g. "COPY 1000"
+    return int(status.rsplit(" ", 1)[-1])
+
+
+def _dedupe_rows(rows: Iterable[Row], index_elements: Sequence[str]) -> list[Row]:
+    # ON CONFLICT DO UPDATE can't affect the same row twice in one statement:
+    # the last row of a key wins
+    by_key: dict[tuple[Any, ...], Row] = {}
+    for row in rows:
+        key = tuple(row[element] for element in index_elements)
+        by_key.pop(key, None)
+        by_key[key] = row
+    return list(by_key.values())
+
+
+async def bulk_upsert[M: DeclarativeBase](
+    session: AsyncSession,
+    model: type[M],
+    rows: Iterable[Row],
+    *,
+    index_elements: Sequence[str],
+    update_columns: Sequence[str] | None = None,
+    chunk_size: int | None = None,
+) -> list[M]:
+    """
+    Inserts `rows` (column key -> value, all with the same keys) into the table
+    of `model`, updating the rows conflicting on the unique `index_elements`,
+    e.g. `["name"]` for `Role` or `["user_id", "type"]` for `Credential`.
+
+    Emits one `INSERT ... ON CONFLICT ... DO UPDATE ... RETURNING` per chunk of
+    rows, chunks being sized to stay under the bind parameters limit. Updated
+    columns default to all the given ones but the index elements and the primary
+    key; `onupdate` columns (e.g. `modified_at`) are refreshed as well.
+
+    Returns the inserted or updated instances, in no particular order. Instances
+    already in the session are refreshed with the upserted values.
+    """
+    deduped_rows = _dedupe_rows(rows, index_elements)
+    if not deduped_rows:
+        return []
+
+    table: Table = model.__table__  # type: ignore[assignment]
+    keys = list(deduped_rows[0])
+    if unknown_keys := set(keys) - set(table.columns.keys()):
+        raise ValueError(f"Unknown columns for {table.name}: {sorted(unknown_keys)}")
+    if update_columns is None:
+        update_columns = [
+            key
+            for key in keys
+            if key not in index_elements and not table.columns[key].primary_key
+        ]
+
+    # Python side defaults of the missing columns are bound parameters too
+    parameters_per_row = len(keys) + sum(
+        1
+        for column in table.columns
+        if column.key not in keys and column.default is not None
+    )
+    max_chunk_size = max(POSTGRES_MAX_PARAMETERS // parameters_per_row - 1, 1)
+    chunk_size = min(chunk_size or max_chunk_size, max_chunk_size)
+
+    upserted: list[M] = []
+    for start in range(0, len(deduped_rows), chunk_size):
+        stmt = sql.insert(model).values(deduped_rows[start : start + chunk_size])
+        set_: dict[str, Any] = {
+            key: stmt.excluded[key] for key in update_columns or index_elements[:1]
+        }
+        for column in table.columns:
+            if column.onupdate is not None and column.key not in set_:
+                set_[column.key] = _onupdate_value(column)
+        upsert_stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements, set_=set_
+        ).returning(model)
+        result = await session.scalars(
+            upsert_stmt, execution_options={"populate_existing": True}
+        )
+        upserted.extend(result.all())
+    return upserted
+
+
+__all__ = ["bulk_copy", "bulk_upsert"]
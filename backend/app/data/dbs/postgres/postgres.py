@@ -1,6 +1,6 @@
-from typing import TypeAlias
+from typing import Any, TypeAlias
 
-from sqlalchemy import Engine
+from sqlalchemy import Connection, Engine, event
 from sqlalchemy import create_engine as _create_engine
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
@@ -10,29 +10,43 @@ from sqlalchemy.ext.asyncio import (
 from sqlalchemy.ext.asyncio import (
     create_async_engine as _create_async_engine,
 )
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm import Session, SessionTransaction, sessionmaker
+from sqlalchemy.pool import Pool
 
 from .extensions.sqlalchemy import sql
 
 
+def quote_search_path(schema_name: str) -> str:
+    return '"{}"'.format(schema_name.replace('"', '""'))
+
+
 class EngineFactory:
     @staticmethod
     def create_async_engine(
         *,
         dsn: str,
         application_name: str | None = None,
+        search_path: str | None = None,
         pool_size: int | None = None,
         pool_recycle: int | None = None,
+        poolclass: type[Pool] | None = None,
         debug: bool = False,
     ) -> AsyncEngine:
+        server_settings: dict[str, str] = {}
+        if application_name:
+            server_settings["application_name"] = application_name
+        if search_path:
+            server_settings["search_path"] = quote_search_path(search_path)
+
         return _create_async_engine(
             dsn,
             echo=debug,
-            connect_args={"server_settings": {"application_name": application_name}}
-            if application_name
+            connect_args={"server_settings": server_settings}
+            if server_settings
             else {},
             pool_size=pool_size,
             pool_recycle=pool_recycle,
+            poolclass=poolclass,
         )
 
     @staticmethod
@@ -40,21 +54,93 @@ class EngineFactory:
         *,
         dsn: str,
         application_name: str | None = None,
+        search_path: str | None = None,
         pool_size: int | None = None,
         pool_recycle: int | None = None,
+        poolclass: type[Pool] | None = None,
         debug: bool = False,
     ) -> Engine:
+        connect_args: dict[str, Any] = {}
+        if application_name:
+            connect_args["application_name"] = application_name
+        if search_path:
+            connect_args["options"] = f"-c search_path={quote_search_path(search_path)}"
+
         return _create_engine(
             dsn,
             echo=debug,
-            connect_args={"application_name": application_name}
-            if application_name
-            else {},
+            connect_args=connect_args,
             pool_size=pool_size,
             pool_recycle=pool_recycle,
+            poolclass=poolclass,
+        )
+
+
+class TrackedSession(Session):
+    """
+    Session keeping track of whether its transaction holds a pooled connection.
+
+    Connections are only checked out by the first statement (or flush), so a
+    session which didn't execute anything can be closed without any commit or
+    rollback round-trip, see `holds_connection`. `info["used_connection"]` tells
+    whether it ever checked one out.
+
+    `info["read_only"]` is set on the sessions of the read-only sessionmakers,
+    whose transactions are `READ ONLY`, see `SessionMakerFactory`.
+    """
+
+
+def _mark_connection_held(
+    session: Session, transaction: SessionTransaction, connection: Connection
+) -> None:
+    session.info["holds_connection"] = True
+    session.info["used_connection"] = True
+
+
+def _mark_connection_released(
+    session: Session, transaction: SessionTransaction
+) -> None:
+    if transaction.parent is None:
+        session.info["holds_connection"] = False
+
+
+event.listen(TrackedSession, "after_begin", _mark_connection_held)
+event.listen(TrackedSession, "after_transaction_end", _mark_connection_released)
+
+
+def holds_connection(session: AsyncSession) -> bool:
+    """Whether the session has pending changes or a transaction holding a connection."""
+    return bool(
+        session.info.get("holds_connection")
+        or session.new
+        or session.dirty
+        or session.deleted
+    )
+
+
+class SearchPathSession(TrackedSession):
+    """
+    Session for engines shared by several schemas.
+
+    The schema stored in `info["schema_name"]` is applied to every transaction
+    with `SET LOCAL search_path`, so it never leaks to the next user of the
+    pooled connection.
+    """
+
+
+def _set_local_search_path(
+    session: Session, transaction: SessionTransaction, connection: Connection
+) -> None:
+    if schema_name := session.info.get("schema_name"):
+        connection.execute(
+            sql.select(
+                sql.func.set_config("search_path", quote_search_path(schema_name), True)
+            )
         )
 
 
+event.listen(SearchPathSession, "after_begin", _set_local_search_path)
+
 AsyncSessionMaker: TypeAlias = async_sessionmaker[AsyncSession]
 SyncSessionMaker: TypeAlias = sessionmaker[Session]
 
@@ -62,9 +148,34 @@ SyncSessionMaker: TypeAlias = sessionmaker[Session]
 class SessionMakerFactory:
     @staticmethod
     def create_async_sessionmaker(
-        engine: AsyncEngine,
+        engine: AsyncEngine, *, schema_name: str | None = None, read_only: bool = False
     ) -> async_sessionmaker[AsyncSession]:
-        return async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+        """
+        If `schema_name` is given, the engine is considered shared between
+        schemas and the schema is set on each transaction of the sessions.
+
+        If `read_only`, the transactions of the sessions are `READ ONLY`: asyncpg
+        begins them as such, without any extra statement.
+        """
+        info: dict[str, Any] = {}
+        if read_only:
+            engine = engine.execution_options(postgresql_readonly=True)
+            info["read_only"] = True
+        if schema_name is not None:
+            return async_sessionmaker(
+                engine,
+                expire_on_commit=False,
+                class_=AsyncSession,
+                sync_session_class=SearchPathSession,
+                info={**info, "schema_name": schema_name},
+            )
+        return async_sessionmaker(
+            engine,
+            expire_on_commit=False,
+            class_=AsyncSession,
+            sync_session_class=TrackedSession,
+            info=info,
+        )
 
     @staticmethod
     def create_sync_sessionmaker(engine: Engine) -> sessionmaker[Session]:
@@ -80,5 +191,9 @@ __all__ = [
     "SyncSessionMaker",
     "EngineFactory",
     "SessionMakerFactory",
+    "TrackedSession",
+    "SearchPathSession",
+    "holds_connection",
+    "quote_search_path",
     "sql",
 ]
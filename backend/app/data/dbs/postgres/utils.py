@@ -1,4 +1,4 @@
-from sqlalchemy import inspect
+from sqlalchemy import inspect, text
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.schema import CreateSchema
@@ -25,3 +25,23 @@ async def create_special_schema(engine: AsyncEngine) -> None:
 async def create_tenant_schema(engine: AsyncEngine, tenant_id: str) -> None:
     tenant_schema: str = f"tenant_{tenant_id}"
     await create_schema(engine, tenant_schema)
+
+
+async def get_replica_lag(engine: AsyncEngine) -> float:
+    """
+    Seconds of replication lag of the server behind `engine`.
+
+    Zero when everything received was replayed, so an idle primary doesn't make
+    its replicas look late, and on a server which isn't a replica.
+    """
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            text(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+                "THEN 0 "
+                "ELSE COALESCE("
+                "EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0"
+                ") END"
+            )
+        )
+        return float(result.scalar_one())
@@ -0,0 +1,35 @@
+from datetime import datetime
+
+from sqlalchemy import TIMESTAMP, BigInteger, Identity, LargeBinary, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.data.dbs.postgres.models import Model
+from app.infra.config import settings
+from app.infra.kit.utils import utc_now
+
+
+class WorkerOutbox(Model):
+    __tablename__ = "worker_outbox"
+    # One outbox for all the tenants, so a single relay query serves them all;
+    # qualified, as it's written from the sessions of the tenant schemas
+    __table_args__ = {"schema": settings.SPECIAL_SCHEMA}
+
+    schema: str = settings.SPECIAL_SCHEMA
+
+    # Sequential, so the relay reads the oldest jobs first from the primary key
+    id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=False, default=utc_now
+    )
+    job_id: Mapped[str] = mapped_column(String(255), nullable=False)
+    payload: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+"""
+| Attribute  | Description                                                          |
+|------------|----------------------------------------------------------------------|
+| id         | Sequential identifier, the relay order.                              |
+| created_at | Timestamp when the job was enqueued (committed).                     |
+| job_id     | arq ID of the job.                                                   |
+| payload    | Job name, arguments and enqueue options, as serialized for the jobs. |
+"""
@@ -6,7 +6,7 @@ from pydantic import (
 )
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
-from app.infra.kit.enums import Environment
+from app.infra.kit.enums import Environment, JobSerialization, SchemaRouting
 
 # from app.infra.kit.jwk import JWKSFile
 
@@ -40,8 +40,30 @@ class Settings(BaseSettings):
     # Application behaviours
     API_PAGINATION_MAX_LIMIT: int = 100
 
+    # A single middleware does the work of the request middlewares (correlation
+    # ID, forwarded host, /api/v1 rewrite, jobs flush), see `FusedMiddleware`
+    FUSED_MIDDLEWARES: bool = False
+
     # JSON list of accepted CORS origins
     CORS_ORIGINS: list[str] = []
+    # CORS configs of the tenants (their `cors` setting) kept in memory until they
+    # change, and all dropped this often in case a change was missed
+    CORS_TENANT_CONFIGS_CACHE_SIZE: int = 10_000
+    CORS_TENANT_CONFIGS_RELOAD_SECONDS: float = 300
+    # Cached CORS decisions, and preflight responses, per process
+    CORS_DECISIONS_CACHE_SIZE: int = 4096
+
+    # Bodies of the `@cache_response` responses kept in each process, on top of
+    # Redis, and the biggest body cached at all
+    RESPONSE_CACHE_LOCAL_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_MAX_BODY_BYTES: int = 1024 * 1024
+    # Tag versions of the tenants kept in memory, and all dropped this often in
+    # case a change was missed
+    RESPONSE_CACHE_TENANTS_CACHE_SIZE: int = 10_000
+    RESPONSE_CACHE_RELOAD_SECONDS: float = 300
+
+    # Bearer token of the Prometheus scrapers of /metrics, disabled if None
+    METRICS_TOKEN: str | None = None
 
     ALLOWED_HOSTS: set[str] = {"127.0.0.1:3000", "localhost:3000"}
 
@@ -71,12 +93,31 @@ class Settings(BaseSettings):
     POSTGRES_HOST: str = "127.0.0.1"
     POSTGRES_PORT: int = 5432
     POSTGRES_DATABASE: str = f"{get_app_name}_development"
+    # Read replicas for safe HTTP methods, as {"host:port": weight}
+    POSTGRES_REPLICAS: dict[str, int] = {}
     DATABASE_POOL_SIZE: int = 5
     DATABASE_SYNC_POOL_SIZE: int = 1  # Specific pool size for sync connection: since we only use it in OAuth2 router, don't waste resources.
     DATABASE_POOL_RECYCLE_SECONDS: int = 600  # 10 minutes
+    DATABASE_MAX_TENANT_ENGINES: int = 50  # Max live tenant engines (pools) per process
+    DATABASE_TENANT_ENGINE_IDLE_SECONDS: int = 900  # 15 minutes
+    DATABASE_SCHEMA_ROUTING: SchemaRouting = SchemaRouting.ENGINE
+    DATABASE_SHARED_POOL_SIZE: int = 20  # Pool size when all tenants share one engine
+    DATABASE_SHARED_MAX_SESSIONMAKERS: int = 1000  # Per schema, on the shared engine
+    DATABASE_REPLICA_MAX_LAG_SECONDS: float = 5  # Above it, reads go to the primary
+    DATABASE_REPLICA_LAG_CHECK_SECONDS: float = 10
+    DATABASE_REPLICA_LAG_CHECK_TIMEOUT_SECONDS: float = 2  # Unreachable replica after it
+    # Reads of a client stick to the primary for a while after its writes, in
+    # every process: the writes are marked in Redis
+    DATABASE_READ_YOUR_WRITES_SECONDS: float = 10
 
     SPECIAL_SCHEMA: str = "special"
     TENANT_SCHEMA: str = "tenant_{}"
+    # Tenants named by the requests (ID, subdomain), resolved by `TenantResolver`
+    TENANT_RESOLUTION_CACHE_SIZE: int = 10_000
+    TENANT_RESOLUTION_TTL_SECONDS: float = 60
+    # Custom domains of the tenants are indexed in memory, updated on their changes
+    # and reloaded this often in case one was missed
+    TENANT_HOSTS_RELOAD_SECONDS: float = 300
 
     # Redis
     REDIS_HOST: str = "127.0.0.1"
@@ -85,6 +126,38 @@ class Settings(BaseSettings):
     # REDIS_PASSWORD: str = "secret"
 
     DEFAULT_QUEUE_NAME: str = "arq:queue"
+    # Jobs go to a queue per tenant, fed fairly to the worker queue
+    WORKER_TENANT_QUEUES: bool = False
+    # Weights of the tenants in the fair scheduling, as {tenant_id: weight}
+    WORKER_TENANT_WEIGHTS: dict[str, int] = {}
+    WORKER_TENANT_WEIGHT: int = 1
+    # Ready jobs the scheduler keeps in the worker queue
+    WORKER_SCHEDULER_READY_JOBS: int = 20
+    WORKER_SCHEDULER_POLL_SECONDS: float = 0.5
+    # Encoding of the job payloads and results; pickled jobs are still read
+    WORKER_JOB_SERIALIZATION: JobSerialization = JobSerialization.MSGPACK
+    # Above this payload size, job arguments are stored compressed in their own
+    # key and the job only carries a reference to it (None to disable)
+    WORKER_CLAIM_CHECK_BYTES: int | None = 32 * 1024
+    # Jobs enqueued before a commit are written to the `worker_outbox` table in the
+    # same transaction, then relayed to Redis by the workers
+    WORKER_OUTBOX: bool = False
+    WORKER_OUTBOX_BATCH_SIZE: int = 500
+    WORKER_OUTBOX_POLL_SECONDS: float = 0.2
+    # Processes of the `@task(executor="process")` tasks, the CPU count if None
+    WORKER_PROCESS_POOL_SIZE: int | None = None
+    # Modules imported by these processes when they start, besides the task ones
+    WORKER_PROCESS_PRELOAD: list[str] = []
+    # Interrupts a task in its process, unless the task has its own timeout
+    WORKER_PROCESS_TIMEOUT_SECONDS: float = 300
+    # Each cron tick is leased in Redis by the worker running it, for this long
+    WORKER_CRON_LEASE_SECONDS: float = 3600
+    # Workers missing their heartbeats for this long are considered gone
+    WORKER_HEARTBEAT_SECONDS: float = 15
+    # Points of each worker on the hash ring sharding the per-tenant crons
+    WORKER_CRON_RING_REPLICAS: int = 64
+    # Tenants a worker runs at the same time on a tick of a per-tenant cron
+    WORKER_CRON_TENANT_CONCURRENCY: int = 10
 
     model_config = SettingsConfigDict(
         env_prefix=f"{get_app_name}_",
@@ -99,15 +172,22 @@ class Settings(BaseSettings):
         return f"redis://{self.REDIS_HOST}:{self.REDIS_PORT}"
 
     def get_postgres_dsn(
-        self, schema_name: str | None, driver: Literal["asyncpg", "psycopg2"]
+        self,
+        schema_name: str | None,
+        driver: Literal["asyncpg", "psycopg2"],
+        *,
+        host: str | None = None,
+        port: int | None = None,
     ) -> str:
-        base_dsn: str = PostgresDsn.build(  # type: ignore
-            scheme=f"postgresql+{driver}",
-            username=self.POSTGRES_USER,
-            password=self.POSTGRES_PWD,
-            host=self.POSTGRES_HOST,
-            port=self.POSTGRES_PORT,
-            path=self.POSTGRES_DATABASE,
+        base_dsn = str(
+            PostgresDsn.build(
+                scheme=f"postgresql+{driver}",
+                username=self.POSTGRES_USER,
+                password=self.POSTGRES_PWD,
+                host=host or self.POSTGRES_HOST,
+                port=port or self.POSTGRES_PORT,
+                path=self.POSTGRES_DATABASE,
+            )
         )
         return f"{base_dsn}/{schema_name}" if schema_name else base_dsn
 
@@ -1,17 +1,18 @@
+import asyncio
 import contextlib
 from contextvars import ContextVar
 from datetime import datetime
 from types import TracebackType
-from typing import ClassVar, Optional, TypedDict
+from typing import TYPE_CHECKING, ClassVar, Optional, TypedDict
 
 from arq.connections import ArqRedis
 from fastapi import Request
 from pydantic import BaseModel
 
-from app.data.dbs.postgres.postgres import AsyncEngine
-from app.data.dbs.postgres.postgres import (
-    AsyncSessionMaker as AsyncSessionMakerType,
-)
+if TYPE_CHECKING:  # pragma: no cover
+    from app.infra.core.cron import WorkerRegistry
+    from app.infra.core.postgres import TenantEngines
+    from app.infra.core.process_pool import ProcessPool
 
 
 class ProdkitContext:
@@ -196,8 +197,10 @@ class ProdkitWorkerContext(BaseModel):
 
 class WorkerContext(TypedDict):
     redis: ArqRedis
-    async_engine: AsyncEngine
-    async_sessionmaker: AsyncSessionMakerType
+    tenant_engines: "TenantEngines"
+    background_tasks: list[asyncio.Task[None]]
+    process_pool: "ProcessPool"
+    worker_registry: "WorkerRegistry"
 
 
 class JobContext(WorkerContext):
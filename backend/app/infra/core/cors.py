@@ -1,17 +1,211 @@
+import asyncio
+import functools
+import json
+import time
+from collections import OrderedDict
 from collections.abc import Mapping, Sequence
+from typing import Any
 
+import structlog
 from fastapi import FastAPI
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import UOWTransaction
 
+from app.data.dbs.postgres.postgres import Session, TrackedSession
+from app.data.models.tenant_setting import TenantSetting
 from app.infra.config import settings
-from app.infra.kit.cors import CORSConfig, CORSMatcherMiddleware, Scope
+from app.infra.core.context import TenantContext
+from app.infra.core.postgres import TenantEngines, get_schema_name, tenant_engines
+from app.infra.core.redis import Redis, publish_soon
+from app.infra.kit.cors import (
+    CORSConfig,
+    CORSMatcherMiddleware,
+    Scope,
+    get_origin_matcher,
+)
+from app.providers.monitoring.logging import Logger
 
-# class TenantCORSConfig:
-#     def __init__(self, tenant_id: str, sub_id: str, origins: list[str]):
-#         pass
+log: Logger = structlog.get_logger()
+
+# Name of the tenant setting holding the CORS config of the tenant, as the
+# arguments of a `CORSConfig` in its `data`
+CORS_SETTING_NAME = "cors"
+# Messages of the IDs of the tenants whose CORS config changed
+TENANT_CORS_CHANNEL = f"{settings.app_name}:tenant_cors"
+
+
+def get_tenant_cors_config(data: dict[str, Any]) -> CORSConfig:
+    """CORS config of a tenant, matching the origins it allows."""
+    config = CORSConfig(matcher=lambda origin, scope: False, **data)
+    config.matcher = get_origin_matcher(config.allow_origins, config.allow_origin_regex)
+    return config
+
+
+class TenantCORSConfigs:
+    """
+    CORS configs of the tenants, from their `cors` setting, for the
+    `CORSMatcherMiddleware`.
+
+    The configs of up to `max_tenants` tenants are kept in memory, until they
+    change (see `_publish_cors_changes`), and all of them are dropped every
+    `reload_seconds` in case a change was missed. Dropping the config of a
+    tenant changes its generation, and only its own, so the middleware only
+    drops the decisions of this tenant; dropping all of them changes
+    `generation`, and the generations of all the tenants.
+    """
+
+    def __init__(
+        self,
+        engines: TenantEngines | None = None,
+        *,
+        max_tenants: int = settings.CORS_TENANT_CONFIGS_CACHE_SIZE,
+        reload_seconds: float = settings.CORS_TENANT_CONFIGS_RELOAD_SECONDS,
+    ) -> None:
+        self.engines = engines or tenant_engines
+        self.max_tenants = max_tenants
+        self.reload_seconds = reload_seconds
+        self.generation = 0
+        # Generations of the tenants dropped since the last full drop, all of
+        # them taken from the same counter so none is ever reused
+        self._tenant_generations: OrderedDict[str, int] = OrderedDict()
+        self._last_generation = 0
+        self._configs: OrderedDict[str, tuple[CORSConfig, ...] | None] = OrderedDict()
+        self._loads: dict[str, asyncio.Future[tuple[CORSConfig, ...] | None]] = {}
+
+    async def get(self, tenant_id: str) -> Sequence[CORSConfig] | None:
+        if tenant_id in self._configs:
+            self._configs.move_to_end(tenant_id)
+            return self._configs[tenant_id]
+
+        load = self._loads.get(tenant_id)
+        if load is None:
+            load = asyncio.ensure_future(self._load(tenant_id))
+            self._loads[tenant_id] = load
+            load.add_done_callback(
+                functools.partial(
+                    self._load_done, tenant_id, self.get_generation(tenant_id)
+                )
+            )
+        return await asyncio.shield(load)
+
+    def get_generation(self, tenant_id: str) -> int:
+        return self._tenant_generations.get(tenant_id, self.generation)
+
+    def invalidate(self, tenant_id: str | None = None) -> None:
+        """Drops the config of `tenant_id`, or all of them."""
+        self._last_generation += 1
+        if tenant_id is None:
+            self._configs.clear()
+            self._tenant_generations.clear()
+            self.generation = self._last_generation
+            return
+
+        self._configs.pop(tenant_id, None)
+        self._tenant_generations[tenant_id] = self._last_generation
+        self._tenant_generations.move_to_end(tenant_id)
+        if len(self._tenant_generations) > self.max_tenants:
+            # The generation of the forgotten tenant would go back: drop all
+            self.invalidate()
+
+    def _load_done(
+        self,
+        tenant_id: str,
+        generation: int,
+        load: asyncio.Future[tuple[CORSConfig, ...] | None],
+    ) -> None:
+        del self._loads[tenant_id]
+        # Not cached if it was loaded before a change
+        if load.cancelled() or load.exception() is not None:
+            return
+        if generation != self.get_generation(tenant_id):
+            return
+        self._configs[tenant_id] = load.result()
+        if len(self._configs) > self.max_tenants:
+            self._configs.popitem(last=False)
+
+    async def _load(self, tenant_id: str) -> tuple[CORSConfig, ...] | None:
+        sessionmaker = await self.engines.get_sessionmaker(get_schema_name(tenant_id))
+        async with sessionmaker() as session:
+            data = (
+                await session.execute(
+                    select(TenantSetting.data).where(
+                        TenantSetting.name == CORS_SETTING_NAME
+                    )
+                )
+            ).scalar_one_or_none()
+        if not data:
+            return None
+        try:
+            return (get_tenant_cors_config(data),)
+        except (TypeError, ValueError) as e:
+            log.warning(
+                f"{settings.app_name}.cors.invalid_tenant_config",
+                tenant_id=tenant_id,
+                error=str(e),
+            )
+            return None
+
+    async def run(self, redis: Redis) -> None:
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(TENANT_CORS_CHANNEL)
+                    while True:
+                        # Changes may have been missed while unsubscribed, or lost
+                        self.invalidate()
+                        reload_at = time.monotonic() + self.reload_seconds
+                        while (timeout := reload_at - time.monotonic()) > 0:
+                            message = await pubsub.get_message(
+                                ignore_subscribe_messages=True, timeout=timeout
+                            )
+                            if message is not None:
+                                for tenant_id in json.loads(message["data"]):
+                                    self.invalidate(tenant_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"{settings.app_name}.cors.refresh_failed", error=str(e))
+                await asyncio.sleep(1)
+
+
+tenant_cors_configs = TenantCORSConfigs()
+
+
+def _track_cors_changes(session: Session, flush_context: UOWTransaction) -> None:
+    tenant_ids: set[str] = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if not isinstance(obj, TenantSetting):
+            continue
+        name_history = inspect(obj).attrs.name.history
+        if CORS_SETTING_NAME not in (obj.name, *name_history.deleted):
+            continue
+        tenant_id = obj.tenant_id or TenantContext.current().tenant_id
+        if tenant_id is not None:
+            tenant_ids.add(str(tenant_id))
+    if tenant_ids:
+        session.info.setdefault("tenant_cors_changes", set()).update(tenant_ids)
+
+
+def _publish_cors_changes(session: Session) -> None:
+    if not (tenant_ids := session.info.pop("tenant_cors_changes", None)):
+        return
+    if not publish_soon(TENANT_CORS_CHANNEL, json.dumps(sorted(tenant_ids))):
+        # Sync sessions outside of the event loop: left to the periodic reload
+        log.warning(
+            f"{settings.app_name}.cors.not_published", tenant_ids=sorted(tenant_ids)
+        )
+
+
+def _forget_cors_changes(session: Session) -> None:
+    session.info.pop("tenant_cors_changes", None)
+
+
+event.listen(TrackedSession, "after_flush", _track_cors_changes)
+event.listen(TrackedSession, "after_commit", _publish_cors_changes)
+event.listen(TrackedSession, "after_rollback", _forget_cors_changes)
 
 
 def configure_cors(app: FastAPI) -> None:
-    tenant_configs: dict[str, Sequence[CORSConfig]] = {}
     default_configs: list[CORSConfig] = []
 
     # Default CORS configurations
@@ -39,32 +233,13 @@ def configure_cors(app: FastAPI) -> None:
     )
     default_configs.append(api_config)
 
-    # TODO: Make it being dynamic, rather than being hardcoded.
-    tenant_configs = {
-        # f"tenant{tenant_id}": [
-        #     CORSConfig(
-        #         matcher=lambda origin, scope: origin in allowed_origins,
-        #         allow_origins=allowed_origins,
-        #         allow_methods=allowed_methods,
-        #         allow_headers=allowed_headers,
-        #         allow_credentials=allowed_credentials,
-        #     ),
-        # ],
-        # "tenant2": [
-        #     CORSConfig(
-        #         matcher=lambda origin, scope: origin in ["https://example2.com"],
-        #         allow_origins=["https://example2.com"],
-        #         allow_methods=["GET"],
-        #         allow_headers=["*"],
-        #         allow_credentials=False,
-        #     ),
-        # ],
-        # ...
-    }
-
     combined_configs: Mapping[str, Sequence[CORSConfig]] = {
-        **tenant_configs,
         "default": default_configs,
     }
 
-    app.add_middleware(CORSMatcherMiddleware, configs=combined_configs)
+    app.add_middleware(
+        CORSMatcherMiddleware,
+        configs=combined_configs,
+        tenant_configs=tenant_cors_configs,
+        max_decisions=settings.CORS_DECISIONS_CACHE_SIZE,
+    )
@@ -0,0 +1,289 @@
+import asyncio
+import bisect
+import contextlib
+import dataclasses
+import hashlib
+import time
+from collections.abc import Awaitable, Callable, Iterable, Sequence
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, cast
+
+import structlog
+from arq.connections import ArqRedis
+from arq.cron import CronJob
+from arq.utils import timestamp_ms, to_unix_ms
+from sqlalchemy import select
+
+from app.data.dbs.postgres.postgres import AsyncSessionMaker
+from app.data.models.tenant import Tenant
+from app.infra.config import settings
+from app.infra.kit.enums import Status
+from app.providers.monitoring.logging import Logger
+
+if TYPE_CHECKING:
+    from app.infra.core.context import JobContext, WorkerContext
+
+log: Logger = structlog.get_logger()
+
+CRON_LEASE_PREFIX = f"{settings.DEFAULT_QUEUE_NAME}:cron:lease:"
+# Sorted set of the workers, scored by their last heartbeat
+WORKERS_KEY = f"{settings.DEFAULT_QUEUE_NAME}:workers"
+
+
+async def acquire_leases(
+    redis: ArqRedis,
+    names: Sequence[str],
+    owner: str,
+    *,
+    lease_ms: int = int(settings.WORKER_CRON_LEASE_SECONDS * 1000),
+) -> list[bool]:
+    """
+    Takes the leases `names` for `owner`, returns which ones it got.
+
+    A lease is never released, it only expires: it stands for a tick that was
+    run, not only for a tick being run.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        for name in names:
+            pipe.set(CRON_LEASE_PREFIX + name, owner, nx=True, px=lease_ms)
+        results = await pipe.execute()
+    return [bool(result) for result in results]
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest())
+
+
+class HashRing:
+    """
+    Consistent hashing of keys (tenant IDs) to nodes (worker IDs).
+
+    Each node is placed `replicas` times on the ring, so the keys are spread
+    evenly, and a node joining or leaving only moves its own share of them.
+    """
+
+    def __init__(
+        self,
+        nodes: Iterable[str],
+        *,
+        replicas: int = settings.WORKER_CRON_RING_REPLICAS,
+    ) -> None:
+        points = sorted(
+            (_hash(f"{node}:{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def get_node(self, key: str) -> str | None:
+        if not self._nodes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class WorkerRegistry:
+    """
+    Live workers, known from their heartbeats in Redis.
+
+    A worker missing its heartbeats for `ttl` seconds (killed, partitioned) is
+    forgotten; one shutting down cleanly leaves right away.
+    """
+
+    def __init__(
+        self,
+        redis: ArqRedis,
+        worker_id: str,
+        *,
+        ttl: float = settings.WORKER_HEARTBEAT_SECONDS,
+    ) -> None:
+        self.redis = redis
+        self.worker_id = worker_id
+        self.ttl_ms = int(ttl * 1000)
+
+    async def heartbeat(self) -> None:
+        now = timestamp_ms()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(WORKERS_KEY, {self.worker_id: now})
+            pipe.zremrangebyscore(WORKERS_KEY, "-inf", now - self.ttl_ms)
+            await pipe.execute()
+
+    async def live_workers(self) -> list[str]:
+        workers = await self.redis.zrangebyscore(
+            WORKERS_KEY, timestamp_ms() - self.ttl_ms, "+inf"
+        )
+        return sorted(
+            worker.decode() if isinstance(worker, bytes) else worker
+            for worker in workers
+        )
+
+    async def leave(self) -> None:
+        await self.redis.zrem(WORKERS_KEY, self.worker_id)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.heartbeat()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(
+                    f"{settings.app_name}.worker.heartbeat_failed", error=str(e)
+                )
+            await asyncio.sleep(self.ttl_ms / 1000 / 3)
+
+
+async def list_tenant_ids(sessionmaker: AsyncSessionMaker) -> list[str]:
+    """Tenants the per-tenant crons run for."""
+    async with sessionmaker() as session:
+        result = await session.execute(
+            select(Tenant.id).where(Tenant.status == Status.ACTIVE)
+        )
+        return [str(tenant_id) for tenant_id in result.scalars()]
+
+
+@dataclasses.dataclass
+class TenantCron:
+    # Schedule of the cron, `coroutine` being called as `coroutine(ctx, tenant_id=...)`
+    cron_job: CronJob
+    coroutine: Callable[..., Awaitable[Any]]
+
+
+class TenantCronScheduler:
+    """
+    Runs the per-tenant crons (`@interval(per_tenant=True)`) on every worker,
+    each of them taking the tenants the hash ring of the live workers assigns
+    to it.
+
+    On each tick, the tenants of the worker are run `concurrency` at a time,
+    each one in its own job context. A tenant is leased per tick too: while the
+    workers disagree on who is alive (one joined or left since the last
+    heartbeats), a tenant can be assigned twice, but still runs once.
+    """
+
+    def __init__(
+        self,
+        ctx: "WorkerContext",
+        registry: WorkerRegistry,
+        crons: Sequence[TenantCron],
+        list_tenant_ids: Callable[[], Awaitable[list[str]]],
+        *,
+        concurrency: int = settings.WORKER_CRON_TENANT_CONCURRENCY,
+    ) -> None:
+        self.ctx = ctx
+        self.registry = registry
+        self.crons = crons
+        self.list_tenant_ids = list_tenant_ids
+        self.concurrency = concurrency
+        self._ring: tuple[list[str], HashRing] = ([], HashRing(()))
+
+    async def get_tenant_ids(self) -> list[str]:
+        """Tenants of this worker, as of now."""
+        workers = await self.registry.live_workers()
+        if workers != self._ring[0]:
+            self._ring = (workers, HashRing(workers))
+        ring = self._ring[1]
+        return [
+            tenant_id
+            for tenant_id in await self.list_tenant_ids()
+            if ring.get_node(tenant_id) == self.registry.worker_id
+        ]
+
+    async def tick(self, tenant_cron: TenantCron, tick: datetime) -> None:
+        start = time.perf_counter()
+        cron_job = tenant_cron.cron_job
+        tick_ms = to_unix_ms(tick)
+        tenant_ids = await self.get_tenant_ids()
+        leases = await acquire_leases(
+            self.ctx["redis"],
+            [f"{cron_job.name}:{tick_ms}:{tenant_id}" for tenant_id in tenant_ids],
+            self.registry.worker_id,
+        )
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(tenant_id: str) -> None:
+            job_context: JobContext = {
+                **self.ctx,
+                "job_id": f"{cron_job.name}:{tick_ms}:{tenant_id}",
+                "job_try": 1,
+                "enqueue_time": tick,
+                "score": tick_ms,
+                "exit_stack": contextlib.ExitStack(),
+            }
+            async with semaphore, asyncio.timeout(cron_job.timeout_s):
+                await tenant_cron.coroutine(job_context, tenant_id=tenant_id)
+
+        leased = [
+            tenant_id
+            for tenant_id, lease in zip(tenant_ids, leases, strict=True)
+            if lease
+        ]
+        results = await asyncio.gather(
+            *(run(tenant_id) for tenant_id in leased), return_exceptions=True
+        )
+        for tenant_id, result in zip(leased, results, strict=True):
+            if isinstance(result, Exception):
+                log.warning(
+                    f"{settings.app_name}.worker.tenant_cron_failed",
+                    cron=cron_job.name,
+                    tenant_id=tenant_id,
+                    error=str(result),
+                )
+        log.info(
+            f"{settings.app_name}.worker.tenant_cron_ticked",
+            cron=cron_job.name,
+            tick=tick.isoformat(),
+            tenants=len(leased),
+            failed=sum(isinstance(result, Exception) for result in results),
+            duration_ms=round((time.perf_counter() - start) * 1000, 3),
+        )
+
+    async def _tick(self, tenant_cron: TenantCron, tick: datetime) -> None:
+        try:
+            await self.tick(tenant_cron, tick)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning(
+                f"{settings.app_name}.worker.tenant_cron_tick_failed",
+                cron=tenant_cron.cron_job.name,
+                tick=tick.isoformat(),
+                error=str(e),
+            )
+
+    async def run(self) -> None:
+        log.info(f"{settings.app_name}.worker.tenant_crons.started")
+        for tenant_cron in self.crons:
+            tenant_cron.cron_job.calculate_next(datetime.now())
+
+        ticks: set[asyncio.Task[None]] = set()
+        try:
+            while True:
+                tenant_cron = min(
+                    self.crons,
+                    key=lambda tenant_cron: cast(
+                        datetime, tenant_cron.cron_job.next_run
+                    ),
+                )
+                tick = cast(datetime, tenant_cron.cron_job.next_run)
+                await asyncio.sleep(max((tick - datetime.now()).total_seconds(), 0))
+                tenant_cron.cron_job.calculate_next(tick)
+
+                # A tick running late doesn't hold the next ones back
+                task = asyncio.create_task(self._tick(tenant_cron, tick))
+                ticks.add(task)
+                task.add_done_callback(ticks.discard)
+        finally:
+            for task in ticks:
+                task.cancel()
+
+
+__all__ = [
+    "acquire_leases",
+    "HashRing",
+    "WorkerRegistry",
+    "list_tenant_ids",
+    "TenantCron",
+    "TenantCronScheduler",
+]
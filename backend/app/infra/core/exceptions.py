@@ -168,6 +168,13 @@ class MissingTenantOrSubIdError(ProdkitError):
         super().__init__(message, status_code)
 
 
+class InvalidCursorError(ProdkitError):
+    def __init__(
+        self, message: str = "Invalid pagination cursor", status_code: int = 400
+    ) -> None:
+        super().__init__(message, status_code)
+
+
 ###########################
 ### Exception Handelers ###
 ###########################
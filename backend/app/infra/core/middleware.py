@@ -1,20 +1,24 @@
 # Base source: https://github.com/polarsource/polar/blob/main/server/polar/middlewares.py
 
 import functools
+import ipaddress
 import re
-from collections.abc import Awaitable, Callable
 from os import environ
-from urllib.parse import urlparse
 
 import structlog
-from fastapi import FastAPI, Request, Response
+from fastapi import FastAPI
 from starlette.datastructures import MutableHeaders
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.infra.config import settings
 from app.infra.core.context import TenantContext
-from app.infra.core.worker import flush_enqueued_jobs
+from app.infra.core.tenant_hosts import (
+    TenantHostIndex,
+    normalize_host,
+    tenant_host_index,
+)
+from app.infra.core.tenant_resolution import TenantResolver, tenant_resolver
+from app.infra.core.worker import flush_enqueued_jobs, jobs_to_enqueue_scope
 from app.providers.monitoring.logging import Logger, generate_correlation_id
 
 
@@ -77,10 +81,11 @@ class FlushEnqueuedWorkerJobsMiddleware:
         self.app = app
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        await self.app(scope, receive, send)
+        with jobs_to_enqueue_scope():
+            await self.app(scope, receive, send)
 
-        if not settings.is_testing():
-            await flush_enqueued_jobs(scope["state"]["arq_pool"])
+            if not settings.is_testing():
+                await flush_enqueued_jobs(scope["state"]["arq_pool"])
 
 
 class PathRewriteMiddleware:
@@ -128,73 +133,234 @@ class PathRewriteMiddleware:
         await send(message)
 
 
-class TenantAwareMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app: ASGIApp) -> None:
-        super().__init__(app)
+def is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
 
-    # TODO: Add a lightweight auth layer
-    async def dispatch(
-        self, request: Request, call_next: Callable[[Request], Awaitable[Response]]
-    ) -> Response:
-        headers = MutableHeaders(scope=request.scope)
-        tenant_id = self.get_tenant_id(headers, request)
-        sub_id = self.get_sub_id(headers, request)
 
-        tenant_context = TenantContext(tenant_id=tenant_id, sub_id=sub_id)
+class TenantAwareMiddleware:
+    """
+    Resolves the tenant of the request, into `request.state.tenant_context` and
+    the current `TenantContext`.
 
-        request.state.tenant_context = tenant_context
+    The tenant is named by the `x-{app_name}-tenant-id` header, else by the
+    host (a custom domain of the `TenantHostIndex`, or a subdomain named after
+    the tenant), else by the first segment of the path, and has to be an active
+    tenant (see `TenantResolver`). The headers are scanned once, and the
+    resolution is cached, so this costs a dict lookup for most requests.
 
-        response = await call_next(request)
-        return response
+    A request whose tenant can't be resolved, e.g. while the database is down,
+    goes on without a tenant rather than failing, so `/healthz` still answers.
+    """
 
-    def get_tenant_id(self, headers: MutableHeaders, request: Request) -> str | None:
+    def __init__(
+        self,
+        app: ASGIApp,
+        resolver: TenantResolver = tenant_resolver,
+        host_index: TenantHostIndex = tenant_host_index,
+    ) -> None:
+        self.app = app
+        self.resolver = resolver
+        self.host_index = host_index
+        self.logger: Logger = structlog.get_logger()
         # TODO: Correct it based on the header naming pattern
-        tenant_id = self.extract_from_header(headers, "tenant-id")
-        if tenant_id:
-            return tenant_id
+        self.tenant_id_header = f"x-{settings.app_name}-tenant-id".lower().encode()
+        self.sub_id_header = f"x-{settings.app_name}-sub-id".lower().encode()
 
-        tenant_id = self.extract_from_subdomain(request)
-        if tenant_id:
-            return tenant_id
+    # TODO: Add a lightweight auth layer
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
 
-        # Check URL path for tenant ID (assuming /tenant/{tenant_id}/... format)
-        tenant_id = self.extract_from_path(request)
-        if tenant_id:
-            return tenant_id
+        tenant_id_header = sub_id = host = None
+        for name, value in scope["headers"]:
+            if name == b"host":
+                host = value.decode("latin-1")
+            elif name == self.tenant_id_header:
+                tenant_id_header = value.decode("latin-1")
+            elif name == self.sub_id_header:
+                sub_id = value.decode("latin-1") or None
 
-        return None
+        try:
+            tenant_id = await self.get_tenant_id(tenant_id_header, host, scope["path"])
+        except Exception as e:
+            self.logger.warning(
+                f"{settings.app_name}.tenant_resolution.failed", error=str(e)
+            )
+            tenant_id = None
+        tenant_context = TenantContext(tenant_id=tenant_id, sub_id=sub_id)
+        scope.setdefault("state", {})["tenant_context"] = tenant_context
+
+        with tenant_context:
+            await self.app(scope, receive, send)
 
-    def extract_from_header(
-        self, headers: MutableHeaders, header_name: str
+    async def get_tenant_id(
+        self, tenant_id_header: str | None, host: str | None, path: str
     ) -> str | None:
-        # TODO: Correct it based on the header naming pattern
-        # headers = Headers(scope=request.scope)  # Use Headers to get request headers
-        header_key = f"x-{settings.app_name}-{header_name}"
-        return headers.get(header_key)
-
-    def extract_from_subdomain(self, request: Request) -> str | None:
-        host = request.headers.get("host", "")
-        parts = host.split(".")
-        if len(parts) > 2:
-            return parts[0]
-        return None
+        if tenant_id_header and (
+            tenant_id := await self.resolver.resolve(("id", tenant_id_header))
+        ):
+            return tenant_id
 
-    def extract_from_path(self, request: Request) -> str | None:
-        parsed_url = urlparse(request.url.path)
-        parts = parsed_url.path.split("/")
-        if len(parts) > 1 and parts[1]:
-            return parts[1]
+        if host:
+            # Custom domains first, then the subdomains named after the tenants
+            if tenant_id := self.host_index.lookup(host):
+                return tenant_id
+            hostname = normalize_host(host)
+            parts = hostname.split(".")
+            if (
+                len(parts) > 2
+                and not is_ip_address(hostname)
+                and (tenant_id := await self.resolver.resolve(("slug", parts[0])))
+            ):
+                return tenant_id
+
+        # Check URL path for tenant ID (assuming /{tenant_id}/... format)
+        if segment := path[1:].partition("/")[0]:
+            return await self.resolver.resolve(("id", segment))
         return None
 
-    def get_sub_id(self, headers: MutableHeaders, request: Request) -> str | None:
-        sub_id = self.extract_from_header(headers, "sub-id")
-        # TODO: Correct it based on the header naming pattern
-        if sub_id:
-            return sub_id
-        return None
+
+class FusedMiddleware:
+    """
+    Does the work of `LogCorrelationIdMiddleware`, `XForwardedHostMiddleware`,
+    `PathRewriteMiddleware` and `FlushEnqueuedWorkerJobsMiddleware` in a single
+    layer, see `settings.FUSED_MIDDLEWARES`.
+
+    The headers are scanned once, and only if the client is a trusted proxy.
+    The trusted hosts may be IPs or networks (`10.0.0.0/8`), the decisions
+    being cached per client. The path rewrite is a prefix replacement.
+    """
+
+    # Clients whose trust is remembered, before the cache is cleared
+    max_trusted_clients = 1024
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        trusted_hosts: str | list[str] = "127.0.0.1",
+        path_prefix: str = "/api/v1",
+        path_replacement: str = "/v1",
+    ) -> None:
+        self.app = app
+        if isinstance(trusted_hosts, str):
+            trusted_hosts = trusted_hosts.split(",")
+        self.trusted_literals: set[str] = set()
+        self.trusted_networks: list[ipaddress.IPv4Network | ipaddress.IPv6Network] = []
+        for item in (item.strip() for item in trusted_hosts):
+            try:
+                self.trusted_networks.append(ipaddress.ip_network(item, strict=False))
+            except ValueError:
+                self.trusted_literals.add(item)
+        self.always_trust = "*" in self.trusted_literals
+        self._trusted_clients: dict[str | None, bool] = {}
+
+        self.path_prefix = path_prefix
+        self.path_replacement = path_replacement
+        self.deprecation_notice = (
+            f"x-{settings.app_name}-deprecation-notice".encode(),
+            b"The API root has moved from /api/v1 to /v1. "
+            b"Please update your integration.",
+        )
+        self.logger: Logger = structlog.get_logger()
+
+    def is_trusted(self, client_host: str | None) -> bool:
+        if self.always_trust:
+            return True
+        if (trusted := self._trusted_clients.get(client_host)) is not None:
+            return trusted
+
+        trusted = client_host in self.trusted_literals
+        if not trusted and client_host is not None:
+            try:
+                address = ipaddress.ip_address(client_host)
+            except ValueError:
+                pass
+            else:
+                trusted = any(address in network for network in self.trusted_networks)
+
+        if len(self._trusted_clients) >= self.max_trusted_clients:
+            self._trusted_clients.clear()
+        self._trusted_clients[client_host] = trusted
+        return trusted
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        client_addr: tuple[str, int] | None = scope.get("client")
+        if self.is_trusted(client_addr[0] if client_addr else None):
+            self.rewrite_host(scope)
+
+        is_http = scope["type"] == "http"
+        if is_http:
+            structlog.contextvars.bind_contextvars(
+                correlation_id=generate_correlation_id(),
+                method=scope["method"],
+                path=scope["path"],
+            )
+
+        path: str = scope["path"]
+        if path.startswith(self.path_prefix):
+            scope["path"] = self.path_replacement + path[len(self.path_prefix) :]
+            self.logger.warning(
+                "PathRewriteMiddleware",
+                pattern=self.path_prefix,
+                replacement=self.path_replacement,
+                path=scope["path"],
+            )
+            send = functools.partial(self.send_deprecation_notice, send=send)
+
+        try:
+            with jobs_to_enqueue_scope():
+                await self.app(scope, receive, send)
+
+                if not settings.is_testing():
+                    await flush_enqueued_jobs(scope["state"]["arq_pool"])
+        finally:
+            if is_http:
+                structlog.contextvars.unbind_contextvars(
+                    "correlation_id", "method", "path"
+                )
+
+    @staticmethod
+    def rewrite_host(scope: Scope) -> None:
+        headers: list[tuple[bytes, bytes]] = scope["headers"]
+        for name, value in headers:
+            if name == b"x-forwarded-host":
+                scope["headers"] = [
+                    (header_name, header_value)
+                    for header_name, header_value in headers
+                    if header_name != b"host"
+                ]
+                scope["headers"].append((b"host", value))
+                return
+
+    async def send_deprecation_notice(self, message: Message, send: Send) -> None:
+        if message["type"] == "http.response.start":
+            message["headers"] = [*message.get("headers", ()), self.deprecation_notice]
+        await send(message)
 
 
 def add_middlewares(app: FastAPI) -> None:
+    if settings.FUSED_MIDDLEWARES:
+        # Outside of the CORS middleware, which reads the tenant of the request
+        app.add_middleware(TenantAwareMiddleware)
+        app.add_middleware(
+            FusedMiddleware,
+            trusted_hosts=environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        )
+        return
+
+    # Outside of the CORS middleware, which reads the tenant of the request, and
+    # inside of the path rewrite, so `/api/v1` isn't taken for a tenant ID
+    app.add_middleware(TenantAwareMiddleware)
     app.add_middleware(PathRewriteMiddleware, pattern=r"^/api/v1", replacement="/v1")
     app.add_middleware(FlushEnqueuedWorkerJobsMiddleware)
     app.add_middleware(
@@ -202,4 +368,3 @@ def add_middlewares(app: FastAPI) -> None:
         trusted_hosts=environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1"),
     )
     app.add_middleware(LogCorrelationIdMiddleware)
-    # app.add_middleware(TenantAwareMiddleware)
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable, Sequence
+from typing import TYPE_CHECKING
+
+import structlog
+from arq.connections import ArqRedis
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.data.dbs.postgres.postgres import AsyncSessionMaker
+from app.data.models.worker_outbox import WorkerOutbox
+from app.infra.config import settings
+from app.infra.core.job_serializer import get_job_serializers
+from app.providers.monitoring.logging import Logger
+
+if TYPE_CHECKING:
+    from app.infra.core.worker import JobToEnqueue
+
+log: Logger = structlog.get_logger()
+
+EnqueueJobs = Callable[[ArqRedis, list["JobToEnqueue"]], Awaitable[list[str]]]
+
+# Same encoding as the job payloads, so everything a job accepts can be stored
+job_serializer, job_deserializer = get_job_serializers(
+    settings.WORKER_JOB_SERIALIZATION
+)
+
+
+def add_to_outbox(session: Session, jobs: Sequence["JobToEnqueue"]) -> None:
+    """Adds `jobs` to the outbox, in the current transaction of `session`."""
+    session.add_all(
+        WorkerOutbox(
+            job_id=kwargs["_job_id"],
+            payload=job_serializer({"f": name, "a": args, "k": kwargs}),
+        )
+        for name, args, kwargs, _ in jobs
+    )
+
+
+class OutboxRelay:
+    """
+    Moves the jobs of the outbox to Redis, oldest first, by batches of
+    `batch_size`.
+
+    Each batch is a single `DELETE ... RETURNING` of rows locked with
+    `SKIP LOCKED`, enqueued with `enqueue_jobs` before the commit: several
+    relays (one per worker) share the backlog without waiting on each other,
+    and the rows come back if Redis fails. A job relayed twice (Redis succeeded,
+    the commit didn't) keeps its ID, so the second enqueue is skipped.
+    """
+
+    def __init__(
+        self,
+        sessionmaker: AsyncSessionMaker,
+        redis: ArqRedis,
+        enqueue_jobs: EnqueueJobs,
+        *,
+        batch_size: int = settings.WORKER_OUTBOX_BATCH_SIZE,
+        poll_delay: float = settings.WORKER_OUTBOX_POLL_SECONDS,
+    ) -> None:
+        self.sessionmaker = sessionmaker
+        self.redis = redis
+        self.enqueue_jobs = enqueue_jobs
+        self.batch_size = batch_size
+        self.poll_delay = poll_delay
+
+    async def relay(self) -> int:
+        """Relays a batch of jobs, returns their number."""
+        locked_ids = (
+            select(WorkerOutbox.id)
+            .order_by(WorkerOutbox.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        async with self.sessionmaker() as session:
+            result = await session.execute(
+                delete(WorkerOutbox)
+                .where(WorkerOutbox.id.in_(locked_ids))
+                .returning(WorkerOutbox.id, WorkerOutbox.payload)
+            )
+            rows = sorted(result.tuples().all())
+            if not rows:
+                return 0
+
+            jobs: list[JobToEnqueue] = []
+            for _, payload in rows:
+                job = job_deserializer(payload)
+                jobs.append((job["f"], tuple(job["a"]), job["k"], time.perf_counter()))
+            await self.enqueue_jobs(self.redis, jobs)
+            await session.commit()
+
+        log.debug(f"{settings.app_name}.worker.outbox.relayed", jobs=len(rows))
+        return len(rows)
+
+    async def run(self) -> None:
+        log.info(f"{settings.app_name}.worker.outbox.started")
+        while True:
+            try:
+                relayed = await self.relay()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(
+                    f"{settings.app_name}.worker.outbox.relay_failed", error=str(e)
+                )
+                relayed = 0
+            # Keep relaying while there is a backlog
+            if relayed < self.batch_size:
+                await asyncio.sleep(self.poll_delay)
+
+
+__all__ = ["add_to_outbox", "OutboxRelay"]
@@ -1,6 +1,13 @@
+import asyncio
+import dataclasses
+import math
+import random
+import time
+from collections import OrderedDict
 from collections.abc import AsyncGenerator
-from typing import Literal, TypeAlias
+from typing import Literal, Protocol, TypeAlias
 
+import structlog
 from fastapi import Depends, Request
 
 from app.data.dbs.postgres.postgres import (
@@ -12,13 +19,30 @@ from app.data.dbs.postgres.postgres import (
     Session,
     SessionMakerFactory,
     SyncSessionMaker,
+    holds_connection,
     sql,
 )
+from app.data.dbs.postgres.utils import get_replica_lag
 from app.infra.config import settings
+from app.infra.core.context import TenantContext
+from app.infra.core.redis import Redis, redis
+from app.infra.kit.enums import SchemaRouting
+from app.providers.monitoring.logging import Logger
+from app.providers.monitoring.performance import (
+    TimedAsyncAdaptedQueuePool,
+    TimedQueuePool,
+    instrument_pool,
+    instrument_statement_cache,
+)
+
+log: Logger = structlog.get_logger()
 
 ProcessName: TypeAlias = Literal["app", "worker", "script"]
 SchemaName: TypeAlias = str
 
+# Clients who wrote recently, see `ReplicaRouter`
+READ_YOUR_WRITES_PREFIX = f"{settings.app_name}:read_your_writes:"
+
 
 def get_schema_name(tenant_id: str | None) -> SchemaName:
     if tenant_id is None:
@@ -30,37 +54,498 @@ def get_schema_name(tenant_id: str | None) -> SchemaName:
 class DatabaseEngine:
     @staticmethod
     def create_async_engine(
-        process_name: ProcessName, schema_name: SchemaName
+        process_name: ProcessName,
+        schema_name: SchemaName,
+        *,
+        host: str | None = None,
+        port: int | None = None,
     ) -> AsyncEngine:
-        dsn = settings.get_postgres_dsn(schema_name, "asyncpg")
-        return EngineFactory.create_async_engine(
+        dsn = settings.get_postgres_dsn(None, "asyncpg", host=host, port=port)
+        application_name = f"{settings.ENV.value}.{process_name}.{schema_name}"
+        engine = EngineFactory.create_async_engine(
             dsn=dsn,
-            application_name=f"{settings.ENV.value}.{process_name}.{schema_name}",
+            application_name=application_name,
+            search_path=schema_name,
             debug=settings.DEBUG,
             pool_size=settings.DATABASE_POOL_SIZE,
             pool_recycle=settings.DATABASE_POOL_RECYCLE_SECONDS,
+            poolclass=TimedAsyncAdaptedQueuePool,
+        )
+        instrument_statement_cache(engine.sync_engine)
+        instrument_pool(
+            engine.sync_engine, application_name=application_name, host=host, port=port
+        )
+        return engine
+
+    @staticmethod
+    def create_shared_async_engine(
+        process_name: ProcessName,
+        *,
+        host: str | None = None,
+        port: int | None = None,
+    ) -> AsyncEngine:
+        """Engine shared by all the schemas, see `SharedTenantEngine`."""
+        dsn = settings.get_postgres_dsn(None, "asyncpg", host=host, port=port)
+        application_name = f"{settings.ENV.value}.{process_name}.shared"
+        engine = EngineFactory.create_async_engine(
+            dsn=dsn,
+            application_name=application_name,
+            debug=settings.DEBUG,
+            pool_size=settings.DATABASE_SHARED_POOL_SIZE,
+            pool_recycle=settings.DATABASE_POOL_RECYCLE_SECONDS,
+            poolclass=TimedAsyncAdaptedQueuePool,
         )
+        instrument_statement_cache(engine.sync_engine)
+        instrument_pool(
+            engine.sync_engine, application_name=application_name, host=host, port=port
+        )
+        return engine
 
     @staticmethod
     def create_sync_engine(
         process_name: ProcessName, schema_name: SchemaName
     ) -> Engine:
-        dsn = settings.get_postgres_dsn(schema_name, "psycopg2")
-        return EngineFactory.create_sync_engine(
+        dsn = settings.get_postgres_dsn(None, "psycopg2")
+        application_name = f"{settings.ENV.value}.{process_name}.{schema_name}"
+        engine = EngineFactory.create_sync_engine(
             dsn=dsn,
-            application_name=f"{settings.ENV.value}.{process_name}.{schema_name}",
+            application_name=application_name,
+            search_path=schema_name,
             debug=settings.DEBUG,
             pool_size=settings.DATABASE_SYNC_POOL_SIZE,
             pool_recycle=settings.DATABASE_POOL_RECYCLE_SECONDS,
+            poolclass=TimedQueuePool,
+        )
+        instrument_pool(engine, application_name=application_name)
+        return engine
+
+
+class TenantEngines(Protocol):
+    """Resolves the engine and sessionmaker to use for a tenant schema."""
+
+    async def get_engine(self, schema_name: SchemaName) -> AsyncEngine: ...
+
+    async def get_sessionmaker(
+        self, schema_name: SchemaName, *, read_only: bool = False
+    ) -> AsyncSessionMaker: ...
+
+    async def dispose(self) -> None: ...
+
+
+@dataclasses.dataclass
+class TenantEngineRegistryStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+@dataclasses.dataclass
+class _TenantEngine:
+    engine: AsyncEngine
+    sessionmaker: AsyncSessionMaker
+    read_only_sessionmaker: AsyncSessionMaker
+    last_used_at: float
+
+
+class TenantEngineRegistry:
+    """
+    Process-wide cache of async engines keyed by schema name.
+
+    Engines (and their pools) are reused across requests and jobs. At most
+    `max_engines` of them are kept alive: when the limit is reached, the least
+    recently used engine is disposed. Engines that were not used for more than
+    `idle_seconds` are disposed as well.
+
+    Engines with checked-out connections are never evicted, so the limit can be
+    exceeded temporarily while all of them are busy.
+    """
+
+    def __init__(
+        self,
+        process_name: ProcessName,
+        *,
+        max_engines: int,
+        idle_seconds: float,
+        host: str | None = None,
+        port: int | None = None,
+    ) -> None:
+        self.process_name = process_name
+        self.host = host
+        self.port = port
+        self.max_engines = max_engines
+        self.idle_seconds = idle_seconds
+        self.stats = TenantEngineRegistryStats()
+        self._engines: OrderedDict[SchemaName, _TenantEngine] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._engines)
+
+    def __contains__(self, schema_name: object) -> bool:
+        return schema_name in self._engines
+
+    async def get_engine(self, schema_name: SchemaName) -> AsyncEngine:
+        return (await self._get(schema_name)).engine
+
+    async def get_sessionmaker(
+        self, schema_name: SchemaName, *, read_only: bool = False
+    ) -> AsyncSessionMaker:
+        entry = await self._get(schema_name)
+        return entry.read_only_sessionmaker if read_only else entry.sessionmaker
+
+    async def _get(self, schema_name: SchemaName) -> _TenantEngine:
+        now = time.monotonic()
+
+        if entry := self._engines.get(schema_name):
+            self.stats.hits += 1
+            entry.last_used_at = now
+            self._engines.move_to_end(schema_name)
+            return entry
+
+        self.stats.misses += 1
+        engine = DatabaseEngine.create_async_engine(
+            self.process_name, schema_name, host=self.host, port=self.port
+        )
+        entry = _TenantEngine(
+            engine=engine,
+            sessionmaker=SessionMakerFactory.create_async_sessionmaker(engine),
+            read_only_sessionmaker=SessionMakerFactory.create_async_sessionmaker(
+                engine, read_only=True
+            ),
+            last_used_at=now,
         )
+        self._engines[schema_name] = entry
+
+        # Only pay for the eviction scan when a new pool is created
+        await self._dispose(self._pop_evictable(now))
+
+        return entry
+
+    async def evict_idle(self) -> int:
+        """Dispose engines idle for longer than `idle_seconds`."""
+        evicted = self._pop_evictable(time.monotonic(), over_limit=False)
+        await self._dispose(evicted)
+        return len(evicted)
+
+    async def run_idle_eviction(self) -> None:
+        """Periodically dispose idle engines, for processes which can stay quiet."""
+        while True:
+            await asyncio.sleep(max(self.idle_seconds / 4, 1))
+            if evicted := await self.evict_idle():
+                log.debug(
+                    f"{settings.app_name}.postgres.tenant_engines_evicted",
+                    process_name=self.process_name,
+                    evicted=evicted,
+                )
+
+    async def dispose(self) -> None:
+        """Dispose all the engines, e.g. on shutdown."""
+        engines = list(self._engines.items())
+        self._engines.clear()
+        for _, entry in engines:
+            await entry.engine.dispose()
+
+    def _pop_evictable(
+        self, now: float, *, over_limit: bool = True
+    ) -> list[tuple[SchemaName, _TenantEngine]]:
+        evicted: list[tuple[SchemaName, _TenantEngine]] = []
+        # Oldest first, the most recently used engine is never a candidate
+        for schema_name, entry in list(self._engines.items())[:-1]:
+            is_idle = now - entry.last_used_at > self.idle_seconds
+            is_over_limit = over_limit and len(self._engines) > self.max_engines
+            if not (is_idle or is_over_limit):
+                break  # Entries are ordered by last use, the next ones are newer
+
+            if entry.engine.pool.checkedout() > 0:  # type: ignore[attr-defined]
+                continue
+
+            del self._engines[schema_name]
+            evicted.append((schema_name, entry))
+
+        return evicted
+
+    async def _dispose(self, evicted: list[tuple[SchemaName, _TenantEngine]]) -> None:
+        for schema_name, entry in evicted:
+            self.stats.evictions += 1
+            await entry.engine.dispose()
+            log.debug(
+                f"{settings.app_name}.postgres.tenant_engine_evicted",
+                schema_name=schema_name,
+                process_name=self.process_name,
+            )
+
+
+class SharedTenantEngine:
+    """
+    A single engine (and pool) serving all the tenant schemas, so the number of
+    Postgres connections doesn't depend on the number of tenants.
+
+    With `SchemaRouting.SEARCH_PATH`, sessions set their schema on each
+    transaction with `SET LOCAL search_path`.
+
+    With `SchemaRouting.TRANSLATE_MAP`, sessions are bound to the engine with a
+    `schema_translate_map` execution option: schema-less tables are rendered in
+    the tenant schema after compilation, so the compiled statements cache of the
+    engine is shared by all the tenants. Textual SQL is not translated.
+    """
+
+    def __init__(
+        self,
+        process_name: ProcessName,
+        schema_routing: SchemaRouting = SchemaRouting.SEARCH_PATH,
+        *,
+        host: str | None = None,
+        port: int | None = None,
+        max_sessionmakers: int = settings.DATABASE_SHARED_MAX_SESSIONMAKERS,
+    ) -> None:
+        self.process_name = process_name
+        self.schema_routing = schema_routing
+        self.host = host
+        self.port = port
+        self.max_sessionmakers = max_sessionmakers
+        self._engine: AsyncEngine | None = None
+        self._sessionmakers: OrderedDict[tuple[SchemaName, bool], AsyncSessionMaker] = (
+            OrderedDict()
+        )
+
+    @property
+    def engine(self) -> AsyncEngine:
+        if self._engine is None:
+            self._engine = DatabaseEngine.create_shared_async_engine(
+                self.process_name, host=self.host, port=self.port
+            )
+        return self._engine
+
+    async def get_engine(self, schema_name: SchemaName) -> AsyncEngine:
+        return self.engine
+
+    async def get_sessionmaker(
+        self, schema_name: SchemaName, *, read_only: bool = False
+    ) -> AsyncSessionMaker:
+        key = (schema_name, read_only)
+        if (sessionmaker := self._sessionmakers.get(key)) is not None:
+            self._sessionmakers.move_to_end(key)
+            return sessionmaker
+
+        if self.schema_routing == SchemaRouting.TRANSLATE_MAP:
+            sessionmaker = SessionMakerFactory.create_async_sessionmaker(
+                self.engine.execution_options(schema_translate_map={None: schema_name}),
+                read_only=read_only,
+            )
+        else:
+            sessionmaker = SessionMakerFactory.create_async_sessionmaker(
+                self.engine, schema_name=schema_name, read_only=read_only
+            )
+        # Option engines share the pool of the engine: dropping them is free
+        self._sessionmakers[key] = sessionmaker
+        if len(self._sessionmakers) > self.max_sessionmakers:
+            self._sessionmakers.popitem(last=False)
+        return sessionmaker
+
+    async def dispose(self) -> None:
+        self._sessionmakers.clear()
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+
+
+def create_tenant_engines(
+    process_name: ProcessName,
+    schema_routing: SchemaRouting = settings.DATABASE_SCHEMA_ROUTING,
+    *,
+    host: str | None = None,
+    port: int | None = None,
+) -> TenantEngines:
+    """Engines of the primary, or of the Postgres server at `host:port`."""
+    if schema_routing in (SchemaRouting.SEARCH_PATH, SchemaRouting.TRANSLATE_MAP):
+        return SharedTenantEngine(process_name, schema_routing, host=host, port=port)
+    return TenantEngineRegistry(
+        process_name,
+        max_engines=settings.DATABASE_MAX_TENANT_ENGINES,
+        idle_seconds=settings.DATABASE_TENANT_ENGINE_IDLE_SECONDS,
+        host=host,
+        port=port,
+    )
+
+
+@dataclasses.dataclass
+class Replica:
+    name: str
+    engines: TenantEngines
+    weight: int
+    # Unknown until measured: reads go to the primary meanwhile
+    lag_seconds: float = math.inf
+
+
+class ReplicaRouter:
+    """
+    Picks the engines serving read-only sessions among weighted read replicas.
+
+    Replicas lagging more than `max_lag_seconds` behind the primary (or which
+    can't be reached) are skipped; when none is left, reads fall back to the
+    primary. The lag is measured with `pg_last_xact_replay_timestamp()` every
+    `lag_check_seconds` by `run`, in the background: reads use the last measure,
+    and a replica not answering within `lag_check_timeout_seconds` is skipped.
+
+    Reads of a client who wrote less than `read_your_writes_seconds` ago stick to
+    the primary so they see their own writes, whichever process serves them: the
+    writes are marked in Redis (and in the process, sparing Redis the reads of
+    its own writers). If Redis can't be reached, reads go to the primary.
+    """
+
+    max_sticky_clients = 10_000
+
+    def __init__(
+        self,
+        replicas: list[Replica],
+        *,
+        max_lag_seconds: float,
+        lag_check_seconds: float,
+        lag_check_timeout_seconds: float,
+        read_your_writes_seconds: float,
+        redis: Redis = redis,
+    ) -> None:
+        self.replicas = replicas
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check_seconds = lag_check_seconds
+        self.lag_check_timeout_seconds = lag_check_timeout_seconds
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self.redis = redis
+        self._last_writes: OrderedDict[str, float] = OrderedDict()
+
+    @classmethod
+    def from_settings(cls, process_name: ProcessName) -> "ReplicaRouter":
+        replicas: list[Replica] = []
+        for name, weight in settings.POSTGRES_REPLICAS.items():
+            host, _, port = name.partition(":")
+            engines = create_tenant_engines(
+                process_name, host=host, port=int(port) if port else None
+            )
+            replicas.append(Replica(name=name, engines=engines, weight=weight))
+
+        return cls(
+            replicas,
+            max_lag_seconds=settings.DATABASE_REPLICA_MAX_LAG_SECONDS,
+            lag_check_seconds=settings.DATABASE_REPLICA_LAG_CHECK_SECONDS,
+            lag_check_timeout_seconds=settings.DATABASE_REPLICA_LAG_CHECK_TIMEOUT_SECONDS,
+            read_your_writes_seconds=settings.DATABASE_READ_YOUR_WRITES_SECONDS,
+        )
+
+    async def mark_write(self, client_key: str) -> None:
+        if not self.replicas:
+            return
+        self._last_writes[client_key] = time.monotonic()
+        self._last_writes.move_to_end(client_key)
+        while len(self._last_writes) > self.max_sticky_clients:
+            self._last_writes.popitem(last=False)
+        try:
+            await self.redis.set(
+                f"{READ_YOUR_WRITES_PREFIX}{client_key}",
+                1,
+                px=int(self.read_your_writes_seconds * 1000),
+            )
+        except Exception as e:
+            log.warning(
+                f"{settings.app_name}.postgres.read_your_writes_failed", error=str(e)
+            )
+
+    async def is_sticky(self, client_key: str) -> bool:
+        last_write = self._last_writes.get(client_key)
+        if last_write is not None:
+            if time.monotonic() - last_write <= self.read_your_writes_seconds:
+                return True
+            del self._last_writes[client_key]
+
+        # Written through another process
+        try:
+            return bool(
+                await self.redis.exists(f"{READ_YOUR_WRITES_PREFIX}{client_key}")
+            )
+        except Exception as e:
+            log.warning(
+                f"{settings.app_name}.postgres.read_your_writes_failed", error=str(e)
+            )
+            return True
+
+    async def get_read_engines(self, client_key: str) -> TenantEngines | None:
+        """The engines of a replica, or None if the read must go to the primary."""
+        if not self.replicas or await self.is_sticky(client_key):
+            return None
+
+        candidates = [
+            replica
+            for replica in self.replicas
+            if replica.weight > 0 and replica.lag_seconds <= self.max_lag_seconds
+        ]
+        if not candidates:
+            return None
+
+        (replica,) = random.choices(
+            candidates, weights=[replica.weight for replica in candidates]
+        )
+        return replica.engines
+
+    async def run(self) -> None:
+        if not self.replicas:
+            return
+        while True:
+            await asyncio.gather(*map(self._measure_lag, self.replicas))
+            await asyncio.sleep(self.lag_check_seconds)
+
+    async def _measure_lag(self, replica: Replica) -> None:
+        try:
+            async with asyncio.timeout(self.lag_check_timeout_seconds):
+                engine = await replica.engines.get_engine(settings.SPECIAL_SCHEMA)
+                replica.lag_seconds = await get_replica_lag(engine)
+        except Exception as e:
+            replica.lag_seconds = math.inf
+            log.warning(
+                f"{settings.app_name}.postgres.replica_unavailable",
+                replica=replica.name,
+                error=str(e) or type(e).__name__,
+            )
+
+    async def dispose(self) -> None:
+        for replica in self.replicas:
+            await replica.engines.dispose()
+
+
+tenant_engines = create_tenant_engines("app")
+replica_router = ReplicaRouter.from_settings("app")
 
 
 class DatabaseSession:
+    @staticmethod
+    def is_read_only(request: Request) -> bool:
+        """Whether the matched route only serves safe methods, see `AutoCommitAPIRoute`."""
+        return bool(getattr(request.scope.get("route"), "read_only", False))
+
+    @staticmethod
+    def get_client_key(request: Request) -> str:
+        """Identifies the client for read-your-writes, see `ReplicaRouter`."""
+        tenant_context = (
+            TenantContext.get_tenant_context(request) or TenantContext.current()
+        )
+        client_host = request.client.host if request.client else None
+        return f"{tenant_context.tenant_id}:{tenant_context.sub_id or client_host}"
+
     @staticmethod
     async def get_db_sessionmaker(
         request: Request,
     ) -> AsyncGenerator[AsyncSessionMaker, None]:
-        async_sessionmaker: AsyncSessionMaker = request.state.async_sessionmaker
+        tenant_context = (
+            TenantContext.get_tenant_context(request) or TenantContext.current()
+        )
+        schema_name = get_schema_name(tenant_context.tenant_id)
+
+        engines: TenantEngines | None = None
+        read_only = DatabaseSession.is_read_only(request)
+        if read_only:
+            client_key = DatabaseSession.get_client_key(request)
+            engines = await replica_router.get_read_engines(client_key)
+
+        async_sessionmaker = await (engines or tenant_engines).get_sessionmaker(
+            schema_name, read_only=read_only
+        )
         yield async_sessionmaker
 
     default_async_sessionmaker = Depends(get_db_sessionmaker)
@@ -71,22 +556,41 @@ class DatabaseSession:
         sessionmaker: AsyncSessionMaker = default_async_sessionmaker,
     ) -> AsyncGenerator[AsyncSession, None]:
         """
-        Generates a new session for the request using the sessionmaker in the application state.
+        Generates a new session for the request using the sessionmaker of the tenant.
         Note that we store it in the request state: this way, we make sure we only have
         one session per request.
+
+        With `SchemaRouting.SEARCH_PATH`, the tenant schema is set at the beginning
+        of each transaction of the session.
+
+        The session only checks out a connection on its first statement: if the
+        endpoint never used it, commit and rollback are skipped altogether.
+
+        Read-only routes get a `READ ONLY` transaction (on a read replica, if any)
+        which is never committed: closing the session releases it. After a write
+        route which used its session, the reads of the same client stick to the
+        primary for a while.
         """
         if session := getattr(request.state, "session", None):
             yield session
         else:
-            async with sessionmaker() as session:
+            read_only = DatabaseSession.is_read_only(request)
+            async with sessionmaker(info={"read_only": read_only}) as session:
                 try:
                     request.state.session = session
                     yield session
                 except:
-                    await session.rollback()
+                    if holds_connection(session) and not read_only:
+                        await session.rollback()
                     raise
                 else:
-                    await session.commit()
+                    if holds_connection(session) and not read_only:
+                        await session.commit()
+                    # Committed here or by the route, see `AutoCommitAPIRoute`
+                    if session.info.get("used_connection") and not read_only:
+                        await replica_router.mark_write(
+                            DatabaseSession.get_client_key(request)
+                        )
 
 
 __all__ = [
@@ -94,6 +598,15 @@ __all__ = [
     "AsyncEngine",
     "EngineFactory",
     "DatabaseEngine",
+    "TenantEngines",
+    "TenantEngineRegistry",
+    "TenantEngineRegistryStats",
+    "SharedTenantEngine",
+    "create_tenant_engines",
+    "tenant_engines",
+    "Replica",
+    "ReplicaRouter",
+    "replica_router",
     "Session",
     "AsyncSession",
     "SyncSessionMaker",
@@ -0,0 +1,183 @@
+import asyncio
+import dataclasses
+import importlib
+import multiprocessing
+import os
+import signal
+from collections.abc import Callable, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import FrameType
+from typing import Any
+
+import structlog
+from structlog.typing import EventDict, WrappedLogger
+
+from app.infra.config import settings
+from app.providers.monitoring.logging import Logger
+
+log: Logger = structlog.get_logger()
+
+# Log events of the task running in this pool process
+_log_events: list[EventDict] = []
+
+
+def _collect_log_event(
+    logger: WrappedLogger, method_name: str, event_dict: EventDict
+) -> EventDict:
+    _log_events.append(event_dict)
+    raise structlog.DropEvent
+
+
+def _raise_timeout(signum: int, frame: FrameType | None) -> None:
+    raise TimeoutError("Task timed out in its process")
+
+
+def _init_process(modules: Sequence[str]) -> None:
+    """Warms up a pool process, before its first task."""
+    for module in modules:
+        importlib.import_module(module)
+
+    # Logs are sent back to the worker with the result, see `ProcessPool.run`,
+    # with the context of the job bound by `_call`
+    structlog.configure(
+        processors=[
+            structlog.contextvars.merge_contextvars,
+            structlog.stdlib.add_log_level,
+            structlog.processors.TimeStamper(fmt="iso", key="process_timestamp"),
+            structlog.processors.format_exc_info,
+            _collect_log_event,
+        ],
+        cache_logger_on_first_use=False,
+    )
+    signal.signal(signal.SIGALRM, _raise_timeout)
+
+
+@dataclasses.dataclass
+class _ProcessResult:
+    value: Any
+    error: Exception | None
+    log_events: list[EventDict]
+    pid: int
+
+
+def _call(
+    f: Callable[..., Any],
+    args: tuple[Any, ...],
+    kwargs: dict[str, Any],
+    log_context: Mapping[str, Any],
+    timeout: float | None,
+) -> _ProcessResult:
+    _log_events.clear()
+    structlog.contextvars.clear_contextvars()
+    structlog.contextvars.bind_contextvars(**log_context)
+
+    # The task can't be cancelled from the worker, it's interrupted here
+    signal.setitimer(signal.ITIMER_REAL, timeout or 0)
+    try:
+        value, error = f(*args, **kwargs), None
+    except Exception as e:
+        value, error = None, e
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    return _ProcessResult(
+        value=value, error=error, log_events=list(_log_events), pid=os.getpid()
+    )
+
+
+class ProcessPool:
+    """
+    Pool of processes running the CPU bound tasks (`@task(executor="process")`),
+    so they don't block the event loop of the worker.
+
+    The processes are spawned by `start` and import the modules of the tasks
+    right away, rather than with their first job. A task taking longer than its
+    timeout is interrupted in its process, which stays in the pool. A process
+    dying (e.g. killed for lack of memory) breaks the whole pool: the jobs
+    running in it fail, and the pool is started again for the next ones. The
+    log events of a task are emitted by the worker once it returns, with the
+    structlog context of the job.
+    """
+
+    def __init__(
+        self,
+        *,
+        size: int | None = settings.WORKER_PROCESS_POOL_SIZE,
+        modules: Sequence[str] = (),
+    ) -> None:
+        self.size = size or os.cpu_count() or 1
+        self.modules = [*settings.WORKER_PROCESS_PRELOAD, *modules]
+        self._executor: ProcessPoolExecutor | None = None
+
+    async def start(self) -> None:
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.size,
+            # Forking a process with a running event loop isn't safe
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process,
+            initargs=(self.modules,),
+        )
+        # Processes are spawned on demand: start them all now
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, os.getpid) for _ in range(self.size))
+        )
+        log.info(
+            f"{settings.app_name}.worker.process_pool.started",
+            processes=len(set(pids)),
+        )
+
+    async def run(
+        self,
+        f: Callable[..., Any],
+        args: tuple[Any, ...],
+        kwargs: dict[str, Any],
+        *,
+        timeout: float | None = settings.WORKER_PROCESS_TIMEOUT_SECONDS,
+    ) -> Any:
+        """Calls `f(*args, **kwargs)` in a process of the pool."""
+        if self._executor is None:
+            raise RuntimeError("The process pool isn't started")
+
+        executor = self._executor
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                executor,
+                _call,
+                f,
+                args,
+                kwargs,
+                structlog.contextvars.get_contextvars(),
+                timeout,
+            )
+        except BrokenProcessPool:
+            await self._restart(executor)
+            raise
+        for event_dict in result.log_events:
+            level = event_dict.pop("level", "info")
+            # The task may have logged a `pid` of its own
+            event_dict.setdefault("pid", result.pid)
+            getattr(log, level)(event_dict.pop("event"), **event_dict)
+
+        if result.error is not None:
+            raise result.error
+        return result.value
+
+    async def _restart(self, broken_executor: ProcessPoolExecutor) -> None:
+        # The jobs which were running in the pool all fail: the first one restarts it
+        if self._executor is not broken_executor:
+            return
+        log.error(f"{settings.app_name}.worker.process_pool.broken")
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+        await self.start()
+
+    async def shutdown(self) -> None:
+        if self._executor is not None:
+            await asyncio.to_thread(
+                self._executor.shutdown, wait=True, cancel_futures=True
+            )
+            self._executor = None
+
+
+__all__ = ["ProcessPool"]
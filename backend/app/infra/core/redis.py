@@ -1,32 +1,96 @@
-from typing import TYPE_CHECKING, cast
+import asyncio
+import functools
+from collections.abc import Callable, Coroutine
+from typing import TYPE_CHECKING, Any, cast
 
 import redis.asyncio as _async_redis  # type: ignore
+import structlog
 
 from app.infra.config import settings
+from app.providers.monitoring.logging import Logger
+
+log: Logger = structlog.get_logger()
 
 # https://github.com/python/typeshed/issues/7597#issuecomment-1117551641
 # Redis is generic at type checking, but not at runtime...
 if TYPE_CHECKING:
     Redis = _async_redis.Redis[str]  # type: ignore
+    BinaryRedis = _async_redis.Redis[bytes]  # type: ignore
     ConnectionPool = _async_redis.ConnectionPool[_async_redis.Connection]  # type: ignore
 else:
     Redis = _async_redis.Redis
+    BinaryRedis = _async_redis.Redis
     ConnectionPool = _async_redis.ConnectionPool
 
 
-def create_async_connection_pool() -> ConnectionPool:  # type: ignore
+def create_async_connection_pool(*, decode_responses: bool = True) -> ConnectionPool:  # type: ignore
     return _async_redis.ConnectionPool.from_url(
-        settings.redis_url, decode_responses=True
+        settings.redis_url, decode_responses=decode_responses
     )
 
 
 async_pool = create_async_connection_pool()
+# For the values which aren't text, e.g. compressed
+binary_async_pool = create_async_connection_pool(decode_responses=False)
 
 
 def get_redis() -> Redis:  # type: ignore
     return cast(Redis, _async_redis.Redis(connection_pool=async_pool))  # type: ignore
 
 
+def get_binary_redis() -> BinaryRedis:
+    return cast(BinaryRedis, _async_redis.Redis(connection_pool=binary_async_pool))  # type: ignore
+
+
 redis = get_redis()
+binary_redis = get_binary_redis()
+
+# Tasks run soon, referenced until they are done
+_background_tasks: set[asyncio.Task[None]] = set()
+
+
+def run_soon(f: Callable[[], Coroutine[Any, Any, None]]) -> bool:
+    """
+    Runs `f()` without waiting for it, from sync code running in the event
+    loop (e.g. session events). False if there is no running loop.
+
+    `f` handles its own errors.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    task = loop.create_task(f())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return True
+
+
+async def _publish(channel: str, message: str) -> None:
+    try:
+        await redis.publish(channel, message)
+    except Exception as e:
+        log.warning(
+            f"{settings.app_name}.redis.publish_failed",
+            channel=channel,
+            message=message,
+            error=str(e),
+        )
+
+
+def publish_soon(channel: str, message: str) -> bool:
+    """
+    Publishes `message` without waiting for it, from sync code running in the
+    event loop (e.g. session events). False if there is no running loop.
+    """
+    return run_soon(functools.partial(_publish, channel, message))
+
 
-__all__ = ["redis", "Redis"]
+__all__ = [
+    "redis",
+    "Redis",
+    "binary_redis",
+    "BinaryRedis",
+    "run_soon",
+    "publish_soon",
+]
@@ -0,0 +1,374 @@
+import asyncio
+import dataclasses
+import functools
+import hashlib
+import json
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import Awaitable, Collection, Mapping, Sequence
+from typing import cast
+from urllib.parse import parse_qsl, urlencode
+
+import msgpack
+import structlog
+from fastapi import Response
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import ORMExecuteState, UOWTransaction
+
+from app.data.dbs.postgres.postgres import Session, TrackedSession
+from app.data.models.tenant import Tenant
+from app.infra.config import settings
+from app.infra.core.context import TenantContext
+from app.infra.core.redis import BinaryRedis, Redis, binary_redis, run_soon
+from app.providers.monitoring.logging import Logger
+
+log: Logger = structlog.get_logger()
+
+RESPONSE_CACHE_PREFIX = f"{settings.app_name}:response_cache:"
+# Messages of {tenant_id: {tag: version}}, published when tags are invalidated
+RESPONSE_CACHE_CHANNEL = f"{settings.app_name}:response_cache"
+
+
+def get_cache_key(
+    tenant_id: str, path: str, query_string: str, headers: Sequence[str]
+) -> str:
+    """Key of a response, from its request: query parameters in any order match."""
+    query = urlencode(sorted(parse_qsl(query_string, keep_blank_values=True)))
+    digest = hashlib.blake2b(
+        "\n".join((path, query, *headers)).encode(), digest_size=16
+    ).hexdigest()
+    return f"{RESPONSE_CACHE_PREFIX}{tenant_id}:{digest}"
+
+
+@dataclasses.dataclass
+class CachedResponse:
+    status_code: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+    # Versions of the tags of the route, when the response was computed
+    versions: tuple[int, ...]
+    # Unix time, the entries being shared by the fleet
+    expires_at: float
+
+    def to_response(self) -> Response:
+        response = Response(self.body, status_code=self.status_code)
+        response.raw_headers = list(self.headers)
+        return response
+
+    def dumps(self) -> bytes:
+        return zlib.compress(
+            msgpack.packb(
+                [
+                    self.status_code,
+                    self.headers,
+                    self.body,
+                    self.versions,
+                    self.expires_at,
+                ]
+            )
+        )
+
+    @classmethod
+    def loads(cls, data: bytes) -> "CachedResponse":
+        status_code, headers, body, versions, expires_at = msgpack.unpackb(
+            zlib.decompress(data)
+        )
+        return cls(
+            status_code=status_code,
+            headers=[(name, value) for name, value in headers],
+            body=body,
+            versions=tuple(versions),
+            expires_at=expires_at,
+        )
+
+
+class ResponseCache:
+    """
+    Responses of the GET routes decorated with `@cache_response`, per tenant.
+
+    Responses are stored compressed in Redis, shared by the fleet, and the most
+    recently used ones are kept in process too, up to `local_max_bytes` of
+    bodies.
+
+    Routes are tagged with the tables they read. Each tag of a tenant has a
+    version in Redis, increased after the commits changing the table in the
+    tenant (see `_invalidate_response_cache`) and published to every process.
+    A response is only served while its tags have the versions it was computed
+    with: stale entries aren't deleted, just never served again. The versions
+    of up to `max_tenants` tenants are kept in memory, and all of them are
+    dropped every `reload_seconds` in case a change was missed.
+    """
+
+    def __init__(
+        self,
+        redis: BinaryRedis | None = None,
+        *,
+        local_max_bytes: int = settings.RESPONSE_CACHE_LOCAL_MAX_BYTES,
+        max_body_bytes: int = settings.RESPONSE_CACHE_MAX_BODY_BYTES,
+        max_tenants: int = settings.RESPONSE_CACHE_TENANTS_CACHE_SIZE,
+        reload_seconds: float = settings.RESPONSE_CACHE_RELOAD_SECONDS,
+    ) -> None:
+        self.redis = redis or binary_redis
+        self.local_max_bytes = local_max_bytes
+        self.max_body_bytes = max_body_bytes
+        self.max_tenants = max_tenants
+        self.reload_seconds = reload_seconds
+        self._responses: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._local_bytes = 0
+        self._versions: OrderedDict[str, dict[str, int]] = OrderedDict()
+        self._loads: dict[str, asyncio.Future[dict[str, int]]] = {}
+        # Versions published while the ones of their tenant were loading
+        self._updates: dict[str, dict[str, int]] = {}
+        # Invalidations of this process in flight, per tenant
+        self._invalidations: dict[str, int] = {}
+
+    async def get_versions(
+        self, tenant_id: str, tags: Sequence[str]
+    ) -> tuple[int, ...] | None:
+        """Versions of `tags`, None if they are unknown (the cache is bypassed)."""
+        # A request following a commit of this process sees its changes
+        if self._invalidations.get(tenant_id):
+            return None
+
+        versions = self._versions.get(tenant_id)
+        if versions is not None:
+            self._versions.move_to_end(tenant_id)
+        else:
+            load = self._loads.get(tenant_id)
+            if load is None:
+                load = asyncio.ensure_future(self._load(tenant_id))
+                self._loads[tenant_id] = load
+                load.add_done_callback(functools.partial(self._load_done, tenant_id))
+            try:
+                versions = await asyncio.shield(load)
+            except RedisError as e:
+                log.warning(
+                    f"{settings.app_name}.response_cache.redis_failed", error=str(e)
+                )
+                return None
+        return tuple(versions.get(tag, 0) for tag in tags)
+
+    async def get(self, key: str, versions: tuple[int, ...]) -> CachedResponse | None:
+        if (response := self._responses.get(key)) is not None:
+            if self._is_fresh(response, versions):
+                self._responses.move_to_end(key)
+                return response
+            self._forget(key)
+
+        try:
+            data = await self.redis.get(key)
+        except RedisError as e:
+            log.warning(
+                f"{settings.app_name}.response_cache.redis_failed", error=str(e)
+            )
+            return None
+        if data is None:
+            return None
+        response = CachedResponse.loads(data)
+        if not self._is_fresh(response, versions):
+            return None
+        self._remember(key, response)
+        return response
+
+    def put(self, key: str, response: CachedResponse) -> None:
+        """Caches `response` in process, and in Redis without waiting for it."""
+        self._remember(key, response)
+        run_soon(functools.partial(self._store, key, response))
+
+    def invalidate_soon(self, changes: Mapping[str, Collection[str]]) -> bool:
+        """
+        Increases the versions of the tags `changes` ({tenant_id: tags}) without
+        waiting for it, from sync code running in the event loop (e.g. session
+        events). False if there is no running loop.
+        """
+        if not run_soon(functools.partial(self._invalidate_soon, changes)):
+            return False
+        for tenant_id in changes:
+            self._invalidations[tenant_id] = self._invalidations.get(tenant_id, 0) + 1
+        return True
+
+    async def _invalidate_soon(self, changes: Mapping[str, Collection[str]]) -> None:
+        try:
+            await self.invalidate(changes)
+        finally:
+            for tenant_id in changes:
+                if (count := self._invalidations[tenant_id] - 1) > 0:
+                    self._invalidations[tenant_id] = count
+                else:
+                    del self._invalidations[tenant_id]
+
+    async def invalidate(self, changes: Mapping[str, Collection[str]]) -> None:
+        keys = [(tenant_id, tag) for tenant_id, tags in changes.items() for tag in tags]
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for tenant_id, tag in keys:
+                    pipe.hincrby(self._get_tags_key(tenant_id), tag, 1)
+                results = await pipe.execute()
+
+            versions: dict[str, dict[str, int]] = {}
+            for (tenant_id, tag), version in zip(keys, results, strict=True):
+                versions.setdefault(tenant_id, {})[tag] = version
+            self.update(versions)
+            await self.redis.publish(RESPONSE_CACHE_CHANNEL, json.dumps(versions))
+        except RedisError as e:
+            # Left to the TTLs of the responses
+            log.warning(
+                f"{settings.app_name}.response_cache.invalidation_failed",
+                tenant_ids=sorted(changes),
+                error=str(e),
+            )
+
+    def update(self, versions: Mapping[str, Mapping[str, int]]) -> None:
+        """Applies the versions published by an invalidation."""
+        for tenant_id, tag_versions in versions.items():
+            current = self._versions.get(tenant_id)
+            if current is None:
+                if tenant_id not in self._loads:
+                    continue
+                current = self._updates.setdefault(tenant_id, {})
+            # Publications of concurrent invalidations may arrive in any order
+            for tag, version in tag_versions.items():
+                current[tag] = max(current.get(tag, 0), version)
+
+    async def run(self, redis: Redis) -> None:
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(RESPONSE_CACHE_CHANNEL)
+                    # Changes may have been missed while unsubscribed
+                    self._versions.clear()
+                    while True:
+                        message = await pubsub.get_message(
+                            ignore_subscribe_messages=True, timeout=self.reload_seconds
+                        )
+                        if message is None:
+                            self._versions.clear()
+                            continue
+                        self.update(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(
+                    f"{settings.app_name}.response_cache.refresh_failed", error=str(e)
+                )
+                await asyncio.sleep(1)
+
+    @staticmethod
+    def _get_tags_key(tenant_id: str) -> str:
+        return f"{RESPONSE_CACHE_PREFIX}{tenant_id}:tags"
+
+    @staticmethod
+    def _is_fresh(response: CachedResponse, versions: tuple[int, ...]) -> bool:
+        return response.versions == versions and response.expires_at > time.time()
+
+    def _remember(self, key: str, response: CachedResponse) -> None:
+        self._forget(key)
+        self._responses[key] = response
+        self._local_bytes += len(response.body)
+        while self._local_bytes > self.local_max_bytes:
+            _, evicted = self._responses.popitem(last=False)
+            self._local_bytes -= len(evicted.body)
+
+    def _forget(self, key: str) -> None:
+        if (response := self._responses.pop(key, None)) is not None:
+            self._local_bytes -= len(response.body)
+
+    async def _store(self, key: str, response: CachedResponse) -> None:
+        ttl_ms = int((response.expires_at - time.time()) * 1000)
+        if ttl_ms <= 0:
+            return
+        try:
+            await self.redis.set(key, response.dumps(), px=ttl_ms)
+        except RedisError as e:
+            log.warning(
+                f"{settings.app_name}.response_cache.redis_failed", error=str(e)
+            )
+
+    async def _load(self, tenant_id: str) -> dict[str, int]:
+        versions = await cast(
+            Awaitable[dict[bytes, bytes]],
+            self.redis.hgetall(self._get_tags_key(tenant_id)),
+        )
+        return {tag.decode(): int(version) for tag, version in versions.items()}
+
+    def _load_done(self, tenant_id: str, load: asyncio.Future[dict[str, int]]) -> None:
+        del self._loads[tenant_id]
+        updates = self._updates.pop(tenant_id, {})
+        if load.cancelled() or load.exception() is not None:
+            return
+        versions = load.result()
+        for tag, version in updates.items():
+            versions[tag] = max(versions.get(tag, 0), version)
+        self._versions[tenant_id] = versions
+        if len(self._versions) > self.max_tenants:
+            self._versions.popitem(last=False)
+
+
+response_cache = ResponseCache()
+
+
+def _add_change(session: Session, tenant_id: object, tag: str) -> None:
+    tenant_id = tenant_id or TenantContext.current().tenant_id
+    if tenant_id is not None:
+        changes = session.info.setdefault("response_cache_changes", {})
+        changes.setdefault(str(tenant_id), set()).add(tag)
+
+
+def _track_response_cache_changes(
+    session: Session, flush_context: UOWTransaction
+) -> None:
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        tenant_id = (
+            obj.id if isinstance(obj, Tenant) else getattr(obj, "tenant_id", None)
+        )
+        _add_change(session, tenant_id, obj.__tablename__)
+
+
+def _track_response_cache_statements(orm_execute_state: ORMExecuteState) -> None:
+    # Bulk INSERT, UPDATE and DELETE statements, which don't go through a flush
+    if not (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        return
+    if (mapper := orm_execute_state.bind_mapper) is not None:
+        _add_change(orm_execute_state.session, None, mapper.class_.__tablename__)
+
+
+def _invalidate_response_cache(session: Session) -> None:
+    # Copies don't go through the ORM, see `bulk_copy`
+    for table_name in session.info.pop("copied_tables", ()):
+        _add_change(session, None, table_name)
+    if not (changes := session.info.pop("response_cache_changes", None)):
+        return
+    if not response_cache.invalidate_soon(changes):
+        # Sync sessions outside of the event loop: left to the TTLs
+        log.warning(
+            f"{settings.app_name}.response_cache.not_invalidated",
+            changes={tenant_id: sorted(tags) for tenant_id, tags in changes.items()},
+        )
+
+
+def _forget_response_cache_changes(session: Session) -> None:
+    session.info.pop("response_cache_changes", None)
+    session.info.pop("copied_tables", None)
+
+
+event.listen(TrackedSession, "after_flush", _track_response_cache_changes)
+event.listen(TrackedSession, "do_orm_execute", _track_response_cache_statements)
+event.listen(TrackedSession, "after_commit", _invalidate_response_cache)
+event.listen(TrackedSession, "after_rollback", _forget_response_cache_changes)
+
+
+__all__ = [
+    "RESPONSE_CACHE_CHANNEL",
+    "get_cache_key",
+    "CachedResponse",
+    "ResponseCache",
+    "response_cache",
+]
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import time
+
+import structlog
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import UOWTransaction
+
+from app.data.dbs.postgres.postgres import Session, TrackedSession
+from app.data.models.tenant import Tenant
+from app.infra.config import settings
+from app.infra.core.postgres import TenantEngines, tenant_engines
+from app.infra.core.redis import Redis, publish_soon
+from app.infra.kit.enums import Status
+from app.providers.monitoring.logging import Logger
+
+log: Logger = structlog.get_logger()
+
+# Messages of {tenant_id: domain or None}, published when tenants change
+TENANT_HOSTS_CHANNEL = f"{settings.app_name}:tenant_hosts"
+
+
+def normalize_host(host: str) -> str:
+    return host.partition(":")[0].rstrip(".").lower()
+
+
+class _HostNode:
+    __slots__ = ("children", "tenant_id", "wildcard_tenant_id")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _HostNode] = {}
+        self.tenant_id: str | None = None
+        # Tenant of `*.<this host>`, i.e. of any of its subdomains
+        self.wildcard_tenant_id: str | None = None
+
+
+class HostTrie:
+    """
+    Tenants by host, in a trie of their labels from the TLD down.
+
+    Patterns are hosts (`shop.example.com`) or wildcards (`*.example.com`,
+    matching the subdomains of any depth). A lookup walks the labels of the
+    host once, the most specific pattern winning.
+    """
+
+    def __init__(self) -> None:
+        self._root = _HostNode()
+
+    def add(self, pattern: str, tenant_id: str) -> None:
+        wildcard, labels = self._split(pattern)
+        node = self._root
+        for label in labels:
+            node = node.children.setdefault(label, _HostNode())
+        if wildcard:
+            node.wildcard_tenant_id = tenant_id
+        else:
+            node.tenant_id = tenant_id
+
+    def remove(self, pattern: str) -> None:
+        wildcard, labels = self._split(pattern)
+        path = [self._root]
+        for label in labels:
+            if (child := path[-1].children.get(label)) is None:
+                return
+            path.append(child)
+        if wildcard:
+            path[-1].wildcard_tenant_id = None
+        else:
+            path[-1].tenant_id = None
+
+        # Prune the nodes left empty
+        for depth in range(len(labels), 0, -1):
+            node = path[depth]
+            if node.children or node.tenant_id or node.wildcard_tenant_id:
+                break
+            del path[depth - 1].children[labels[depth - 1]]
+
+    def lookup(self, host: str) -> str | None:
+        labels = normalize_host(host).split(".")
+        node = self._root
+        tenant_id = None
+        for label in reversed(labels):
+            # A wildcard matches if there is at least one label left
+            tenant_id = node.wildcard_tenant_id or tenant_id
+            if (child := node.children.get(label)) is None:
+                return tenant_id
+            node = child
+        return node.tenant_id or tenant_id
+
+    @staticmethod
+    def _split(pattern: str) -> tuple[bool, list[str]]:
+        labels = normalize_host(pattern).split(".")
+        wildcard = labels[0] == "*"
+        return wildcard, list(reversed(labels[1:] if wildcard else labels))
+
+
+class TenantHostIndex:
+    """
+    Active tenants by their custom domain (`Tenant.domain`), in memory.
+
+    The index is loaded from the `tenants` table, then kept up to date by the
+    changes published on `TENANT_HOSTS_CHANNEL` after the commits changing a
+    tenant (see `_publish_host_changes`). It is reloaded whenever it subscribes
+    again, and every `reload_seconds` to catch up on any message lost.
+    """
+
+    def __init__(
+        self,
+        *,
+        reload_seconds: float = settings.TENANT_HOSTS_RELOAD_SECONDS,
+    ) -> None:
+        self.reload_seconds = reload_seconds
+        self._trie = HostTrie()
+        self._domains: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._domains)
+
+    def lookup(self, host: str) -> str | None:
+        return self._trie.lookup(host)
+
+    def update(self, tenant_id: str, domain: str | None) -> None:
+        if (previous := self._domains.pop(tenant_id, None)) is not None:
+            self._trie.remove(previous)
+        if domain:
+            self._domains[tenant_id] = domain
+            self._trie.add(domain, tenant_id)
+
+    async def load(self, engines: TenantEngines | None = None) -> None:
+        sessionmaker = await (engines or tenant_engines).get_sessionmaker(
+            settings.SPECIAL_SCHEMA
+        )
+        async with sessionmaker() as session:
+            result = await session.execute(
+                select(Tenant.id, Tenant.domain).where(
+                    Tenant.status == Status.ACTIVE, Tenant.domain.is_not(None)
+                )
+            )
+            rows = result.tuples().all()
+
+        trie = HostTrie()
+        domains: dict[str, str] = {}
+        for tenant_id, domain in rows:
+            if domain:
+                domains[str(tenant_id)] = domain
+                trie.add(domain, str(tenant_id))
+        self._trie, self._domains = trie, domains
+        log.info(f"{settings.app_name}.tenant_hosts.loaded", hosts=len(domains))
+
+    async def run(self, redis: Redis, engines: TenantEngines | None = None) -> None:
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(TENANT_HOSTS_CHANNEL)
+                    while True:
+                        await self.load(engines)
+                        reload_at = time.monotonic() + self.reload_seconds
+                        while (timeout := reload_at - time.monotonic()) > 0:
+                            message = await pubsub.get_message(
+                                ignore_subscribe_messages=True, timeout=timeout
+                            )
+                            if message is not None:
+                                for tenant_id, domain in json.loads(
+                                    message["data"]
+                                ).items():
+                                    self.update(tenant_id, domain)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(
+                    f"{settings.app_name}.tenant_hosts.refresh_failed", error=str(e)
+                )
+                await asyncio.sleep(1)
+
+
+tenant_host_index = TenantHostIndex()
+
+
+def _track_host_changes(session: Session, flush_context: UOWTransaction) -> None:
+    changes: dict[str, str | None] = {}
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if not isinstance(obj, Tenant):
+            continue
+        state = inspect(obj)
+        if obj in session.deleted:
+            changes[str(obj.id)] = None
+        elif (
+            obj in session.new
+            or state.attrs.domain.history.has_changes()
+            or state.attrs.status.history.has_changes()
+        ):
+            changes[str(obj.id)] = obj.domain if obj.status == Status.ACTIVE else None
+    if changes:
+        session.info.setdefault("tenant_host_changes", {}).update(changes)
+
+
+def _publish_host_changes(session: Session) -> None:
+    if not (changes := session.info.pop("tenant_host_changes", None)):
+        return
+    if not publish_soon(TENANT_HOSTS_CHANNEL, json.dumps(changes)):
+        # Sync sessions outside of the event loop: left to the periodic reload
+        log.warning(f"{settings.app_name}.tenant_hosts.not_published", changes=changes)
+
+
+def _forget_host_changes(session: Session) -> None:
+    session.info.pop("tenant_host_changes", None)
+
+
+event.listen(TrackedSession, "after_flush", _track_host_changes)
+event.listen(TrackedSession, "after_commit", _publish_host_changes)
+event.listen(TrackedSession, "after_rollback", _forget_host_changes)
+
+
+__all__ = [
+    "TENANT_HOSTS_CHANNEL",
+    "normalize_host",
+    "HostTrie",
+    "TenantHostIndex",
+    "tenant_host_index",
+]
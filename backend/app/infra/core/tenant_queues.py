@@ -0,0 +1,275 @@
+import asyncio
+import dataclasses
+from collections import deque
+from collections.abc import Mapping
+
+import structlog
+from arq.connections import ArqRedis
+from arq.constants import in_progress_key_prefix
+from arq.utils import timestamp_ms
+
+from app.infra.config import settings
+from app.providers.monitoring.logging import Logger
+from app.providers.monitoring.performance import Sample, sample
+
+log: Logger = structlog.get_logger()
+
+TENANT_QUEUE_PREFIX = f"{settings.DEFAULT_QUEUE_NAME}:tenant:"
+# Set of the tenant queues holding jobs
+TENANT_QUEUES_KEY = f"{settings.DEFAULT_QUEUE_NAME}:tenants"
+
+# Moves jobs from tenant queues to the worker queue, and forgets the queues
+# left empty. KEYS: worker queue, TENANT_QUEUES_KEY, tenant queues...
+# ARGV: (index of the tenant queue in KEYS, job ID, score) triples
+DISPATCH_SCRIPT = """
+local moved = 0
+for i = 1, #ARGV, 3 do
+  local queue = KEYS[tonumber(ARGV[i])]
+  if redis.call('ZREM', queue, ARGV[i + 1]) == 1 then
+    redis.call('ZADD', KEYS[1], ARGV[i + 2], ARGV[i + 1])
+    moved = moved + 1
+  end
+end
+for i = 3, #KEYS do
+  if redis.call('ZCARD', KEYS[i]) == 0 then
+    redis.call('SREM', KEYS[2], KEYS[i])
+  end
+end
+return moved
+"""
+
+# Ready jobs of the worker queue no worker started yet: arq keeps the jobs it
+# runs in the queue until they finish. Workers take the jobs oldest first, so
+# the waiting ones are the newest: only the newest ARGV[3] ready jobs are looked
+# at, which bounds the time Redis spends in the script.
+# KEYS: worker queue. ARGV: now, prefix of the in-progress keys, limit
+WAITING_JOBS_SCRIPT = """
+local waiting = 0
+local jobs = redis.call(
+  'ZREVRANGEBYSCORE', KEYS[1], ARGV[1], '-inf', 'LIMIT', 0, tonumber(ARGV[3])
+)
+for _, job_id in ipairs(jobs) do
+  if redis.call('EXISTS', ARGV[2] .. job_id) == 0 then
+    waiting = waiting + 1
+  end
+end
+return waiting
+"""
+
+
+def get_tenant_queue_name(tenant_id: str | None) -> str:
+    return f"{TENANT_QUEUE_PREFIX}{tenant_id or settings.SPECIAL_SCHEMA}"
+
+
+def is_tenant_queue(queue_name: str) -> bool:
+    return queue_name.startswith(TENANT_QUEUE_PREFIX)
+
+
+def get_tenant_weight(queue_name: str) -> int:
+    tenant_id = queue_name.removeprefix(TENANT_QUEUE_PREFIX)
+    return max(
+        settings.WORKER_TENANT_WEIGHTS.get(tenant_id, settings.WORKER_TENANT_WEIGHT),
+        1,
+    )
+
+
+def deficit_round_robin[T](
+    ready: Mapping[str, list[T]],
+    order: list[str],
+    weights: Mapping[str, int],
+    deficits: dict[str, int],
+    budget: int,
+) -> list[tuple[str, T]]:
+    """
+    Picks up to `budget` items of the `ready` queues, each queue getting a share
+    proportional to its weight.
+
+    A backlogged queue keeps its unused deficit for the next call; an emptied
+    one loses it, so idle tenants can't save up credit.
+    """
+    picked: list[tuple[str, T]] = []
+    offsets = dict.fromkeys(ready, 0)
+    active = [queue for queue in order if ready.get(queue)]
+    while budget > 0 and active:
+        for queue in list(active):
+            deficits[queue] = deficits.get(queue, 0) + weights.get(queue, 1)
+            items = ready[queue]
+            count = min(deficits[queue], len(items) - offsets[queue], budget)
+            picked.extend((queue, item) for item in items[offsets[queue] :][:count])
+            offsets[queue] += count
+            deficits[queue] -= count
+            budget -= count
+            if offsets[queue] == len(items):
+                deficits[queue] = 0
+                active.remove(queue)
+            if budget == 0:
+                break
+    return picked
+
+
+class TenantQueueScheduler:
+    """
+    Feeds the worker queue from the tenant queues with weighted deficit
+    round-robin, so a noisy tenant can't starve the others.
+
+    The worker queue is kept shallow (`WORKER_SCHEDULER_READY_JOBS` ready jobs
+    waiting for a worker, the running ones aside), fairness being decided here
+    rather than by the order of the worker queue.
+    Several workers can run a scheduler: jobs are moved by a Lua script, so each
+    of them is dispatched once.
+    """
+
+    def __init__(
+        self,
+        redis: ArqRedis,
+        *,
+        queue_name: str = settings.DEFAULT_QUEUE_NAME,
+        ready_jobs: int = settings.WORKER_SCHEDULER_READY_JOBS,
+        poll_delay: float = settings.WORKER_SCHEDULER_POLL_SECONDS,
+    ) -> None:
+        self.redis = redis
+        self.queue_name = queue_name
+        self.ready_jobs = ready_jobs
+        self.poll_delay = poll_delay
+        self._order: deque[str] = deque()
+        self._deficits: dict[str, int] = {}
+        self._dispatch_script = redis.register_script(DISPATCH_SCRIPT)
+        self._waiting_jobs_script = redis.register_script(WAITING_JOBS_SCRIPT)
+
+    async def dispatch(self) -> int:
+        """Moves a fair share of the ready tenant jobs to the worker queue."""
+        queues = sorted(
+            queue.decode() if isinstance(queue, bytes) else queue
+            for queue in await self.redis.smembers(TENANT_QUEUES_KEY)  # type: ignore[misc]
+        )
+        if not queues:
+            return 0
+
+        now = timestamp_ms()
+        waiting: int = await self._waiting_jobs_script(
+            keys=[self.queue_name],
+            args=[now, in_progress_key_prefix, self.ready_jobs],
+        )
+        budget = self.ready_jobs - waiting
+        if budget <= 0:
+            return 0
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for queue in queues:
+                pipe.zrangebyscore(
+                    queue, "-inf", now, start=0, num=budget, withscores=True
+                )
+            results = await pipe.execute()
+        ready: dict[str, list[tuple[str, float]]] = {
+            queue: [
+                (job_id.decode() if isinstance(job_id, bytes) else job_id, score)
+                for job_id, score in jobs
+            ]
+            for queue, jobs in zip(queues, results, strict=True)
+        }
+
+        # Rotate the starting queue, so ties don't always favor the same tenant
+        for queue in queues:
+            if queue not in self._order:
+                self._order.append(queue)
+        for queue in list(self._order):
+            if queue not in ready:
+                self._order.remove(queue)
+                self._deficits.pop(queue, None)
+        self._order.rotate(-1)
+
+        picked = deficit_round_robin(
+            ready,
+            list(self._order),
+            {queue: get_tenant_weight(queue) for queue in queues},
+            self._deficits,
+            budget,
+        )
+        keys = [self.queue_name, TENANT_QUEUES_KEY, *queues]
+        args: list[str | int] = []
+        for queue, (job_id, score) in picked:
+            args.extend((keys.index(queue) + 1, job_id, int(score)))
+        moved: int = await self._dispatch_script(keys=keys, args=args)
+        return moved
+
+    async def run(self) -> None:
+        log.info(f"{settings.app_name}.worker.tenant_queues.started")
+        while True:
+            try:
+                moved = await self.dispatch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(
+                    f"{settings.app_name}.worker.tenant_queues.dispatch_failed",
+                    error=str(e),
+                )
+                moved = 0
+            # Keep dispatching while there is room and backlog
+            if not moved:
+                await asyncio.sleep(self.poll_delay)
+
+
+@dataclasses.dataclass
+class TenantQueueStats:
+    queue_name: str
+    # All the jobs, deferred ones included
+    depth: int
+    ready: int
+    # Age of the oldest ready job
+    wait_seconds: float
+
+
+async def get_tenant_queue_stats(redis: ArqRedis) -> list[TenantQueueStats]:
+    queues = sorted(
+        queue.decode() if isinstance(queue, bytes) else queue
+        for queue in await redis.smembers(TENANT_QUEUES_KEY)  # type: ignore[misc]
+    )
+    now = timestamp_ms()
+    async with redis.pipeline(transaction=False) as pipe:
+        for queue in queues:
+            pipe.zcard(queue)
+            pipe.zcount(queue, "-inf", now)
+            pipe.zrange(queue, 0, 0, withscores=True)
+        results = await pipe.execute()
+
+    stats = []
+    for index, queue in enumerate(queues):
+        depth, ready, oldest = results[index * 3 : index * 3 + 3]
+        wait_ms = now - oldest[0][1] if ready and oldest else 0
+        stats.append(
+            TenantQueueStats(
+                queue_name=queue,
+                depth=depth,
+                ready=ready,
+                wait_seconds=max(wait_ms, 0) / 1000,
+            )
+        )
+    return stats
+
+
+async def tenant_queue_samples(redis: ArqRedis) -> list[Sample]:
+    prefix = f"{settings.app_name}_worker_tenant_queue"
+    samples: list[Sample] = []
+    for stats in await get_tenant_queue_stats(redis):
+        labels = {"tenant": stats.queue_name.removeprefix(TENANT_QUEUE_PREFIX)}
+        for name, value in (
+            ("depth", stats.depth),
+            ("ready", stats.ready),
+            ("wait_seconds", stats.wait_seconds),
+        ):
+            samples.append(
+                (f"{prefix}_{name}", "gauge", sample(f"{prefix}_{name}", labels, value))
+            )
+    return samples
+
+
+__all__ = [
+    "get_tenant_queue_name",
+    "is_tenant_queue",
+    "deficit_round_robin",
+    "TenantQueueScheduler",
+    "TenantQueueStats",
+    "get_tenant_queue_stats",
+    "tenant_queue_samples",
+]
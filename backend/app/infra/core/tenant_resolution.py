@@ -0,0 +1,260 @@
+import asyncio
+import functools
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Literal, TypeAlias
+
+import structlog
+from redis.exceptions import RedisError
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import UOWTransaction
+
+from app.data.dbs.postgres.postgres import Session, TrackedSession
+from app.data.models.tenant import Tenant
+from app.infra.config import settings
+from app.infra.core.postgres import TenantEngines, tenant_engines
+from app.infra.core.redis import Redis, redis, run_soon
+from app.infra.kit.enums import Status
+from app.providers.monitoring.logging import Logger
+
+log: Logger = structlog.get_logger()
+
+# How a request names its tenant: its ID (header, path) or its slug (subdomain)
+TenantKey: TypeAlias = tuple[Literal["id", "slug"], str]
+
+TENANT_RESOLUTION_PREFIX = f"{settings.app_name}:tenant_resolution:"
+# Messages of the [kind, value] keys to forget, published when tenants change
+TENANT_RESOLUTION_CHANNEL = f"{settings.app_name}:tenant_resolution"
+
+
+def normalize_tenant_key(key: TenantKey) -> TenantKey | None:
+    """Canonical form of `key`, or None if it can't name a tenant."""
+    kind, value = key
+    if kind == "id":
+        try:
+            return kind, str(uuid.UUID(value))
+        except ValueError:
+            return None
+    return (kind, value.lower()) if value else None
+
+
+def get_redis_key(key: TenantKey) -> str:
+    return f"{TENANT_RESOLUTION_PREFIX}{key[0]}:{key[1]}"
+
+
+class TenantResolver:
+    """
+    Resolves the tenant named by a request to the ID of an active tenant.
+
+    Resolutions are cached in process (at most `max_size` of them, least
+    recently used first out) and in Redis, both for `ttl` seconds, so the
+    `tenants` table is only read once per key and TTL by the whole fleet.
+    Unknown keys are cached too, as None. Concurrent misses of a key share a
+    single lookup.
+
+    The keys of a tenant are forgotten by every process on the messages
+    published on `TENANT_RESOLUTION_CHANNEL` after the commits changing it (see
+    `_publish_tenant_changes`), so a suspended tenant stops resolving at once.
+    A lookup in flight when its key is invalidated may have read the tenant
+    before the change: its result isn't cached, in process nor in Redis.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        engines: TenantEngines | None = None,
+        *,
+        max_size: int = settings.TENANT_RESOLUTION_CACHE_SIZE,
+        ttl: float = settings.TENANT_RESOLUTION_TTL_SECONDS,
+    ) -> None:
+        self.redis = redis
+        self.engines = engines or tenant_engines
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache: OrderedDict[TenantKey, tuple[str | None, float]] = OrderedDict()
+        self._lookups: dict[TenantKey, asyncio.Future[str | None]] = {}
+        # Lookups are outdated by the invalidations of their key after their start,
+        # counted by `_epoch`; only remembered while lookups are in flight
+        self._epoch = 0
+        self._invalidated: dict[TenantKey, int] = {}
+        self._in_flight = 0
+
+    async def resolve(self, key: TenantKey) -> str | None:
+        if (normalized := normalize_tenant_key(key)) is None:
+            return None
+
+        if entry := self._cache.get(normalized):
+            tenant_id, expires_at = entry
+            if expires_at > time.monotonic():
+                self._cache.move_to_end(normalized)
+                return tenant_id
+            del self._cache[normalized]
+
+        lookup = self._lookups.get(normalized)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self._lookup(normalized, self._epoch))
+            self._lookups[normalized] = lookup
+            self._in_flight += 1
+            lookup.add_done_callback(
+                functools.partial(self._lookup_done, normalized, self._epoch)
+            )
+        # A cancelled request doesn't cancel the lookup of the others
+        return await asyncio.shield(lookup)
+
+    def invalidate(self, key: TenantKey) -> None:
+        """Forgets `key` in this process, e.g. after its tenant changed."""
+        if (normalized := normalize_tenant_key(key)) is None:
+            return
+        self._cache.pop(normalized, None)
+        if self._in_flight:
+            self._epoch += 1
+            self._invalidated[normalized] = self._epoch
+            # Requests from now on don't wait for an outdated lookup
+            self._lookups.pop(normalized, None)
+
+    async def run(self, redis: Redis) -> None:
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(TENANT_RESOLUTION_CHANNEL)
+                    # Changes may have been missed while unsubscribed
+                    self._cache.clear()
+                    while True:
+                        message = await pubsub.get_message(
+                            ignore_subscribe_messages=True, timeout=None
+                        )
+                        if message is None:
+                            continue
+                        for kind, value in json.loads(message["data"]):
+                            self.invalidate((kind, value))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(
+                    f"{settings.app_name}.tenant_resolution.refresh_failed",
+                    error=str(e),
+                )
+                await asyncio.sleep(1)
+
+    def _is_outdated(self, key: TenantKey, epoch: int) -> bool:
+        return self._invalidated.get(key, 0) > epoch
+
+    def _lookup_done(
+        self, key: TenantKey, epoch: int, lookup: asyncio.Future[str | None]
+    ) -> None:
+        if self._lookups.get(key) is lookup:
+            del self._lookups[key]
+        outdated = self._is_outdated(key, epoch)
+        self._in_flight -= 1
+        if not self._in_flight:
+            self._invalidated.clear()
+        if outdated or lookup.cancelled() or lookup.exception() is not None:
+            return
+        self._cache[key] = (lookup.result(), time.monotonic() + self.ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def _lookup(self, key: TenantKey, epoch: int) -> str | None:
+        redis_key = get_redis_key(key)
+        try:
+            cached = await self.redis.get(redis_key)
+        except RedisError as e:
+            log.warning(
+                f"{settings.app_name}.tenant_resolution.redis_failed", error=str(e)
+            )
+            return await self._load(key)
+        if cached is not None:
+            return cached or None
+
+        tenant_id = await self._load(key)
+        if self._is_outdated(key, epoch):
+            return tenant_id
+        try:
+            await self.redis.set(redis_key, tenant_id or "", px=int(self.ttl * 1000))
+        except RedisError as e:
+            log.warning(
+                f"{settings.app_name}.tenant_resolution.redis_failed", error=str(e)
+            )
+        return tenant_id
+
+    async def _load(self, key: TenantKey) -> str | None:
+        kind, value = key
+        statement = select(Tenant.id).where(Tenant.status == Status.ACTIVE)
+        if kind == "id":
+            statement = statement.where(Tenant.id == uuid.UUID(value))
+        else:
+            statement = statement.where(Tenant.name == value)
+
+        sessionmaker = await self.engines.get_sessionmaker(settings.SPECIAL_SCHEMA)
+        async with sessionmaker() as session:
+            tenant_id = (await session.execute(statement)).scalar_one_or_none()
+        return str(tenant_id) if tenant_id is not None else None
+
+
+tenant_resolver = TenantResolver(redis)
+
+
+def _track_tenant_changes(session: Session, flush_context: UOWTransaction) -> None:
+    keys: set[TenantKey] = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if not isinstance(obj, Tenant):
+            continue
+        state = inspect(obj)
+        name_history = state.attrs.name.history
+        if (
+            obj in session.new
+            or obj in session.deleted
+            or name_history.has_changes()
+            or state.attrs.status.history.has_changes()
+        ):
+            # New tenants may have been cached as unknown
+            keys.add(("id", str(obj.id)))
+            for name in (obj.name, *name_history.deleted):
+                keys.add(("slug", name))
+    normalized = {key for key in map(normalize_tenant_key, keys) if key is not None}
+    if normalized:
+        session.info.setdefault("tenant_resolution_changes", set()).update(normalized)
+
+
+async def _forget_tenant_keys(keys: list[TenantKey]) -> None:
+    try:
+        # Before the message, or a process could read the outdated key again
+        await redis.delete(*map(get_redis_key, keys))
+        await redis.publish(TENANT_RESOLUTION_CHANNEL, json.dumps(keys))
+    except Exception as e:
+        log.warning(
+            f"{settings.app_name}.tenant_resolution.not_published",
+            keys=keys,
+            error=str(e),
+        )
+
+
+def _publish_tenant_changes(session: Session) -> None:
+    if not (keys := session.info.pop("tenant_resolution_changes", None)):
+        return
+    if not run_soon(functools.partial(_forget_tenant_keys, sorted(keys))):
+        # Sync sessions outside of the event loop: left to the TTL
+        log.warning(
+            f"{settings.app_name}.tenant_resolution.not_published", keys=sorted(keys)
+        )
+
+
+def _forget_tenant_changes(session: Session) -> None:
+    session.info.pop("tenant_resolution_changes", None)
+
+
+event.listen(TrackedSession, "after_flush", _track_tenant_changes)
+event.listen(TrackedSession, "after_commit", _publish_tenant_changes)
+event.listen(TrackedSession, "after_rollback", _forget_tenant_changes)
+
+
+__all__ = [
+    "TenantKey",
+    "TENANT_RESOLUTION_CHANNEL",
+    "normalize_tenant_key",
+    "TenantResolver",
+    "tenant_resolver",
+]
@@ -1,24 +1,41 @@
 # Base source: https://github.com/polarsource/polar/blob/main/server/polar/worker.py
 
+import asyncio
 import contextlib
 import contextvars
+import dataclasses
 import functools
+import hashlib
+import inspect
+import json
+import pickle
+import time
 import uuid
-from collections.abc import AsyncGenerator, Awaitable, Callable
-from typing import Any, ParamSpec, TypeAlias, TypeVar, cast
+import zlib
+from collections.abc import AsyncGenerator, Awaitable, Callable, Iterator
+from datetime import datetime
+from typing import Any, Literal, ParamSpec, TypeAlias, TypeVar, cast
 
 # import logfire
 import structlog
-from arq import cron, func
+from arq import Retry, cron, func
 from arq.connections import ArqRedis, RedisSettings
 from arq.connections import create_pool as arq_create_pool
+from arq.constants import job_key_prefix, result_key_prefix
 from arq.cron import CronJob
+from arq.jobs import serialize_job
 from arq.typing import OptionType, SecondsTimedelta, WeekdayOptionType
+from arq.utils import timestamp_ms, to_ms, to_seconds, to_unix_ms
 from arq.worker import Function
+from redis.asyncio.client import Pipeline
+from redis.exceptions import WatchError
+from sqlalchemy import event
 
 from app.data.dbs.postgres.postgres import (
     AsyncSession,
-    SessionMakerFactory,
+    Session,
+    TrackedSession,
+    holds_connection,
 )
 from app.infra.config import settings
 from app.infra.core.context import (
@@ -28,46 +45,225 @@ from app.infra.core.context import (
     TenantContext,
     WorkerContext,
 )
+from app.infra.core.cron import (
+    TenantCron,
+    TenantCronScheduler,
+    WorkerRegistry,
+    acquire_leases,
+    list_tenant_ids,
+)
+from app.infra.core.exceptions import ProdkitTaskError
+from app.infra.core.job_serializer import get_job_serializers
+from app.infra.core.outbox import OutboxRelay, add_to_outbox
 
 # from app.infra.core.logfire import instrument_httpx, instrument_sqlalchemy
-from app.infra.core.postgres import DatabaseEngine, SchemaName, get_schema_name
+from app.infra.core.postgres import (
+    TenantEngineRegistry,
+    create_tenant_engines,
+    get_schema_name,
+)
+from app.infra.core.process_pool import ProcessPool
+from app.infra.core.tenant_queues import (
+    TENANT_QUEUES_KEY,
+    TenantQueueScheduler,
+    get_tenant_queue_name,
+    is_tenant_queue,
+)
 from app.providers.monitoring.logging import Logger, generate_correlation_id
 
 log: Logger = structlog.get_logger()
 
-JobToEnqueue: TypeAlias = tuple[str, tuple[Any], dict[str, Any]]
+# (name, args, kwargs, perf_counter() when enqueued)
+JobToEnqueue: TypeAlias = tuple[str, tuple[Any, ...], dict[str, Any], float]
 _jobs_to_enqueue = contextvars.ContextVar[list[JobToEnqueue]](
-    f"{settings.app_name}_worker_jobs_to_enqueue", default=[]
+    f"{settings.app_name}_worker_jobs_to_enqueue"
 )
 
+# Attempts to enqueue a batch when one of its job IDs is enqueued concurrently
+ENQUEUE_WATCH_ATTEMPTS = 3
+
+DEDUPE_KEY_PREFIX = f"{settings.DEFAULT_QUEUE_NAME}:dedupe:"
+CLAIM_CHECK_KEY_PREFIX = f"{settings.DEFAULT_QUEUE_NAME}:claim_check:"
+# Kwargs `task_hooks` reads before the offloaded arguments are loaded
+CLAIM_CHECK_KEPT_KWARGS = ("request_correlation_id", "tenant_id", "dedupe_key")
+
+
+@dataclasses.dataclass(frozen=True)
+class JobDedupe:
+    # Identity of a job from its arguments, all of them by default
+    key: Callable[..., str] | None = None
+    # Identical jobs are collapsed for this long, or only while pending if None
+    window_ms: int | None = None
+
+
+# Task name -> deduplication of its jobs, see `task`
+_job_dedupes: dict[str, JobDedupe] = {}
+
+BATCH_KEY_PREFIX = f"{settings.DEFAULT_QUEUE_NAME}:batch:"
+# A failed drain job is retried after this, times its number of tries
+BATCH_RETRY_DELAY_SECONDS = 5
+
+# Moves the next items of a batch to the processing list of a drain job, unless
+# the list still holds the items of a previous try of the job, then returned
+# again. KEYS: batch, processing list. ARGV: batch size, expiry (ms)
+CLAIM_BATCH_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[2], 0, -1)
+if #items > 0 then
+  return items
+end
+items = redis.call('LPOP', KEYS[1], ARGV[1])
+if not items then
+  return {}
+end
+redis.call('RPUSH', KEYS[2], unpack(items))
+redis.call('PEXPIRE', KEYS[2], ARGV[2])
+return items
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class JobBatch:
+    size: int
+    max_wait_ms: int
+
+
+@dataclasses.dataclass
+class BatchItem:
+    """Arguments of one invocation of a batch task."""
+
+    args: tuple[Any, ...]
+    kwargs: dict[str, Any]
+
+
+# Task name -> batching of its invocations, see `task`
+_job_batches: dict[str, JobBatch] = {}
+
+# Modules of the tasks running in the process pool, imported by its processes
+_process_task_modules: set[str] = set()
+
+# Crons run by every worker for its share of the tenants, see `interval`
+_tenant_crons: list[TenantCron] = []
+
+
+def get_batch_key(name: str, tenant_id: str | None) -> str:
+    return f"{BATCH_KEY_PREFIX}{name}:{tenant_id or settings.SPECIAL_SCHEMA}"
+
+
+def _canonical(value: Any) -> Any:
+    # Pickles of equal values may differ: sets are pickled in the order of their
+    # hashes, which differs between processes (`PYTHONHASHSEED`)
+    if isinstance(value, dict):
+        return sorted(
+            [_canonical_json(key), _canonical(item)] for key, item in value.items()
+        )
+    if isinstance(value, set | frozenset):
+        return sorted(map(_canonical_json, value))
+    if isinstance(value, list | tuple):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def _canonical_json(value: Any) -> str:
+    """JSON of `value`, the same for equal values in every process."""
+    return json.dumps(
+        _canonical(value), sort_keys=True, separators=(",", ":"), default=str
+    )
+
+
+def get_dedupe_key(
+    name: str, tenant_id: str | None, args: tuple[Any, ...], kwargs: dict[str, Any]
+) -> str | None:
+    if (dedupe := _job_dedupes.get(name)) is None:
+        return None
+
+    if dedupe.key is not None:
+        identity = dedupe.key(*args, **kwargs)
+    else:
+        identity = hashlib.blake2b(
+            _canonical_json((args, kwargs)).encode(), digest_size=16
+        ).hexdigest()
+    return (
+        f"{DEDUPE_KEY_PREFIX}{name}:{tenant_id or settings.SPECIAL_SCHEMA}:{identity}"
+    )
+
 
 class WorkerSettings:
     functions: list[Function] = []
     cron_jobs: list[CronJob] = []
     queue_name: str = settings.DEFAULT_QUEUE_NAME
+    # Tries of the jobs of the tasks without their own `max_tries`
+    max_tries: int = 5
 
     redis_settings = RedisSettings().from_dsn(settings.redis_url)
+    # Also used by the pool of `lifespan`, so both sides agree on the encoding
+    job_serializer, job_deserializer = get_job_serializers(
+        settings.WORKER_JOB_SERIALIZATION
+    )
 
     @staticmethod
     async def on_startup(ctx: WorkerContext) -> None:
         log.info(f"{settings.app_name}.worker.startup")
 
-        tenant_context = TenantContext.current()
-        schema_name: SchemaName = get_schema_name(tenant_context.tenant_id)
-
-        async_engine = DatabaseEngine.create_async_engine("worker", schema_name)
-        async_sessionmaker = SessionMakerFactory.create_async_sessionmaker(async_engine)
-        # instrument_sqlalchemy(async_engine.sync_engine)
+        # Jobs of all the tenants share the engines, see `AsyncSessionMaker`
+        tenant_engines = create_tenant_engines("worker")
         # instrument_httpx()
 
+        background_tasks: list[asyncio.Task[None]] = []
+        if settings.WORKER_TENANT_QUEUES:
+            background_tasks.append(
+                asyncio.create_task(TenantQueueScheduler(ctx["redis"]).run())
+            )
+        if isinstance(tenant_engines, TenantEngineRegistry):
+            background_tasks.append(
+                asyncio.create_task(tenant_engines.run_idle_eviction())
+            )
+        worker_registry = WorkerRegistry(ctx["redis"], uuid.uuid4().hex)
+        # Registered before the first tick, so it gets its share of the tenants
+        await worker_registry.heartbeat()
+        background_tasks.append(asyncio.create_task(worker_registry.run()))
+        if _tenant_crons:
+            special_sessionmaker = await tenant_engines.get_sessionmaker(
+                settings.SPECIAL_SCHEMA
+            )
+            tenant_cron_scheduler = TenantCronScheduler(
+                ctx,
+                worker_registry,
+                _tenant_crons,
+                functools.partial(list_tenant_ids, special_sessionmaker),
+            )
+            background_tasks.append(asyncio.create_task(tenant_cron_scheduler.run()))
+        if settings.WORKER_OUTBOX:
+            outbox_relay = OutboxRelay(
+                await tenant_engines.get_sessionmaker(settings.SPECIAL_SCHEMA),
+                ctx["redis"],
+                enqueue_jobs,
+            )
+            background_tasks.append(asyncio.create_task(outbox_relay.run()))
+
+        process_pool = ProcessPool(modules=sorted(_process_task_modules))
+        if _process_task_modules:
+            await process_pool.start()
+
         ctx.update(
-            {"async_engine": async_engine, "async_sessionmaker": async_sessionmaker}
+            {
+                "tenant_engines": tenant_engines,
+                "background_tasks": background_tasks,
+                "process_pool": process_pool,
+                "worker_registry": worker_registry,
+            }
         )
 
     @staticmethod
     async def on_shutdown(ctx: WorkerContext) -> None:
-        engine = ctx["async_engine"]
-        await engine.dispose()
+        for background_task in ctx["background_tasks"]:
+            background_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await background_task
+
+        # The other workers take over its tenants right away
+        await ctx["worker_registry"].leave()
+        await ctx["tenant_engines"].dispose()
+        await ctx["process_pool"].shutdown()
 
         log.info(f"{settings.app_name}.worker.shutdown")
 
@@ -125,10 +321,18 @@ def enqueue_job(
     )
 
     tenant_id = execution_context.tenant_context.tenant_id
+    if queue_name == settings.DEFAULT_QUEUE_NAME and settings.WORKER_TENANT_QUEUES:
+        # Dispatched to the worker queue by `TenantQueueScheduler`
+        queue_name = get_tenant_queue_name(tenant_id)
 
     # Prefix job ID by task name by default
     _job_id = kwargs.pop("_job_id", f"{name}:{uuid.uuid4().hex}")
 
+    task_kwargs = {
+        key: value for key, value in kwargs.items() if not key.startswith("_")
+    }
+    dedupe_key = get_dedupe_key(name, tenant_id, args, task_kwargs)
+
     kwargs = {
         "request_correlation_id": request_correlation_id,
         "prodkit_context": prodkit_context,
@@ -138,27 +342,361 @@ def enqueue_job(
         "_queue_name": queue_name,
     }
 
-    _jobs_to_enqueue_list = _jobs_to_enqueue.get([])
-    _jobs_to_enqueue_list.append((name, args, kwargs))  # type: ignore
-    _jobs_to_enqueue.set(_jobs_to_enqueue_list)
+    _jobs_to_enqueue_list = _jobs_to_enqueue.get(None)
+    if _jobs_to_enqueue_list is None:
+        # Outside of `jobs_to_enqueue_scope`, e.g. in a script
+        _jobs_to_enqueue_list = []
+        _jobs_to_enqueue.set(_jobs_to_enqueue_list)
+
+    if (batch := _job_batches.get(name)) is not None:
+        batch_key = get_batch_key(name, tenant_id)
+        item = pickle.dumps((args, task_kwargs))
+        # One drain job per batch and request, carrying all the invocations
+        for _, _, job_kwargs, _ in _jobs_to_enqueue_list:
+            if job_kwargs.get("_batch_key") == batch_key:
+                job_kwargs["_batch_items"].append(item)
+                return
+        args = ()
+        kwargs = {
+            key: value for key, value in kwargs.items() if key not in task_kwargs
+        } | {
+            "batch_key": batch_key,
+            "_batch_key": batch_key,
+            "_batch_items": [item],
+            "_batch_size": batch.size,
+            "_defer_by": batch.max_wait_ms / 1000,
+            # While a drain job is pending, the invocations just join the batch
+            "_dedupe_key": f"{batch_key}:drain",
+            "_dedupe_window_ms": None,
+        }
+    elif dedupe_key is not None:
+        # Identical jobs of the same request are collapsed before reaching Redis
+        if any(
+            job_kwargs.get("_dedupe_key") == dedupe_key
+            for _, _, job_kwargs, _ in _jobs_to_enqueue_list
+        ):
+            log.debug(
+                f"{settings.app_name}.worker.job_coalesced",
+                name=name,
+                dedupe_key=dedupe_key,
+            )
+            return
+        kwargs["_dedupe_key"] = dedupe_key
+        kwargs["_dedupe_window_ms"] = _job_dedupes[name].window_ms
+
+    _jobs_to_enqueue_list.append((name, args, kwargs, time.perf_counter()))
 
     log.debug(
         f"{settings.app_name}.worker.job_enqueued", name=name, args=args, kwargs=kwargs
     )
 
 
+def _move_jobs_to_outbox(session: Session) -> None:
+    """
+    Jobs enqueued before a commit go to the outbox in its transaction, rather
+    than to Redis after the response: they are enqueued if and only if the
+    transaction commits, see `OutboxRelay`.
+    """
+    if session.info.get("read_only"):
+        return
+    if _jobs_to_enqueue_list := _jobs_to_enqueue.get(None):
+        add_to_outbox(session, _jobs_to_enqueue_list)
+        _jobs_to_enqueue_list.clear()
+
+
+if settings.WORKER_OUTBOX:
+    event.listen(TrackedSession, "before_commit", _move_jobs_to_outbox)
+
+
+@contextlib.contextmanager
+def jobs_to_enqueue_scope() -> Iterator[None]:
+    """
+    Buffer of the jobs enqueued by a request or a job, until they are flushed.
+
+    The list is created for the scope and shared with the contexts copied from
+    it (e.g. sync endpoints running in a thread), so jobs never leak from a
+    request to the next one.
+    """
+    token = _jobs_to_enqueue.set([])
+    try:
+        yield
+    finally:
+        _jobs_to_enqueue.reset(token)
+
+
+@dataclasses.dataclass
+class _JobOptions:
+    """Options of a buffered job, popped from its kwargs (see `enqueue_job`)."""
+
+    kwargs: dict[str, Any]
+    job_id: str
+    queue_name: str
+    defer_until: datetime | None
+    defer_by_ms: int | None
+    expires_ms: int | None
+    job_try: int | None
+    dedupe_key: str | None
+    dedupe_window_ms: int | None
+    batch_key: str | None
+    batch_items: list[bytes]
+    batch_size: int
+
+    @classmethod
+    def pop(cls, kwargs: dict[str, Any]) -> "_JobOptions":
+        job_kwargs = dict(kwargs)
+        return cls(
+            job_id=job_kwargs.pop("_job_id"),
+            queue_name=job_kwargs.pop("_queue_name"),
+            defer_until=job_kwargs.pop("_defer_until", None),
+            defer_by_ms=to_ms(job_kwargs.pop("_defer_by", None)),
+            expires_ms=to_ms(job_kwargs.pop("_expires", None)),
+            job_try=job_kwargs.pop("_job_try", None),
+            dedupe_key=job_kwargs.pop("_dedupe_key", None),
+            dedupe_window_ms=job_kwargs.pop("_dedupe_window_ms", None),
+            batch_key=job_kwargs.pop("_batch_key", None),
+            batch_items=job_kwargs.pop("_batch_items", []),
+            batch_size=job_kwargs.pop("_batch_size", 0),
+            kwargs=job_kwargs,
+        )
+
+    def get_score(self, enqueue_time_ms: int) -> int:
+        if self.defer_until is not None:
+            return to_unix_ms(self.defer_until)
+        return enqueue_time_ms + (self.defer_by_ms or 0)
+
+
+def _offload_arguments(
+    pipe: Pipeline,
+    arq_pool: ArqRedis,
+    job_id: str,
+    args: tuple[Any, ...],
+    job_kwargs: dict[str, Any],
+    expires_ms: int,
+) -> dict[str, Any]:
+    """
+    Stores the arguments of a job compressed in their own key, and returns the
+    kwargs of the job carrying its reference instead (claim check), see
+    `task_hooks`.
+    """
+    claim_check = CLAIM_CHECK_KEY_PREFIX + job_id
+    kept_kwargs = {
+        key: value
+        for key, value in job_kwargs.items()
+        if key in CLAIM_CHECK_KEPT_KWARGS
+    }
+    offloaded = {
+        "a": args,
+        "k": {
+            key: value for key, value in job_kwargs.items() if key not in kept_kwargs
+        },
+    }
+    pipe.psetex(
+        claim_check,
+        expires_ms,
+        zlib.compress((arq_pool.job_serializer or pickle.dumps)(offloaded)),
+    )
+    return {**kept_kwargs, "claim_check": claim_check}
+
+
+def _queue_job(
+    pipe: Pipeline,
+    arq_pool: ArqRedis,
+    name: str,
+    args: tuple[Any, ...],
+    options: _JobOptions,
+    enqueue_time_ms: int,
+) -> None:
+    """Adds the commands enqueuing a job to the transaction, as arq does."""
+    score = options.get_score(enqueue_time_ms)
+    expires_ms = (
+        options.expires_ms or score - enqueue_time_ms + arq_pool.expires_extra_ms
+    )
+
+    job_kwargs = options.kwargs
+    if options.dedupe_key is not None:
+        pipe.set(
+            options.dedupe_key,
+            options.job_id,
+            px=options.dedupe_window_ms or expires_ms,
+        )
+        if options.dedupe_window_ms is None:
+            # Released by `task_hooks` once the job starts
+            job_kwargs = {**job_kwargs, "dedupe_key": options.dedupe_key}
+
+    job = serialize_job(
+        name,
+        args,
+        job_kwargs,
+        options.job_try,
+        enqueue_time_ms,
+        serializer=arq_pool.job_serializer,
+    )
+    if (
+        settings.WORKER_CLAIM_CHECK_BYTES is not None
+        and len(job) > settings.WORKER_CLAIM_CHECK_BYTES
+    ):
+        log.debug(
+            f"{settings.app_name}.worker.job_claim_check",
+            job_id=options.job_id,
+            size=len(job),
+        )
+        job = serialize_job(
+            name,
+            (),
+            _offload_arguments(
+                pipe, arq_pool, options.job_id, args, job_kwargs, expires_ms
+            ),
+            options.job_try,
+            enqueue_time_ms,
+            serializer=arq_pool.job_serializer,
+        )
+    pipe.psetex(job_key_prefix + options.job_id, expires_ms, job)
+    pipe.zadd(options.queue_name, {options.job_id: score})
+    if is_tenant_queue(options.queue_name):
+        pipe.sadd(TENANT_QUEUES_KEY, options.queue_name)
+
+
+def _get_full_batch_drains(
+    batch_pushes: list[tuple[int, int, int, JobToEnqueue]], results: list[Any]
+) -> list[JobToEnqueue]:
+    """Drain jobs of the batches which just reached their size."""
+    drains: list[JobToEnqueue] = []
+    for index, pushed, batch_size, (name, _, kwargs, enqueued_at) in batch_pushes:
+        length: int = results[index]
+        if length // batch_size > (length - pushed) // batch_size:
+            drain_kwargs = {
+                key: value for key, value in kwargs.items() if not key.startswith("_")
+            }
+            drain_kwargs["_job_id"] = f"{name}:{uuid.uuid4().hex}"
+            drain_kwargs["_queue_name"] = kwargs["_queue_name"]
+            drains.append((name, (), drain_kwargs, enqueued_at))
+    return drains
+
+
+async def enqueue_jobs(arq_pool: ArqRedis, jobs: list[JobToEnqueue]) -> list[str]:
+    """
+    Enqueues `jobs` atomically, in a single `MULTI`/`EXEC` transaction.
+
+    Same semantics as `ArqRedis.enqueue_job` for each job, i.e. a job whose ID
+    already exists (enqueued or with a result) is skipped, but in three Redis
+    round-trips whatever the number of jobs: `WATCH` of the job keys, `MGET`
+    of the existing ones and the transaction writing all the payloads and
+    queue scores. Returns the IDs of the enqueued jobs.
+
+    Jobs of deduplicated tasks are skipped as well while the dedupe key of an
+    identical job exists, see `task`. Invocations of batch tasks are pushed to
+    their batch in the same transaction; a batch reaching its size gets a drain
+    job right away rather than after `max_wait`.
+    """
+    job_ids: list[str] = [kwargs["_job_id"] for _, _, kwargs, _ in jobs]
+    job_keys = [job_key_prefix + job_id for job_id in job_ids]
+    result_keys = [result_key_prefix + job_id for job_id in job_ids]
+    dedupe_keys: list[str] = list(
+        {
+            kwargs["_dedupe_key"]: None
+            for _, _, kwargs, _ in jobs
+            if kwargs.get("_dedupe_key")
+        }
+    )
+
+    async with arq_pool.pipeline(transaction=True) as pipe:
+        for attempt in range(1, ENQUEUE_WATCH_ATTEMPTS + 1):
+            await pipe.watch(*job_keys, *dedupe_keys)
+            existing = await pipe.mget(job_keys + result_keys + dedupe_keys)
+            # Keys of the jobs and dedupe keys which can't be enqueued again
+            existing_keys = {
+                key
+                for key, value in zip(
+                    job_ids + job_ids + dedupe_keys, existing, strict=True
+                )
+                if value is not None
+            }
+
+            pipe.multi()  # type: ignore[no-untyped-call]
+            enqueued_ids: list[str] = []
+            # (index of the RPUSH in the transaction, pushed items, size, drain job)
+            batch_pushes: list[tuple[int, int, int, JobToEnqueue]] = []
+            enqueue_time_ms = timestamp_ms()
+            for name, args, kwargs, enqueued_at in jobs:
+                options = _JobOptions.pop(kwargs)
+                if options.batch_key is not None:
+                    # Even when the drain job is already pending
+                    batch_pushes.append(
+                        (
+                            len(pipe.command_stack),
+                            len(options.batch_items),
+                            options.batch_size,
+                            (name, args, kwargs, enqueued_at),
+                        )
+                    )
+                    pipe.rpush(options.batch_key, *options.batch_items)
+                    pipe.pexpire(options.batch_key, arq_pool.expires_extra_ms)
+
+                # Like arq, the first of duplicated IDs wins
+                keys = {options.job_id, options.dedupe_key or options.job_id}
+                if not existing_keys.isdisjoint(keys):
+                    continue
+                existing_keys |= keys
+
+                _queue_job(pipe, arq_pool, name, args, options, enqueue_time_ms)
+                enqueued_ids.append(options.job_id)
+
+            try:
+                results = await pipe.execute()
+            except WatchError:
+                # Some of the jobs were enqueued since they were checked
+                log.debug(
+                    f"{settings.app_name}.worker.enqueue_jobs_conflict",
+                    attempt=attempt,
+                )
+                continue
+            break
+        else:
+            raise WatchError(f"Couldn't enqueue {len(jobs)} jobs atomically")
+
+    if full_batch_drains := _get_full_batch_drains(batch_pushes, results):
+        await enqueue_jobs(arq_pool, full_batch_drains)
+
+    return enqueued_ids
+
+
 async def flush_enqueued_jobs(arq_pool: ArqRedis) -> None:
-    if _jobs_to_enqueue_list := _jobs_to_enqueue.get([]):
-        log.debug(f"{settings.app_name}.worker.flush_enqueued_jobs")
-        for name, args, kwargs in _jobs_to_enqueue_list:
-            await arq_pool.enqueue_job(name, *args, **kwargs)
+    if _jobs_to_enqueue_list := _jobs_to_enqueue.get(None):
+        jobs = list(_jobs_to_enqueue_list)
+        _jobs_to_enqueue_list.clear()
+
+        start = time.perf_counter()
+        enqueued_ids = set(await enqueue_jobs(arq_pool, jobs))
+        flushed_at = time.perf_counter()
+
+        for name, args, kwargs, enqueued_at in jobs:
+            skipped = kwargs["_job_id"] not in enqueued_ids
+            enqueued_ids.discard(kwargs["_job_id"])
             log.debug(
                 f"{settings.app_name}.worker.job_flushed",
                 name=name,
                 args=args,
                 kwargs=kwargs,
+                skipped=skipped,
+                # From `enqueue_job` to the job being in Redis
+                latency_ms=round((flushed_at - enqueued_at) * 1000, 3),
             )
-        _jobs_to_enqueue.set([])
+        log.debug(
+            f"{settings.app_name}.worker.flush_enqueued_jobs",
+            jobs=len(jobs),
+            duration_ms=round((flushed_at - start) * 1000, 3),
+        )
+
+
+async def _load_claim_check(job_context: JobContext, claim_check: str) -> Any:
+    """Arguments of a job offloaded by `enqueue_jobs`."""
+    arq_pool = job_context["redis"]
+    blob = await arq_pool.get(claim_check)
+    if blob is None:
+        raise ProdkitTaskError(
+            f"Arguments of job {job_context['job_id']} expired ({claim_check})"
+        )
+    return (arq_pool.job_deserializer or pickle.loads)(zlib.decompress(blob))
 
 
 Params = ParamSpec("Params")
@@ -184,14 +722,33 @@ def task_hooks(
         if request_correlation_id is not None:
             log_context["request_correlation_id"] = request_correlation_id
 
+        # From now on, an identical job has to run again
+        dedupe_key = cast(str | None, kwargs.pop("dedupe_key", None))
+        if dedupe_key is not None:
+            await job_context["redis"].delete(dedupe_key)
+
+        claim_check = cast(str | None, kwargs.pop("claim_check", None))
+        if claim_check is not None:
+            stored = await _load_claim_check(job_context, claim_check)
+            args = (job_context, *stored["a"])  # type: ignore[assignment]
+            kwargs.update(stored["k"])
+
         structlog.contextvars.bind_contextvars(**log_context)
         # job_context["logfire_span"].set_attributes(log_context)
 
         log.info(f"{settings.app_name}.worker.job_started")
-        r = await f(*args, **kwargs)
+        with (
+            TenantContext(tenant_id=log_context["tenant_id"]),
+            jobs_to_enqueue_scope(),
+        ):
+            r = await f(*args, **kwargs)
+
+            arq_pool = job_context["redis"]
+            await flush_enqueued_jobs(arq_pool)
 
-        arq_pool = job_context["redis"]
-        await flush_enqueued_jobs(arq_pool)
+        # Kept for the retries until then
+        if claim_check is not None:
+            await arq_pool.delete(claim_check)
 
         log.info(f"{settings.app_name}.worker.job_ended")
         structlog.contextvars.unbind_contextvars(
@@ -218,13 +775,62 @@ def task(
     timeout: SecondsTimedelta | None = None,
     keep_result_forever: bool | None = None,
     max_tries: int | None = None,
-) -> Callable[
-    [Callable[Params, Awaitable[ReturnValue]]], Callable[Params, Awaitable[ReturnValue]]
-]:
+    dedupe: bool = False,
+    dedupe_key: Callable[..., str] | None = None,
+    coalesce_window: SecondsTimedelta | None = None,
+    batch_size: int | None = None,
+    max_wait: SecondsTimedelta = 1,
+    executor: Literal["process"] | None = None,
+) -> Callable[[Callable[Params, ReturnValue]], Callable[Params, ReturnValue]]:
+    """
+    Registers a task of the worker.
+
+    With `dedupe`, a job identical to a pending one (same tenant and arguments,
+    or same `dedupe_key(*args, **kwargs)`) is dropped by `enqueue_job`. With
+    `coalesce_window`, identical jobs are dropped for that long after the first
+    one, even if it already ran.
+
+    With `batch_size`, the invocations of the task are accumulated per tenant,
+    and the task is called as `f(ctx, items: list[BatchItem])` with up to
+    `batch_size` of them, at most `max_wait` after the first one. An invocation
+    is then as cheap as a list push, and the task can handle the whole batch in
+    a single transaction. If the task fails, the drain job is retried later
+    with the same batch, up to `max_tries` times, after which the batch is
+    moved to the `<batch key>:dead` list.
+
+    With `executor="process"`, the task is a regular (not async) function
+    called without the job context, in the process pool of the worker (see
+    `ProcessPool`), so a CPU bound task doesn't block the other jobs. Its
+    arguments and result have to be picklable.
+    """
+    is_deduped = dedupe or dedupe_key is not None or coalesce_window is not None
+    if batch_size is not None and is_deduped:
+        raise ValueError("Batch tasks can't be deduplicated")
+    if batch_size is not None and executor is not None:
+        raise ValueError("Batch tasks can't run in the process pool")
+    if is_deduped:
+        _job_dedupes[name] = JobDedupe(key=dedupe_key, window_ms=to_ms(coalesce_window))
+    if batch_size is not None:
+        _job_batches[name] = JobBatch(size=batch_size, max_wait_ms=to_ms(max_wait) or 0)
+
     def decorator(
-        f: Callable[Params, Awaitable[ReturnValue]],
-    ) -> Callable[Params, Awaitable[ReturnValue]]:
-        wrapped = task_hooks(f)
+        f: Callable[Params, ReturnValue],
+    ) -> Callable[Params, ReturnValue]:
+        if inspect.iscoroutinefunction(f) == (executor == "process"):
+            raise TypeError(
+                f"Task {name} has to be a "
+                f"{'regular' if executor == 'process' else 'coroutine'} function"
+            )
+
+        wrapped: Callable[..., Awaitable[Any]]
+        if executor == "process":
+            # Imported by reference in the processes, so it's returned unwrapped
+            _process_task_modules.add(f.__module__)
+            wrapped = task_hooks(_run_in_process_pool(f, to_seconds(timeout)))
+        elif batch_size is not None:
+            wrapped = task_hooks(_batch_drain(f, batch_size, max_tries))  # type: ignore[arg-type]
+        else:
+            wrapped = task_hooks(cast(Callable[..., Awaitable[Any]], f))
 
         new_task = func(
             wrapped,  # type: ignore
@@ -237,11 +843,86 @@ def task(
 
         WorkerSettings.functions.append(new_task)
 
-        return wrapped
+        if batch_size is not None or executor == "process":
+            return f
+        return cast(Callable[Params, ReturnValue], wrapped)
 
     return decorator
 
 
+def _run_in_process_pool(
+    f: Callable[..., object], timeout: float | None
+) -> Callable[..., Awaitable[Any]]:
+    async def run(ctx: JobContext, *args: Any, **kwargs: Any) -> Any:
+        """Calls the task in the process pool of the worker."""
+        return await ctx["process_pool"].run(
+            f, args, kwargs, timeout=timeout or settings.WORKER_PROCESS_TIMEOUT_SECONDS
+        )
+
+    return run
+
+
+def _batch_drain(
+    f: Callable[..., Awaitable[object]], batch_size: int, max_tries: int | None
+) -> Callable[..., Awaitable[int]]:
+    async def drain(ctx: JobContext, *, batch_key: str, **kwargs: Any) -> int:
+        """
+        Calls the batch task until its batch is empty.
+
+        Each batch is moved to the processing list of the job before the task
+        is called, so it isn't lost if the worker dies meanwhile: the next try
+        of the job takes it again.
+        """
+        redis = ctx["redis"]
+        processing_key = f"{batch_key}:processing:{ctx['job_id']}"
+        claim_batch = redis.register_script(CLAIM_BATCH_SCRIPT)
+        drained = 0
+        while raw_items := await claim_batch(
+            keys=[batch_key, processing_key],
+            args=[batch_size, redis.expires_extra_ms],
+        ):
+            items = [BatchItem(*pickle.loads(raw_item)) for raw_item in raw_items]
+            try:
+                await f(ctx, items)
+            except Exception as e:
+                if ctx["job_try"] < (max_tries or WorkerSettings.max_tries):
+                    log.warning(
+                        f"{settings.app_name}.worker.batch_failed",
+                        batch_key=batch_key,
+                        items=len(items),
+                        error=str(e),
+                    )
+                    # arq only runs a failed job again if it raises `Retry`
+                    raise Retry(defer=ctx["job_try"] * BATCH_RETRY_DELAY_SECONDS) from e
+
+                # Left in the batch, it would fail the next drains too
+                async with redis.pipeline(transaction=True) as pipe:
+                    pipe.rpush(f"{batch_key}:dead", *raw_items)
+                    pipe.delete(processing_key)
+                    await pipe.execute()
+                log.error(
+                    f"{settings.app_name}.worker.batch_dead_lettered",
+                    batch_key=batch_key,
+                    items=len(items),
+                    error=str(e),
+                )
+                raise
+            except BaseException:
+                # E.g. a timeout, which arq doesn't retry: back to the batch
+                async with redis.pipeline(transaction=True) as pipe:
+                    pipe.lpush(batch_key, *reversed(raw_items))
+                    pipe.delete(processing_key)
+                    await pipe.execute()
+                raise
+            await redis.delete(processing_key)
+            drained += len(items)
+            if len(raw_items) < batch_size:
+                break
+        return drained
+
+    return drain
+
+
 def interval(
     *,
     month: OptionType = None,
@@ -250,56 +931,106 @@ def interval(
     hour: OptionType = None,
     minute: OptionType = None,
     second: OptionType = 0,
+    timeout: SecondsTimedelta | None = None,
+    per_tenant: bool = False,
 ) -> Callable[
     [Callable[Params, Awaitable[ReturnValue]]], Callable[Params, Awaitable[ReturnValue]]
 ]:
+    """
+    Registers a cron of the worker.
+
+    Every worker schedules the crons, but each tick runs once: the worker
+    running it first takes its lease in Redis, and the others skip it.
+
+    With `per_tenant`, the cron is called as `f(ctx, tenant_id=...)` for each
+    active tenant on each tick. The tenants are sharded across the live workers
+    with consistent hashing (see `TenantCronScheduler`), each worker running its
+    own share concurrently, rather than a single job running them all.
+    """
+
     def decorator(
         f: Callable[Params, Awaitable[ReturnValue]],
     ) -> Callable[Params, Awaitable[ReturnValue]]:
         wrapped = task_hooks(f)
 
         new_cron = cron(
-            wrapped,  # type: ignore
+            wrapped if per_tenant else task_hooks(_leased(f)),  # type: ignore
+            name=f"{'tenant_cron' if per_tenant else 'cron'}:{f.__qualname__}",
             month=month,
             day=day,
             weekday=weekday,
             hour=hour,
             minute=minute,
             second=second,
+            timeout=timeout,
             run_at_startup=False,
         )
 
-        # All crontabs are running on the "default" worker
-        WorkerSettings.cron_jobs.append(new_cron)
+        if per_tenant:
+            # Run by the `TenantCronScheduler` of each worker, not enqueued
+            _tenant_crons.append(TenantCron(cron_job=new_cron, coroutine=wrapped))
+        else:
+            # All crontabs are running on the "default" worker
+            WorkerSettings.cron_jobs.append(new_cron)
 
         return wrapped
 
     return decorator
 
 
-# TODO: Separate Redis queues per tenant
+def _leased(
+    f: Callable[Params, Awaitable[ReturnValue]],
+) -> Callable[Params, Awaitable[ReturnValue | None]]:
+    @functools.wraps(f)
+    async def leased(*args: Params.args, **kwargs: Params.kwargs) -> ReturnValue | None:
+        job_context = cast(JobContext, args[0])
+        # arq's cron job IDs are the cron name and the tick
+        [lease] = await acquire_leases(
+            job_context["redis"],
+            [job_context["job_id"]],
+            job_context["worker_registry"].worker_id,
+        )
+        if not lease:
+            log.info(f"{settings.app_name}.worker.cron_tick_skipped")
+            return None
+        return await f(*args, **kwargs)
+
+    return leased
+
+
 @contextlib.asynccontextmanager
 async def lifespan() -> AsyncGenerator[ArqRedis, None]:
-    arq_pool = await arq_create_pool(WorkerSettings.redis_settings)
+    arq_pool = await arq_create_pool(
+        WorkerSettings.redis_settings,
+        job_serializer=WorkerSettings.job_serializer,
+        job_deserializer=WorkerSettings.job_deserializer,
+    )
     try:
         yield arq_pool
     finally:
         await arq_pool.close(True)
 
 
-# TODO: Can be extended to dynamically select the appropriate schema
-# configuration based on tenant information?
 @contextlib.asynccontextmanager
 async def AsyncSessionMaker(ctx: JobContext) -> AsyncGenerator[AsyncSession, None]:  # noqa: N802
-    """Helper to open an AsyncSession context manager from the job context."""
-    async with ctx["async_sessionmaker"]() as session:
+    """
+    Helper to open an AsyncSession context manager from the job context, bound to
+    the schema of the tenant of the job.
+
+    Engines are cached per schema across jobs (see `create_tenant_engines`).
+    """
+    schema_name = get_schema_name(TenantContext.current().tenant_id)
+    sessionmaker = await ctx["tenant_engines"].get_sessionmaker(schema_name)
+    async with sessionmaker() as session:
         try:
             yield session
         except:
-            await session.rollback()
+            if holds_connection(session):
+                await session.rollback()
             raise
         else:
-            await session.commit()
+            if holds_connection(session):
+                await session.commit()
 
 
 __all__ = [
@@ -307,6 +1038,10 @@ __all__ = [
     "task",
     "lifespan",
     "enqueue_job",
+    "enqueue_jobs",
+    "BatchItem",
+    "flush_enqueued_jobs",
+    "jobs_to_enqueue_scope",
     "JobContext",
     "AsyncSessionMaker",
     "ArqRedis",
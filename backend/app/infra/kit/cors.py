@@ -1,5 +1,7 @@
 import dataclasses
-from collections.abc import Sequence
+import re
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
 from typing import Protocol
 
 from starlette.datastructures import Headers
@@ -11,6 +13,23 @@ class CORSMatcher(Protocol):
     def __call__(self, origin: str, scope: Scope) -> bool: ...
 
 
+def get_origin_matcher(
+    allow_origins: Sequence[str], allow_origin_regex: str | None = None
+) -> CORSMatcher:
+    """Matches the origins allowed by `allow_origins` and `allow_origin_regex`."""
+    origins = frozenset(allow_origins)
+    regex = re.compile(allow_origin_regex) if allow_origin_regex else None
+
+    def matcher(origin: str, scope: Scope) -> bool:
+        return (
+            "*" in origins
+            or origin in origins
+            or (regex is not None and regex.fullmatch(origin) is not None)
+        )
+
+    return matcher
+
+
 @dataclasses.dataclass
 class CORSConfig:
     matcher: CORSMatcher
@@ -35,58 +54,183 @@ class CORSConfig:
         )
 
 
+class TenantCORSConfigSource(Protocol):
+    """
+    CORS configs of the tenants, besides the static ones.
+
+    The generation of a tenant changes whenever its configs may have changed,
+    outdating the decisions cached by `CORSMatcherMiddleware` for this tenant.
+    `generation` changes when the configs of all the tenants may have changed.
+    """
+
+    generation: int
+
+    def get_generation(self, tenant_id: str) -> int: ...
+
+    async def get(self, tenant_id: str) -> Sequence[CORSConfig] | None: ...
+
+
+# (tenant ID, origin, method)
+DecisionKey = tuple[str | None, str, str]
+# (tenant ID, origin, requested method, requested headers)
+PreflightKey = tuple[str | None, str, str, str | None]
+# (status, headers, body)
+PreflightResponse = tuple[int, list[tuple[bytes, bytes]], bytes]
+
+
 class CORSMatcherMiddleware:
+    """
+    Applies the first CORS config of the tenant of the request matching its
+    origin, or the first default one.
+
+    The matching config of each (tenant, origin, method) is cached, at most
+    `max_decisions` of them, as are the preflight responses, which are replayed
+    as is, each with the generation of the configs of its tenant: a change of
+    the configs of a tenant outdates its own entries only. Matchers must then
+    only depend on the origin and the method of the request.
+    """
+
     def __init__(
-        self, app: ASGIApp, *, configs: dict[str, Sequence[CORSConfig]]
+        self,
+        app: ASGIApp,
+        *,
+        configs: Mapping[str, Sequence[CORSConfig]],
+        tenant_configs: TenantCORSConfigSource | None = None,
+        max_decisions: int = 4096,
     ) -> None:
         self.app = app
         self.tenant_middlewares = {
-            tenant_id: tuple(
-                (config, config.get_middleware(app)) for config in tenant_configs
-            )
+            tenant_id: self._get_middlewares(tenant_configs)
             for tenant_id, tenant_configs in configs.items()
         }
         # Handle default (non-tenant-based) configurations separately
-        self.default_middlewares = tuple(
-            (config, config.get_middleware(app))
-            for config in configs.get("default", [])
+        self.default_middlewares = self._get_middlewares(configs.get("default", []))
+        self.tenant_configs = tenant_configs
+        self.max_decisions = max_decisions
+        self._generation = tenant_configs.generation if tenant_configs else 0
+        self._decisions: OrderedDict[DecisionKey, tuple[int, CORSMiddleware | None]] = (
+            OrderedDict()
+        )
+        self._preflights: OrderedDict[PreflightKey, tuple[int, PreflightResponse]] = (
+            OrderedDict()
         )
+        self._source_middlewares: dict[
+            str,
+            tuple[Sequence[CORSConfig], Sequence[tuple[CORSConfig, CORSMiddleware]]],
+        ] = {}
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         if scope["type"] != "http":  # pragma: no cover
             await self.app(scope, receive, send)
             return
 
-        method = scope["method"]
-        headers = Headers(scope=scope)
-        origin = headers.get("origin")
-
-        # Retrieve tenant context from request state
-        tenant_context = scope.get("state", {}).get("tenant_context")
-        tenant_id = tenant_context.tenant_id if tenant_context else None
+        origin = requested_method = requested_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value.decode("latin-1")
+            elif name == b"access-control-request-method":
+                requested_method = value.decode("latin-1")
+            elif name == b"access-control-request-headers":
+                requested_headers = value.decode("latin-1")
 
         if origin is None:
             await self.app(scope, receive, send)
             return
 
-        if tenant_id is None:
-            # Use default configurations if no tenant ID
-            _middlewares = self.default_middlewares
-        else:
-            _middlewares = self.tenant_middlewares.get(
-                tenant_id, self.default_middlewares
-            )
+        # Retrieve tenant context from request state
+        tenant_context = scope.get("state", {}).get("tenant_context")
+        tenant_id = tenant_context.tenant_id if tenant_context else None
 
-        middleware = self._get_config_middleware(origin, scope, _middlewares)
+        generation = self._get_generation(tenant_id)
+        middleware = await self._get_decision(tenant_id, origin, scope, generation)
         if middleware is None:
             await self.app(scope, receive, send)
             return
 
-        if method == "OPTIONS" and "access-control-request-method" in headers:
-            response = middleware.preflight_response(request_headers=headers)
-            await response(scope, receive, send)
+        if scope["method"] == "OPTIONS" and requested_method is not None:
+            preflight_key = (tenant_id, origin, requested_method, requested_headers)
+            cached = self._preflights.get(preflight_key)
+            if cached is not None and cached[0] == generation:
+                preflight = cached[1]
+            else:
+                response = middleware.preflight_response(
+                    request_headers=Headers(scope=scope)
+                )
+                preflight = (response.status_code, response.raw_headers, response.body)
+                self._remember(self._preflights, preflight_key, (generation, preflight))
+            await self._send_preflight(preflight, send)
             return
-        await middleware.simple_response(scope, receive, send, request_headers=headers)
+        await middleware.simple_response(
+            scope, receive, send, request_headers=Headers(scope=scope)
+        )
+
+    def _get_generation(self, tenant_id: str | None) -> int:
+        if (
+            self.tenant_configs is None
+            or tenant_id is None
+            or tenant_id in self.tenant_middlewares
+        ):
+            return 0
+        if self.tenant_configs.generation != self._generation:
+            # The middlewares of the tenants which are gone are dropped now and then
+            self._generation = self.tenant_configs.generation
+            self._source_middlewares.clear()
+        return self.tenant_configs.get_generation(tenant_id)
+
+    async def _get_decision(
+        self, tenant_id: str | None, origin: str, scope: Scope, generation: int
+    ) -> CORSMiddleware | None:
+        decision_key = (tenant_id, origin, scope["method"])
+        cached = self._decisions.get(decision_key)
+        if cached is not None and cached[0] == generation:
+            self._decisions.move_to_end(decision_key)
+            return cached[1]
+
+        middleware = self._get_config_middleware(
+            origin, scope, await self._get_tenant_middlewares(tenant_id)
+        )
+        self._remember(self._decisions, decision_key, (generation, middleware))
+        return middleware
+
+    @staticmethod
+    async def _send_preflight(preflight: PreflightResponse, send: Send) -> None:
+        status, headers, body = preflight
+        # Copied, as the outer middlewares may add headers to it
+        await send(
+            {"type": "http.response.start", "status": status, "headers": [*headers]}
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    async def _get_tenant_middlewares(
+        self, tenant_id: str | None
+    ) -> Sequence[tuple[CORSConfig, CORSMiddleware]]:
+        if tenant_id is None:
+            # Use default configurations if no tenant ID
+            return self.default_middlewares
+        if (middlewares := self.tenant_middlewares.get(tenant_id)) is not None:
+            return middlewares
+        if self.tenant_configs is None:
+            return self.default_middlewares
+
+        configs = await self.tenant_configs.get(tenant_id)
+        if not configs:
+            return self.default_middlewares
+        cached = self._source_middlewares.get(tenant_id)
+        if cached is None or cached[0] is not configs:
+            cached = (configs, self._get_middlewares(configs))
+            self._source_middlewares[tenant_id] = cached
+        return cached[1]
+
+    def _get_middlewares(
+        self, configs: Sequence[CORSConfig]
+    ) -> tuple[tuple[CORSConfig, CORSMiddleware], ...]:
+        return tuple((config, config.get_middleware(self.app)) for config in configs)
+
+    def _remember[K, V](self, cache: OrderedDict[K, V], key: K, value: V) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > self.max_decisions:
+            cache.popitem(last=False)
 
     def _get_config_middleware(
         self,
@@ -100,4 +244,10 @@ class CORSMatcherMiddleware:
         return None
 
 
-__all__ = ["CORSConfig", "CORSMatcherMiddleware", "Scope"]
+__all__ = [
+    "CORSConfig",
+    "CORSMatcherMiddleware",
+    "TenantCORSConfigSource",
+    "get_origin_matcher",
+    "Scope",
+]
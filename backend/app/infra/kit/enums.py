@@ -8,6 +8,22 @@ class Environment(StrEnum):
     PRODUCTION = "production"
 
 
+class SchemaRouting(StrEnum):
+    # One engine (and pool) per tenant schema
+    ENGINE = "engine"
+    # One shared pool, `SET LOCAL search_path` on each transaction
+    SEARCH_PATH = "search_path"
+    # One shared engine, `schema_translate_map` execution option per tenant
+    TRANSLATE_MAP = "translate_map"
+
+
+class JobSerialization(StrEnum):
+    # arq default, any picklable argument
+    PICKLE = "pickle"
+    # Compact binary payloads, pickle only for the types it doesn't know
+    MSGPACK = "msgpack"
+
+
 class TenantLevel(StrEnum):
     ORIGIN = "origin"
     INTERNAL = "internal"
@@ -1,4 +1,13 @@
+import hmac
+
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
+
 from app.api.router.routing import APIRouter
+from app.infra.config import settings
+from app.infra.core.exceptions import NotPermittedError
+from app.infra.core.tenant_queues import tenant_queue_samples
+from app.providers.monitoring.performance import render_metrics
 
 router = APIRouter(tags=["health"], include_in_schema=False)
 
@@ -11,3 +20,21 @@ async def healthz() -> dict[str, str]:
 @router.get("/readyz")
 async def readyz() -> dict[str, str]:
     return {"status": "ok"}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request) -> str:
+    """
+    Database pool and tenant queue metrics in the Prometheus text format, for
+    the scrapers sending `METRICS_TOKEN` as their bearer token.
+    """
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if not (
+        settings.METRICS_TOKEN
+        and scheme.lower() == "bearer"
+        and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode())
+    ):
+        raise NotPermittedError()
+    arq_pool = request.state.arq_pool
+    return render_metrics(await tenant_queue_samples(arq_pool))
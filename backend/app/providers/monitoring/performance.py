@@ -0,0 +1,322 @@
+import bisect
+import dataclasses
+import time
+import weakref
+from collections.abc import Iterable, Iterator, Sequence
+from typing import Any, Self
+
+from sqlalchemy import Connection, Engine, event
+from sqlalchemy.engine import default
+from sqlalchemy.engine.interfaces import (
+    DBAPIConnection,
+    DBAPICursor,
+    ExecutionContext,
+)
+from sqlalchemy.pool import (
+    AsyncAdaptedQueuePool,
+    ConnectionPoolEntry,
+    PoolProxiedConnection,
+    QueuePool,
+)
+
+from app.infra.config import settings
+
+
+@dataclasses.dataclass
+class StatementCacheStats:
+    """Hits and misses of SQLAlchemy's compiled statements cache."""
+
+    hits: int = 0
+    misses: int = 0
+    uncached: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+statement_cache_stats = StatementCacheStats()
+
+
+def instrument_statement_cache(
+    engine: Engine, stats: StatementCacheStats = statement_cache_stats
+) -> None:
+    def after_cursor_execute(
+        conn: Connection,
+        cursor: DBAPICursor,
+        statement: str,
+        parameters: Any,
+        context: ExecutionContext | None,
+        executemany: bool,
+    ) -> None:
+        cache_hit = getattr(context, "cache_hit", None)
+        if cache_hit is default.CACHE_HIT:
+            stats.hits += 1
+        elif cache_hit is default.CACHE_MISS:
+            stats.misses += 1
+        else:
+            stats.uncached += 1
+
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+Labels = dict[str, str]
+# (metric family, type, sample line)
+Sample = tuple[str, str, str]
+
+
+def _format_labels(labels: Labels) -> str:
+    return ",".join(
+        '{}="{}"'.format(key, value.replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+
+
+def sample(name: str, labels: Labels, value: float) -> str:
+    return (
+        f"{name}{{{_format_labels(labels)}}} {value}" if labels else f"{name} {value}"
+    )
+
+
+class Histogram:
+    """Cumulative histogram, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def samples(self, name: str, labels: Labels) -> Iterator[Sample]:
+        cumulative = 0
+        for bucket, count in zip(self.buckets, self.counts, strict=False):
+            cumulative += count
+            yield (
+                name,
+                "histogram",
+                sample(f"{name}_bucket", {**labels, "le": str(bucket)}, cumulative),
+            )
+        yield (
+            name,
+            "histogram",
+            sample(f"{name}_bucket", {**labels, "le": "+Inf"}, self.count),
+        )
+        yield name, "histogram", sample(f"{name}_sum", labels, self.sum)
+        yield name, "histogram", sample(f"{name}_count", labels, self.count)
+
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+AGE_BUCKETS = (1, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+
+class PoolMetrics:
+    """
+    Metrics of the connection pool of one engine.
+
+    The number of checked out and overflow connections is read from the pool
+    when rendering; the engine is weakly referenced so disposed tenant engines
+    don't pile up.
+    """
+
+    def __init__(self, engine: Engine, labels: Labels, recycle_seconds: int) -> None:
+        self._engine = weakref.ref(engine)
+        self.labels = labels
+        self.recycle_seconds = recycle_seconds
+        self.checkout_seconds = Histogram(SECONDS_BUCKETS)
+        self.connection_age_seconds = Histogram(AGE_BUCKETS)
+        self.connects = 0
+        self.recycles = 0
+        self.invalidations = 0
+
+    @property
+    def engine(self) -> Engine | None:
+        return self._engine()
+
+    def samples(self, prefix: str) -> Iterator[Sample]:
+        if (engine := self.engine) and isinstance(engine.pool, QueuePool):
+            pool = engine.pool
+            for name, value in (
+                ("pool_size", pool.size()),
+                ("pool_checked_out", pool.checkedout()),
+                ("pool_overflow", max(pool.overflow(), 0)),
+            ):
+                yield (
+                    f"{prefix}_{name}",
+                    "gauge",
+                    sample(f"{prefix}_{name}", self.labels, value),
+                )
+        for name, value in (
+            ("pool_connects_total", self.connects),
+            ("pool_recycles_total", self.recycles),
+            ("pool_invalidations_total", self.invalidations),
+        ):
+            yield (
+                f"{prefix}_{name}",
+                "counter",
+                sample(f"{prefix}_{name}", self.labels, value),
+            )
+        yield from self.checkout_seconds.samples(
+            f"{prefix}_pool_checkout_seconds", self.labels
+        )
+        yield from self.connection_age_seconds.samples(
+            f"{prefix}_pool_connection_age_seconds", self.labels
+        )
+
+
+_pool_metrics: dict[tuple[str, ...], PoolMetrics] = {}
+
+
+class _TimedPoolMixin:
+    """Times `connect()`, i.e. how long a checkout waited for a connection."""
+
+    pool_metrics: PoolMetrics | None = None
+
+    def connect(self) -> PoolProxiedConnection:
+        start = time.perf_counter()
+        try:
+            return super().connect()  # type: ignore[misc, no-any-return]
+        finally:
+            if self.pool_metrics is not None:
+                self.pool_metrics.checkout_seconds.observe(time.perf_counter() - start)
+
+    def recreate(self) -> Self:
+        pool: Self = super().recreate()  # type: ignore[misc]
+        pool.pool_metrics = self.pool_metrics
+        return pool
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument_pool(
+    engine: Engine,
+    *,
+    application_name: str,
+    host: str | None = None,
+    port: int | None = None,
+    recycle_seconds: int = settings.DATABASE_POOL_RECYCLE_SECONDS,
+) -> PoolMetrics:
+    """
+    Records checkout wait times, connection ages, new connections and recycles of
+    the engine pool, labeled by `application_name` (`{env}.{process}.{schema}`)
+    and the server (primary or replica) `host` and `port`.
+
+    Checkout wait times are only available with the `Timed*Pool` pool classes.
+    """
+    labels = {
+        "application_name": application_name,
+        "host": host or settings.POSTGRES_HOST,
+        "port": str(port or settings.POSTGRES_PORT),
+    }
+    metrics = PoolMetrics(engine, labels, recycle_seconds)
+    _pool_metrics[tuple(labels.values())] = metrics
+
+    if isinstance(engine.pool, _TimedPoolMixin):
+        engine.pool.pool_metrics = metrics
+
+    def on_connect(
+        dbapi_connection: DBAPIConnection, connection_record: ConnectionPoolEntry
+    ) -> None:
+        metrics.connects += 1
+
+    def on_checkout(
+        dbapi_connection: DBAPIConnection,
+        connection_record: ConnectionPoolEntry,
+        connection_proxy: PoolProxiedConnection,
+    ) -> None:
+        started_at: float = getattr(connection_record, "starttime", time.time())
+        metrics.connection_age_seconds.observe(time.time() - started_at)
+
+    def on_close(
+        dbapi_connection: DBAPIConnection, connection_record: ConnectionPoolEntry
+    ) -> None:
+        started_at: float | None = getattr(connection_record, "starttime", None)
+        if (
+            started_at is not None
+            and metrics.recycle_seconds >= 0
+            and time.time() - started_at > metrics.recycle_seconds
+        ):
+            metrics.recycles += 1
+
+    def on_invalidate(
+        dbapi_connection: DBAPIConnection,
+        connection_record: ConnectionPoolEntry,
+        exception: BaseException | None,
+    ) -> None:
+        metrics.invalidations += 1
+
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "close", on_close)
+    event.listen(engine, "invalidate", on_invalidate)
+
+    return metrics
+
+
+def render_metrics(extra_samples: Iterable[Sample] = ()) -> str:
+    """All the metrics, in the Prometheus text exposition format."""
+    prefix = f"{settings.app_name}_db"
+    samples: list[Sample] = [
+        (
+            f"{prefix}_statement_cache_hits_total",
+            "counter",
+            sample(
+                f"{prefix}_statement_cache_hits_total", {}, statement_cache_stats.hits
+            ),
+        ),
+        (
+            f"{prefix}_statement_cache_misses_total",
+            "counter",
+            sample(
+                f"{prefix}_statement_cache_misses_total",
+                {},
+                statement_cache_stats.misses,
+            ),
+        ),
+    ]
+    for key, metrics in list(_pool_metrics.items()):
+        if metrics.engine is None:
+            # Disposed and garbage collected, e.g. an evicted tenant engine
+            del _pool_metrics[key]
+            continue
+        samples.extend(metrics.samples(prefix))
+    samples.extend(extra_samples)
+
+    # Samples of a metric family must be grouped under a single TYPE line
+    families: dict[str, tuple[str, list[str]]] = {}
+    for family, metric_type, line in samples:
+        families.setdefault(family, (metric_type, []))[1].append(line)
+
+    lines: list[str] = []
+    for family, (metric_type, family_lines) in families.items():
+        lines.append(f"# TYPE {family} {metric_type}")
+        lines.extend(family_lines)
+    return "\n".join(lines) + "\n"
+
+
+__all__ = [
+    "StatementCacheStats",
+    "statement_cache_stats",
+    "instrument_statement_cache",
+    "Sample",
+    "sample",
+    "Histogram",
+    "PoolMetrics",
+    "TimedQueuePool",
+    "TimedAsyncAdaptedQueuePool",
+    "instrument_pool",
+    "render_metrics",
+]
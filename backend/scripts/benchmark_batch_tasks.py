@@ -0,0 +1,104 @@
+"""
+Compare a batch task with one job per invocation for a small unit of work.
+
+Enqueues the same invocations (by requests of `--per-request` of them) to a task
+incrementing a counter once per job, and to a batch task incrementing it once
+per batch, then runs an in-process burst worker until the queue is empty and
+reports the invocations per second of each.
+
+Requires a running Redis configured through the usual settings:
+
+    poetry run python scripts/benchmark_batch_tasks.py --invocations 1000 10000
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from arq.worker import Worker
+
+from app.infra.core.worker import (
+    BatchItem,
+    JobContext,
+    WorkerSettings,
+    enqueue_job,
+    flush_enqueued_jobs,
+    jobs_to_enqueue_scope,
+    lifespan,
+    task,
+)
+
+QUEUE_NAME = "bench:batch_tasks"
+COUNTER_KEY = "bench:batch_tasks:counter"
+
+
+@task("bench_single")
+async def bench_single(ctx: JobContext, index: int) -> None:
+    await ctx["redis"].incr(COUNTER_KEY)
+
+
+def register_bench_batch(batch_size: int) -> None:
+    @task("bench_batch", batch_size=batch_size, max_wait=0.05)
+    async def bench_batch(ctx: JobContext, items: list[BatchItem]) -> None:
+        await ctx["redis"].incrby(COUNTER_KEY, len(items))
+
+
+async def run(name: str, invocations: int, per_request: int) -> float:
+    async with lifespan() as arq_pool:
+        await arq_pool.delete(QUEUE_NAME, COUNTER_KEY)
+
+        start = time.perf_counter()
+        for first in range(0, invocations, per_request):
+            with jobs_to_enqueue_scope():
+                for index in range(first, min(first + per_request, invocations)):
+                    enqueue_job(name, index, queue_name=QUEUE_NAME)
+                await flush_enqueued_jobs(arq_pool)
+        enqueued = time.perf_counter()
+
+        worker = Worker(
+            [
+                function
+                for function in WorkerSettings.functions
+                if function.name == name
+            ],
+            queue_name=QUEUE_NAME,
+            redis_pool=arq_pool,
+            burst=True,
+            handle_signals=False,
+            poll_delay=0.01,
+            log_results=False,
+            keep_result=0,
+        )
+        await worker.main()
+        elapsed = time.perf_counter() - start
+        counter = int(await arq_pool.get(COUNTER_KEY) or 0)
+
+    print(
+        f"{name:>12} | invocations={invocations:>7} | jobs={worker.jobs_complete:>7} | "
+        f"enqueue {enqueued - start:>7.3f}s | total {elapsed:>7.3f}s | "
+        f"{invocations / elapsed:>9.0f} invocations/s"
+    )
+    assert counter == invocations, f"{counter} != {invocations}"
+    return elapsed
+
+
+async def main(invocations_list: list[int], per_request: int) -> None:
+    for invocations in invocations_list:
+        single = await run("bench_single", invocations, per_request)
+        batch = await run("bench_batch", invocations, per_request)
+        print(f"{'':>12} | speedup x{single / batch:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--invocations", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--per-request", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    register_bench_batch(args.batch_size)
+    asyncio.run(main(args.invocations, args.per_request))
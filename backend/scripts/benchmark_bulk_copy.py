@@ -0,0 +1,115 @@
+"""
+Compare `bulk_copy` with `session.add_all` to insert activity rows.
+
+Creates a throwaway schema holding a `tenant_activities` table (without the
+foreign keys), then inserts the same rows through both paths and reports the
+rows per second of each.
+
+Requires a running Postgres configured through the usual settings:
+
+    poetry run python scripts/benchmark_bulk_copy.py --rows 1000 10000 100000
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import pool, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.data.dbs.postgres.extensions.sqlalchemy import bulk_copy
+from app.data.dbs.postgres.postgres import SessionMakerFactory
+from app.data.models.tenant_activity import TenantActivity
+from app.infra.config import settings
+
+SCHEMA_NAME = "bench_bulk_copy"
+
+
+def make_rows(count: int) -> list[dict[str, Any]]:
+    return [
+        {"data": {"index": index, "tags": ["a", "b"]}, "description": f"row {index}"}
+        for index in range(count)
+    ]
+
+
+async def insert_add_all(session: AsyncSession, rows: list[dict[str, Any]]) -> None:
+    session.add_all(TenantActivity(**row) for row in rows)
+    await session.flush()
+
+
+async def insert_bulk_copy(session: AsyncSession, rows: list[dict[str, Any]]) -> None:
+    await bulk_copy(session, TenantActivity, rows)
+
+
+async def run(
+    sessionmaker: async_sessionmaker[AsyncSession],
+    name: str,
+    insert: Callable[[AsyncSession, list[dict[str, Any]]], Awaitable[None]],
+    rows: list[dict[str, Any]],
+) -> float:
+    async with sessionmaker() as session:
+        await session.execute(text("TRUNCATE tenant_activities"))
+        await session.commit()
+
+        start = time.perf_counter()
+        await insert(session, rows)
+        await session.commit()
+        elapsed = time.perf_counter() - start
+
+    print(
+        f"{name:>9} | rows={len(rows):>7} | {elapsed:>7.3f}s | "
+        f"{len(rows) / elapsed:>9.0f} rows/s"
+    )
+    return elapsed
+
+
+async def main(rows_list: list[int]) -> None:
+    dsn = settings.get_postgres_dsn(None, "asyncpg")
+    admin_engine = create_async_engine(dsn, poolclass=pool.NullPool)
+    async with admin_engine.begin() as conn:
+        await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{SCHEMA_NAME}"'))
+        await conn.execute(
+            text(
+                f'CREATE TABLE IF NOT EXISTS "{SCHEMA_NAME}".tenant_activities ('
+                "id uuid PRIMARY KEY, "
+                "created_at timestamptz NOT NULL, "
+                "modified_at timestamptz, "
+                "deleted_at timestamptz, "
+                "tenant_id uuid, "
+                "action_id uuid, "
+                "data jsonb NOT NULL, "
+                "description varchar(1024))"
+            )
+        )
+
+    engine = create_async_engine(
+        dsn,
+        connect_args={"server_settings": {"search_path": SCHEMA_NAME}},
+        poolclass=pool.NullPool,
+    )
+    sessionmaker = SessionMakerFactory.create_async_sessionmaker(engine)
+    try:
+        for count in rows_list:
+            rows = make_rows(count)
+            add_all = await run(sessionmaker, "add_all", insert_add_all, rows)
+            copy = await run(sessionmaker, "bulk_copy", insert_bulk_copy, rows)
+            print(f"{'':>9} | speedup x{add_all / copy:.1f}")
+    finally:
+        await engine.dispose()
+        async with admin_engine.begin() as conn:
+            await conn.execute(text(f'DROP SCHEMA IF EXISTS "{SCHEMA_NAME}" CASCADE'))
+        await admin_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    asyncio.run(main(args.rows))
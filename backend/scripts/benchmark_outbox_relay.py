@@ -0,0 +1,113 @@
+"""
+Measure the throughput of the worker outbox relay for several batch sizes.
+
+Fills a throwaway copy of the `worker_outbox` table (the special schema being
+translated to a bench schema) with jobs, then relays it to a bench queue with
+`OutboxRelay` until it's empty, and reports the jobs per second of the outbox
+writes and of the relay.
+
+Requires a running Postgres and Redis configured through the usual settings:
+
+    poetry run python scripts/benchmark_outbox_relay.py --jobs 10000 --batch-sizes 100 500 2000
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from arq.constants import job_key_prefix
+from sqlalchemy import Table, pool, text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.data.dbs.postgres.postgres import SessionMakerFactory
+from app.data.models.worker_outbox import WorkerOutbox
+from app.infra.config import settings
+from app.infra.core.outbox import OutboxRelay, add_to_outbox
+from app.infra.core.worker import JobToEnqueue, enqueue_jobs, lifespan
+
+SCHEMA_NAME = "bench_outbox"
+QUEUE_NAME = "bench:outbox"
+
+
+async def fill_outbox(engine: AsyncEngine, count: int) -> list[str]:
+    sessionmaker = SessionMakerFactory.create_async_sessionmaker(engine)
+    jobs: list[JobToEnqueue] = [
+        (
+            "bench_job",
+            (index,),
+            {"_job_id": f"bench_job:{uuid.uuid4().hex}", "_queue_name": QUEUE_NAME},
+            time.perf_counter(),
+        )
+        for index in range(count)
+    ]
+
+    start = time.perf_counter()
+    async with sessionmaker() as session:
+        add_to_outbox(session.sync_session, jobs)
+        await session.commit()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{'write':>12} | jobs={count:>7} | {elapsed:>7.3f}s | "
+        f"{count / elapsed:>9.0f} jobs/s"
+    )
+    return [kwargs["_job_id"] for _, _, kwargs, _ in jobs]
+
+
+async def run(engine: AsyncEngine, count: int, batch_size: int) -> None:
+    job_ids = await fill_outbox(engine, count)
+
+    async with lifespan() as arq_pool:
+        relay = OutboxRelay(
+            SessionMakerFactory.create_async_sessionmaker(engine),
+            arq_pool,
+            enqueue_jobs,
+            batch_size=batch_size,
+        )
+        start = time.perf_counter()
+        batches = 0
+        while await relay.relay():
+            batches += 1
+        elapsed = time.perf_counter() - start
+
+        queued = await arq_pool.zcard(QUEUE_NAME)
+        await arq_pool.delete(
+            QUEUE_NAME, *(job_key_prefix + job_id for job_id in job_ids)
+        )
+
+    print(
+        f"{'relay':>12} | jobs={count:>7} | batch={batch_size:>5} | "
+        f"batches={batches:>5} | {elapsed:>7.3f}s | {count / elapsed:>9.0f} jobs/s"
+    )
+    assert queued == count, f"{queued} != {count}"
+
+
+async def main(count: int, batch_sizes: list[int]) -> None:
+    dsn = settings.get_postgres_dsn(None, "asyncpg")
+    engine = create_async_engine(dsn, poolclass=pool.NullPool).execution_options(
+        schema_translate_map={settings.SPECIAL_SCHEMA: SCHEMA_NAME}
+    )
+    async with engine.begin() as conn:
+        await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{SCHEMA_NAME}"'))
+        table: Table = WorkerOutbox.__table__  # type: ignore[assignment]
+        await conn.run_sync(table.create, checkfirst=True)
+    try:
+        for batch_size in batch_sizes:
+            await run(engine, count, batch_size)
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f'DROP SCHEMA IF EXISTS "{SCHEMA_NAME}" CASCADE'))
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=10000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100, 500, 2000])
+    args = parser.parse_args()
+
+    asyncio.run(main(args.jobs, args.batch_sizes))
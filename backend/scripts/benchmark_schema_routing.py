@@ -0,0 +1,155 @@
+"""
+Compare the tenant schema routing modes (see `SchemaRouting`).
+
+Creates throwaway tenant schemas holding a small table, then runs concurrent
+queries against random tenants through each mode and reports the throughput,
+the peak number of Postgres connections opened by the benchmark and the hit
+ratio of SQLAlchemy's compiled statements cache.
+
+Requires a running Postgres configured through the usual settings:
+
+    poetry run python scripts/benchmark_schema_routing.py --tenants 10 100 1000
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import Column, Integer, MetaData, Table, Text, func, pool, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.infra.config import settings
+from app.infra.core.postgres import create_tenant_engines, get_schema_name
+from app.infra.kit.enums import SchemaRouting
+from app.providers.monitoring.performance import statement_cache_stats
+
+# Schema-less, so it's resolved through `search_path` or `schema_translate_map`
+items = Table(
+    "items",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("name", Text, nullable=False),
+)
+
+
+def bench_schema_name(index: int) -> str:
+    return get_schema_name(f"bench{index}")
+
+
+async def setup_schemas(admin_engine: AsyncEngine, tenants: int) -> None:
+    async with admin_engine.begin() as conn:
+        for index in range(tenants):
+            schema_name = bench_schema_name(index)
+            await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema_name}"'))
+            await conn.execute(
+                text(
+                    f'CREATE TABLE IF NOT EXISTS "{schema_name}".items '
+                    "(id serial PRIMARY KEY, name text NOT NULL)"
+                )
+            )
+            await conn.execute(
+                text(f"INSERT INTO \"{schema_name}\".items (name) VALUES ('item')")
+            )
+
+
+async def drop_schemas(admin_engine: AsyncEngine, tenants: int) -> None:
+    async with admin_engine.begin() as conn:
+        for index in range(tenants):
+            await conn.execute(
+                text(f'DROP SCHEMA IF EXISTS "{bench_schema_name(index)}" CASCADE')
+            )
+
+
+async def count_connections(admin_engine: AsyncEngine) -> int:
+    async with admin_engine.connect() as conn:
+        result = await conn.execute(
+            text(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE application_name LIKE :application_name"
+            ),
+            {"application_name": f"{settings.ENV.value}.script.%"},
+        )
+        return int(result.scalar_one())
+
+
+async def run_mode(
+    admin_engine: AsyncEngine,
+    schema_routing: SchemaRouting,
+    tenants: int,
+    queries: int,
+    concurrency: int,
+) -> None:
+    tenant_engines = create_tenant_engines("script", schema_routing)
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+    peak_connections = 0
+    cache_hits, cache_misses = statement_cache_stats.hits, statement_cache_stats.misses
+
+    async def query() -> None:
+        nonlocal errors
+        schema_name = bench_schema_name(random.randrange(tenants))
+        async with semaphore:
+            try:
+                sessionmaker = await tenant_engines.get_sessionmaker(schema_name)
+                async with sessionmaker() as session:
+                    await session.execute(select(func.count()).select_from(items))
+                    await session.commit()
+            except Exception:
+                errors += 1
+
+    async def sample_connections() -> None:
+        nonlocal peak_connections
+        while True:
+            peak_connections = max(
+                peak_connections, await count_connections(admin_engine)
+            )
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample_connections())
+    start = time.perf_counter()
+    await asyncio.gather(*(query() for _ in range(queries)))
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    await tenant_engines.dispose()
+
+    cache_hits = statement_cache_stats.hits - cache_hits
+    cache_misses = statement_cache_stats.misses - cache_misses
+    print(
+        f"{schema_routing.value:>13} | tenants={tenants:>5} | "
+        f"{queries / elapsed:>8.0f} queries/s | "
+        f"peak connections={peak_connections:>4} | "
+        f"statement cache hits={cache_hits} misses={cache_misses} | errors={errors}"
+    )
+
+
+async def main(tenants_list: list[int], queries: int, concurrency: int) -> None:
+    admin_engine = create_async_engine(
+        settings.get_postgres_dsn(None, "asyncpg"), poolclass=pool.NullPool
+    )
+    try:
+        for tenants in tenants_list:
+            await setup_schemas(admin_engine, tenants)
+            try:
+                for schema_routing in SchemaRouting:
+                    await run_mode(
+                        admin_engine, schema_routing, tenants, queries, concurrency
+                    )
+            finally:
+                await drop_schemas(admin_engine, tenants)
+    finally:
+        await admin_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tenants", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.tenants, args.queries, args.concurrency))
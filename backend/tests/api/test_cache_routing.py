@@ -0,0 +1,87 @@
+from collections.abc import Sequence
+from typing import Annotated
+
+import pytest
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.security import HTTPBearer
+from fastapi.testclient import TestClient
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.api.router.cache_routing import CachedAPIRoute, cache_response
+from app.infra.core.context import TenantContext
+from app.infra.core.response_cache import CachedResponse, ResponseCache
+
+
+class FakeResponseCache(ResponseCache):
+    def __init__(self) -> None:
+        super().__init__()
+        self.entries: dict[str, CachedResponse] = {}
+
+    async def get_versions(
+        self, tenant_id: str, tags: Sequence[str]
+    ) -> tuple[int, ...] | None:
+        return tuple(0 for _ in tags)
+
+    async def get(self, key: str, versions: tuple[int, ...]) -> CachedResponse | None:
+        return self.entries.get(key)
+
+    def put(self, key: str, response: CachedResponse) -> None:
+        self.entries[key] = response
+
+
+class TenantMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        scope.setdefault("state", {})["tenant_context"] = TenantContext("tenant")
+        await self.app(scope, receive, send)
+
+
+def create_app() -> tuple[FastAPI, list[str]]:
+    app = FastAPI()
+    app.add_middleware(TenantMiddleware)
+    calls: list[str] = []
+
+    def authenticate(authorization: Annotated[str | None, Header()] = None) -> str:
+        calls.append("dependency")
+        if authorization is None:
+            raise HTTPException(status_code=401)
+        return authorization
+
+    @cache_response(ttl=60)
+    async def read_me(caller: Annotated[str, Depends(authenticate)]) -> dict[str, str]:
+        calls.append("endpoint")
+        return {"caller": caller}
+
+    app.router.routes.append(CachedAPIRoute("/me", read_me, methods=["GET"]))
+    return app, calls
+
+
+def test_cached_route_solves_dependencies_first(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    cache = FakeResponseCache()
+    monkeypatch.setattr(CachedAPIRoute, "response_cache", cache)
+    app, calls = create_app()
+    client = TestClient(app)
+
+    assert client.get("/me", headers={"authorization": "a"}).json() == {"caller": "a"}
+    assert client.get("/me", headers={"authorization": "a"}).json() == {"caller": "a"}
+    assert calls == ["dependency", "endpoint", "dependency"]
+
+    # The cached response isn't served to an anonymous nor another caller
+    assert client.get("/me").status_code == 401
+    assert client.get("/me", headers={"authorization": "b"}).json() == {"caller": "b"}
+    assert len(cache.entries) == 2
+
+
+def test_authenticated_cached_route_needs_vary() -> None:
+    @cache_response(ttl=60)
+    async def read_me(token: Annotated[object, Depends(HTTPBearer())]) -> None:
+        pass
+
+    with pytest.raises(ValueError):
+        CachedAPIRoute("/me", read_me, methods=["GET"])
+
+    CachedAPIRoute("/me", cache_response(ttl=60, vary=["authorization"])(read_me))
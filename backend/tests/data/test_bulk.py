@@ -0,0 +1,60 @@
+from typing import Any
+
+import pytest
+from sqlalchemy import DateTime, Integer, String, func
+from sqlalchemy.dialects.postgresql.base import PGDialect
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy.sql import ClauseElement
+
+from app.data.dbs.postgres.extensions.sqlalchemy.bulk import bulk_upsert
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Item(Base):
+    __tablename__ = "items"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String, unique=True)
+    value: Mapped[str] = mapped_column(String)
+    version: Mapped[int] = mapped_column(Integer, default=0, onupdate=1)
+    label: Mapped[str] = mapped_column(String, default="", onupdate=lambda: "updated")
+    touched_at: Mapped[Any] = mapped_column(DateTime, onupdate=func.now())
+
+
+class FakeResult:
+    def all(self) -> list[Item]:
+        return []
+
+
+class FakeSession:
+    def __init__(self) -> None:
+        self.statements: list[ClauseElement] = []
+
+    async def scalars(self, statement: ClauseElement, **kwargs: Any) -> FakeResult:
+        self.statements.append(statement)
+        return FakeResult()
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert_onupdate_columns() -> None:
+    session = FakeSession()
+    await bulk_upsert(
+        session,  # type: ignore[arg-type]
+        Item,
+        [{"id": 1, "name": "a", "value": "x"}],
+        index_elements=["name"],
+    )
+
+    (statement,) = session.statements
+    compiled = statement.compile(dialect=PGDialect())  # type: ignore[no-untyped-call]
+    set_clause = str(compiled).split("DO UPDATE SET", 1)[1]
+    assert "value = excluded.value" in set_clause
+    # Scalar and callable `onupdate` are bound, SQL expressions rendered inline
+    assert "version = %(param_1)s" in set_clause
+    assert "label = %(param_2)s" in set_clause
+    assert "touched_at = now()" in set_clause
+    assert compiled.params["param_1"] == 1
+    assert compiled.params["param_2"] == "updated"
@@ -0,0 +1,81 @@
+from typing import Any, cast
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import PlainTextResponse
+from starlette.types import Receive, Scope, Send
+
+from app.infra.core.context import TenantContext
+from app.infra.core.cors import TenantCORSConfigs, get_tenant_cors_config
+from app.infra.kit.cors import CORSConfig, CORSMatcherMiddleware
+
+
+class FakeTenantCORSConfigs(TenantCORSConfigs):
+    def __init__(self) -> None:
+        super().__init__(engines=cast(Any, object()))
+        self.loads: list[str] = []
+
+    async def _load(self, tenant_id: str) -> tuple[CORSConfig, ...] | None:
+        self.loads.append(tenant_id)
+        data = {"allow_origins": [f"https://{tenant_id}.com"], "allow_methods": ["*"]}
+        return (get_tenant_cors_config(data),)
+
+
+async def app(scope: Scope, receive: Receive, send: Send) -> None:
+    await PlainTextResponse("OK")(scope, receive, send)
+
+
+def create_client(tenant_configs: TenantCORSConfigs) -> TestClient:
+    middleware = CORSMatcherMiddleware(app, configs={}, tenant_configs=tenant_configs)
+
+    async def tenant_app(scope: Scope, receive: Receive, send: Send) -> None:
+        tenant_id = dict(scope["headers"]).get(b"x-tenant", b"").decode()
+        scope.setdefault("state", {})["tenant_context"] = TenantContext(tenant_id)
+        await middleware(scope, receive, send)
+
+    return TestClient(tenant_app)
+
+
+def preflight(client: TestClient, tenant_id: str) -> str | None:
+    response = client.options(
+        "/",
+        headers={
+            "x-tenant": tenant_id,
+            "origin": f"https://{tenant_id}.com",
+            "access-control-request-method": "GET",
+        },
+    )
+    assert response.status_code == 200
+    origin: str | None = response.headers.get("access-control-allow-origin")
+    return origin
+
+
+def test_tenant_change_only_outdates_its_own_decisions(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    preflights: list[str] = []
+    preflight_response = CORSMiddleware.preflight_response
+
+    def counted_preflight_response(self: CORSMiddleware, **kwargs: Any) -> Any:
+        preflights.append(kwargs["request_headers"]["x-tenant"])
+        return preflight_response(self, **kwargs)
+
+    monkeypatch.setattr(
+        CORSMiddleware, "preflight_response", counted_preflight_response
+    )
+    tenant_configs = FakeTenantCORSConfigs()
+    client = create_client(tenant_configs)
+
+    assert preflight(client, "a") == "https://a.com"
+    assert preflight(client, "b") == "https://b.com"
+    tenant_configs.invalidate("b")
+    assert preflight(client, "a") == "https://a.com"
+    assert preflight(client, "b") == "https://b.com"
+    assert tenant_configs.loads == ["a", "b", "b"]
+    assert preflights == ["a", "b", "b"]
+
+    tenant_configs.invalidate()
+    assert preflight(client, "a") == "https://a.com"
+    assert tenant_configs.loads == ["a", "b", "b", "a"]
+    assert preflights == ["a", "b", "b", "a"]
@@ -0,0 +1,21 @@
+from datetime import UTC, datetime
+from typing import Any
+from uuid import uuid4
+
+from app.infra.core.job_serializer import msgpack_deserializer, msgpack_serializer
+
+
+def test_msgpack_roundtrip_keeps_tuples() -> None:
+    payload: dict[str, Any] = {
+        "t": "send_email",
+        "a": ((1, "a"), [(uuid4(), None)], ()),
+        "k": {"sent_at": datetime.now(UTC), "pair": (1, (2, 3))},
+    }
+
+    decoded = msgpack_deserializer(msgpack_serializer(payload))
+
+    assert decoded == payload
+    assert type(decoded["a"]) is tuple
+    assert type(decoded["a"][1]) is list
+    assert type(decoded["a"][1][0]) is tuple
+    assert type(decoded["k"]["pair"][1]) is tuple
@@ -0,0 +1,44 @@
+import os
+import signal
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.infra.core.process_pool import ProcessPool
+
+
+def double(x: int) -> int:
+    return x * 2
+
+
+def crash() -> None:
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def sleep(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_pool_is_restarted_after_a_process_crashed() -> None:
+    pool = ProcessPool(size=1)
+    await pool.start()
+    try:
+        with pytest.raises(BrokenProcessPool):
+            await pool.run(crash, (), {})
+        assert await pool.run(double, (2,), {}) == 4
+    finally:
+        await pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_task_timing_out_is_interrupted_in_its_process() -> None:
+    pool = ProcessPool(size=1)
+    await pool.start()
+    try:
+        with pytest.raises(TimeoutError):
+            await pool.run(sleep, (10,), {}, timeout=0.1)
+        assert await pool.run(double, (2,), {}) == 4
+    finally:
+        await pool.shutdown()
@@ -0,0 +1,28 @@
+from collections.abc import Collection, Mapping
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+from app.infra.core import response_cache as response_cache_module
+from app.infra.core.context import TenantContext
+
+
+def test_commit_invalidates_the_copied_tables(monkeypatch: pytest.MonkeyPatch) -> None:
+    invalidated: list[Mapping[str, Collection[str]]] = []
+
+    def invalidate_soon(changes: Mapping[str, Collection[str]]) -> bool:
+        invalidated.append(changes)
+        return True
+
+    monkeypatch.setattr(
+        response_cache_module.response_cache, "invalidate_soon", invalidate_soon
+    )
+    # As left by `bulk_copy`
+    session: Any = SimpleNamespace(info={"copied_tables": {"items"}})
+
+    with TenantContext(tenant_id="tenant"):
+        response_cache_module._invalidate_response_cache(session)
+
+    assert invalidated == [{"tenant": {"items"}}]
+    assert session.info == {}
@@ -0,0 +1,30 @@
+from typing import Any, cast
+
+import pytest
+from arq.connections import ArqRedis
+
+from app.infra.core.tenant_queues import TenantQueueScheduler
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.script_calls: list[dict[str, Any]] = []
+
+    def register_script(self, script: str) -> Any:
+        async def call(**kwargs: Any) -> int:
+            self.script_calls.append(kwargs)
+            return 0
+
+        return call
+
+    async def smembers(self, key: str) -> set[bytes]:
+        return set()
+
+
+@pytest.mark.asyncio
+async def test_dispatch_without_tenant_queues_skips_the_worker_queue() -> None:
+    redis = FakeRedis()
+    scheduler = TenantQueueScheduler(cast(ArqRedis, redis))
+
+    assert await scheduler.dispatch() == 0
+    assert redis.script_calls == []
@@ -0,0 +1,53 @@
+import asyncio
+from typing import Any, cast
+
+import pytest
+
+from app.infra.core.redis import Redis
+from app.infra.core.tenant_resolution import TenantKey, TenantResolver
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.values: dict[str, str] = {}
+
+    async def get(self, key: str) -> str | None:
+        return self.values.get(key)
+
+    async def set(self, key: str, value: str, **kwargs: Any) -> None:
+        self.values[key] = value
+
+
+class GatedTenantResolver(TenantResolver):
+    def __init__(self, redis: FakeRedis) -> None:
+        super().__init__(cast(Redis, redis), engines=cast(Any, object()))
+        self.tenant_id: str | None = "tenant"
+        self.loads = 0
+        self.gate = asyncio.Event()
+
+    async def _load(self, key: TenantKey) -> str | None:
+        self.loads += 1
+        tenant_id = self.tenant_id
+        await self.gate.wait()
+        return tenant_id
+
+
+@pytest.mark.asyncio
+async def test_lookup_outdated_by_an_invalidation_is_not_cached() -> None:
+    redis = FakeRedis()
+    resolver = GatedTenantResolver(redis)
+
+    resolution = asyncio.ensure_future(resolver.resolve(("slug", "acme")))
+    while not resolver.loads:
+        await asyncio.sleep(0)
+    # The tenant is suspended while its lookup is running
+    resolver.tenant_id = None
+    resolver.invalidate(("slug", "acme"))
+    resolver.gate.set()
+
+    assert await resolution == "tenant"
+    assert redis.values == {}
+    assert await resolver.resolve(("slug", "acme")) is None
+    assert resolver.loads == 2
+    assert await resolver.resolve(("slug", "acme")) is None
+    assert resolver.loads == 2
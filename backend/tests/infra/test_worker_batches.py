@@ -0,0 +1,141 @@
+import pickle
+from collections.abc import Callable
+from typing import Any
+
+import pytest
+from arq import Retry
+
+from app.infra.core.worker import (
+    BATCH_RETRY_DELAY_SECONDS,
+    CLAIM_BATCH_SCRIPT,
+    BatchItem,
+    _batch_drain,
+)
+
+
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis") -> None:
+        self.redis = redis
+        self.commands: list[Callable[[], object]] = []
+
+    async def __aenter__(self) -> "FakePipeline":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+    def rpush(self, key: str, *values: bytes) -> None:
+        self.commands.append(lambda: self.redis.rpush(key, *values))
+
+    def lpush(self, key: str, *values: bytes) -> None:
+        self.commands.append(lambda: self.redis.lpush(key, *values))
+
+    def delete(self, key: str) -> None:
+        self.commands.append(lambda: self.redis.lists.pop(key, None))
+
+    async def execute(self) -> None:
+        for command in self.commands:
+            command()
+
+
+class FakeRedis:
+    expires_extra_ms = 86_400_000
+
+    def __init__(self, lists: dict[str, list[bytes]]) -> None:
+        self.lists = lists
+
+    def rpush(self, key: str, *values: bytes) -> None:
+        self.lists.setdefault(key, []).extend(values)
+
+    def lpush(self, key: str, *values: bytes) -> None:
+        for value in values:
+            self.lists.setdefault(key, []).insert(0, value)
+
+    def register_script(self, script: str) -> Any:
+        assert script == CLAIM_BATCH_SCRIPT
+
+        async def claim_batch(keys: list[str], args: list[Any]) -> list[bytes]:
+            batch_key, processing_key = keys
+            if items := self.lists.get(processing_key):
+                return list(items)
+            batch = self.lists.get(batch_key, [])
+            items, self.lists[batch_key] = batch[: args[0]], batch[args[0] :]
+            if items:
+                self.rpush(processing_key, *items)
+            return items
+
+        return claim_batch
+
+    def pipeline(self, transaction: bool) -> FakePipeline:
+        assert transaction
+        return FakePipeline(self)
+
+    async def delete(self, key: str) -> None:
+        self.lists.pop(key, None)
+
+
+def create_items(count: int) -> list[bytes]:
+    return [pickle.dumps(((index,), {})) for index in range(count)]
+
+
+def create_task(
+    failures: int,
+) -> tuple[Callable[..., Any], list[list[tuple[Any, ...]]]]:
+    handled: list[list[tuple[Any, ...]]] = []
+    errors = [ValueError("Database unavailable")] * failures
+
+    async def handle(ctx: dict[str, Any], items: list[BatchItem]) -> None:
+        if errors:
+            raise errors.pop()
+        handled.append([item.args for item in items])
+
+    return handle, handled
+
+
+@pytest.mark.asyncio
+async def test_batch_drain_retries_a_failed_batch() -> None:
+    handle, handled = create_task(failures=1)
+    redis = FakeRedis({"batch": create_items(3)})
+    drain = _batch_drain(handle, 10, max_tries=3)
+    ctx = {"redis": redis, "job_id": "drain", "job_try": 1}
+
+    # The batch is kept for the next try, and arq told to run the job again
+    with pytest.raises(Retry) as exc_info:
+        await drain(ctx, batch_key="batch")
+    assert exc_info.value.defer_score == BATCH_RETRY_DELAY_SECONDS * 1000
+    assert redis.lists["batch:processing:drain"] == create_items(3)
+    assert handled == []
+
+    assert await drain(ctx | {"job_try": 2}, batch_key="batch") == 3
+    assert handled == [[(0,), (1,), (2,)]]
+    assert redis.lists == {"batch": []}
+
+
+@pytest.mark.asyncio
+async def test_batch_drain_dead_letters_a_batch_on_its_last_try() -> None:
+    handle, handled = create_task(failures=1)
+    redis = FakeRedis({"batch": create_items(3)})
+    drain = _batch_drain(handle, 2, max_tries=3)
+
+    with pytest.raises(ValueError):
+        await drain({"redis": redis, "job_id": "a", "job_try": 3}, batch_key="batch")
+    assert redis.lists == {"batch": create_items(3)[2:], "batch:dead": create_items(2)}
+
+    # The next items are not held up by the failed batch
+    assert await drain({"redis": redis, "job_id": "b", "job_try": 1}, batch_key="batch")
+    assert handled == [[(2,)]]
+
+
+@pytest.mark.asyncio
+async def test_batch_drain_takes_the_batch_of_a_killed_try_first() -> None:
+    handle, handled = create_task(failures=0)
+    # Claimed by a worker which died before the task returned
+    redis = FakeRedis(
+        {"batch": create_items(3)[2:], "batch:processing:drain": create_items(2)}
+    )
+    drain = _batch_drain(handle, 2, max_tries=3)
+
+    ctx = {"redis": redis, "job_id": "drain", "job_try": 2}
+    assert await drain(ctx, batch_key="batch") == 3
+    assert handled == [[(0,), (1,)], [(2,)]]
+    assert redis.lists == {"batch": []}
@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app.infra.core.worker import JobDedupe, _job_dedupes, get_dedupe_key
+
+DEDUPE_KEY_CODE = """
+from app.infra.core.worker import JobDedupe, _job_dedupes, get_dedupe_key
+
+_job_dedupes["send"] = JobDedupe()
+print(get_dedupe_key("send", "acme", ({"a", "b", "c", "d"},), {"to": frozenset("xyz")}))
+"""
+
+
+def get_dedupe_key_in_process(hash_seed: int) -> str:
+    return subprocess.run(
+        [sys.executable, "-c", DEDUPE_KEY_CODE],
+        env={**os.environ, "PYTHONHASHSEED": str(hash_seed)},
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+
+
+def test_dedupe_key_is_the_same_in_every_process() -> None:
+    keys = {get_dedupe_key_in_process(hash_seed) for hash_seed in range(8)}
+
+    assert len(keys) == 1
+
+
+def test_dedupe_key_identifies_the_arguments(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setitem(_job_dedupes, "send", JobDedupe())
+
+    key = get_dedupe_key("send", "acme", (1, [2, 3]), {"a": 1, "b": {"c": 2, "d": 3}})
+
+    assert key == get_dedupe_key(
+        "send", "acme", (1, [2, 3]), {"b": {"d": 3, "c": 2}, "a": 1}
+    )
+    assert key != get_dedupe_key("send", "acme", (1, [3, 2]), {"a": 1, "b": {}})
+    assert key != get_dedupe_key("send", "other", (1, [2, 3]), {"a": 1, "b": {}})